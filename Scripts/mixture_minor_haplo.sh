@@ -32,3 +32,10 @@ python ${STR_SCRIPT_DIR}/pstr_merge_str_snv.py ${fprefix_mixture}_R1.STRln_detai
 
 # Haplotyping of minor component in mixture (output: ${fprefix_mixture}_R1.STR_SNV.minor_haplotypes.txt)
 python ${STR_SCRIPT_DIR}/pstr_minor_haplotypes.py ${fprefix_mixture}_R1.STR_SNV.summary.txt ${fprefix_minor}_R1.STR_SNV.final.txt
+# To screen several candidate contributors against the mixture in one run, list their STR_SNV.final files (or @file_list);
+#   writes ${fprefix_mixture}_R1.<contributor>.STR_SNV.minor_haplotypes.txt per contributor, and contributors ranked by
+#   fraction of haplotypes found in mixture to ${fprefix_mixture}_R1.STR_SNV.minor_screen.txt
+# SNV positions of all candidate contributors can be extracted from the mixture R2 bam in one pass, with a variant list
+#   file (one <contributor> <snv_coords file> per line, tab-delimited); SNV_detail then has a sources column:
+#     python ${STR_SCRIPT_DIR}/pstr_extract_R2snv.py $mixture_r2_bam @contributor_snv_coords.txt all
+#   and merge/screen are each run once, as above, with the contributors' STR_SNV.final files
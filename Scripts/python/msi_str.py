@@ -1,11 +1,58 @@
 #!/usr/bin/env python
-import sys, os, subprocess, re, string, itertools
+import sys, os, subprocess, re, string, itertools, operator, csv, json, gzip, zipfile, StringIO, glob, hashlib, time, signal, resource
+import threading, Queue, runpy
 import numpy as np
 
 FLANK_SIZE = int(os.getenv('FLANK_SIZE', 15))
 MAX_FLANK_MISMATCH = 2
+FLANK_MISMATCH = min(int(os.getenv('STR_FLANK_MISMATCH', 0)), MAX_FLANK_MISMATCH)
 ALLELE2_MIN_PCT = 0.5
-THRESHOLD_VALS = [0.45, 0.35, 0.15, 0.02]
+THRESHOLD_VALS = [float(tval) for tval in os.getenv('STR_THRESHOLD_VALS', '0.45,0.35,0.15,0.02').split(',')]
+MINOR_BASE_MIN = float(os.getenv('STR_MINOR_BASE_MIN', 0.15))
+NR_PROCS = int(os.getenv('STR_NR_PROCS', 1))
+MATE_WINDOW = int(os.getenv('STR_MATE_WINDOW', 2000))
+REGION_FILE = os.getenv('STR_REGION_FILE', '')
+REGION_PAD  = int(os.getenv('STR_REGION_PAD', 500))
+FETCH_UNMAPPED = os.getenv('STR_FETCH_UNMAPPED', 'N') == 'Y'
+BAM_THREADS = int(os.getenv('STR_BAM_THREADS', 1))
+BAM_OPEN_ARGS = {'threads': BAM_THREADS} if BAM_THREADS > 1 else {}
+READ_BATCH  = max(1, int(os.getenv('STR_READ_BATCH', 1000)))
+QUEUE_DEPTH = int(os.getenv('STR_QUEUE_DEPTH', 0))
+TABLE_FORMAT = os.getenv('STR_TABLE_FORMAT', 'tsv')
+TABLE_CHUNK_ROWS = 100000
+DETAIL_LEVEL = os.getenv('STR_DETAIL_LEVEL', 'full')
+DETAIL_COMPRESS = os.getenv('STR_DETAIL_COMPRESS', '')
+DETAIL_BUFFER_ROWS = 10000
+RESOURCE_CACHE = {}
+POOL_CACHE_VERSION = 1
+GENOTYPE_STORE_VERSION = 1
+MANIFEST_VERSION = 1
+COHORT_VERSION = 3
+LOG_LEVELS = {'info': 1, 'debug': 2}
+LOG_LEVEL  = LOG_LEVELS.get(os.getenv('STR_LOG_LEVEL', 'info'), 1)
+WRITE_METRICS = os.getenv('STR_METRICS', 'N') == 'Y'
+PROFILE_MS = float(os.getenv('STR_PROFILE_MS', 0))
+METRICS = {'stage': None, 'start_time': None, 'phase': None, 'phase_start': None, 'phases': [], 'counters': {}, 'profile': {}}
+METRICS_LOCK = threading.Lock()
+
+R1DTL_HDGS = ['str_name', 'motif', 'probe_nr', 'strand', 'qname', 'chrom', 'pos', 'cigar', 'rlen', 'motif_start', 'motif_cnt',
+              'str_len', 'str_sequence', 'bases_5pr', 'bases_3pr', 'trunc_flag', 'seq', 'mapq', 'qqual']
+# STRln_detail columns used by pstr_merge_str_snv.py (slim detail level), and columns written for each STR_DETAIL_LEVEL
+R1DTL_KEY_HDGS  = ['qname', 'probe_nr', 'str_name', 'strand', 'bases_5pr', 'bases_3pr', 'motif_cnt']
+R1DTL_OUT_HDGS  = {'full': R1DTL_HDGS, 'slim': R1DTL_KEY_HDGS, 'none': []}.get(DETAIL_LEVEL, R1DTL_HDGS)
+STR_SUMM_HDGS = ['STR Name', 'Strand', 'Motif', 'Min Rpts', 'Probe Rds', '5pr Flank', '3pr Flank', 'STR Len', 'Motif#', 'STR Rds']
+PROBE_CT_HDGS = ['probe_nr', 'chromosome', 'probe_start_pos', 'str_name', 'strand', 'probe_reads', 'motif_reads', 'full_str_rds']
+SNV_DTL_HDGS  = ['qname', 'probe_nr', 'ref_chr', 'snv_pos', 'snv_base', 'ref/alt']
+# SNV_detail columns for several variant sources (pstr_extract_R2snv.py @variant_list): sources with SNV position/base
+SNV_SRC_DTL_HDGS = SNV_DTL_HDGS + ['sources']
+# Binary table column types (int, text or cat); columns not listed are cat (dictionary encoded)
+R1DTL_TYPES   = {'probe_nr': 'int', 'qname': 'text', 'pos': 'int', 'rlen': 'int', 'motif_start': 'int', 'str_len': 'int', 
+                 'str_sequence': 'text', 'seq': 'text', 'mapq': 'int', 'qqual': 'text'}
+SNV_DTL_TYPES = {'qname': 'text', 'probe_nr': 'int', 'snv_pos': 'int'}
+STR_SNV_HDGS  = ['probe_nr', 'str_name', 'strand', 'bases_5pr', 'bases_3pr', 'motif_cnt', 'str_ct', 'ref_chr', 'snv_pos', 'snv_base', 'snv_ct']
+STRLN_FINAL_HDGS   = ['STR Name', 'Motif', 'Min Rpts', 'Probe Rds', '5pr Flank', '3pr Flank', 'STR TotRds', 'Motif Ct', 'STR Rds', 'Allele(s)']
+STR_SNV_FINAL_HDGS = ['STR name', 'Motif', 'Min Rpts', 'Probe Rds', 'Rds w/motif', 'Flank-5pr', 'Flank-3pr', 'Full STR Rds', 'Ref Chr', 'SNV Pos',
+                      'SNV Allele', 'SNV Reads', 'Motif Rpts', 'Motif Rpt Rds', 'STR Allele(s)']
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Define reusable modules to be imported/called from STR scripts              #
@@ -19,6 +66,14 @@ def open_file(fname, rw):
     print "Unable to open {0} file: {1}".format(input_output, fname)
     sys.exit(1)
 
+def write_json_atomic(json_fn, json_values):
+  # Written to temporary file and renamed, so that an interrupted write does not leave a partial file (eg manifest)
+  tmp_fn = '{0}.{1}.tmp'.format(json_fn, os.getpid())
+  json_output = open_file(tmp_fn, 'w')
+  json.dump(json_values, json_output, indent=1, sort_keys=True)
+  json_output.close()
+  os.rename(tmp_fn, json_fn)
+
 def dict_from_csv(csv_in, ftype):
   cdict = {}
   if ftype == 'str_info':
@@ -44,6 +99,22 @@ def dict_from_csv(csv_in, ftype):
     raise ValueError('Invalid file type for dict_from_csv method', ftype)
   return cdict
 
+def dict_from_file(fname, ftype):
+  # dict_from_csv for tab-delimited file.  Dicts are cached by file name/type, so pool resources (str_info,
+  #   probe_info) are parsed once per process (or preloaded before forking, see str_batch_genotype.py)
+  #   Returns a copy of the cached dict, since scripts update str_info/probe_info values
+  #   str_info/probe_info are built from pool resource cache (<pool>.pool_cache.npz) if it exists and is up to date
+  cache_key = (os.path.abspath(fname), ftype)
+  if cache_key not in RESOURCE_CACHE and ftype in ['str_info', 'probe_info']:
+    pool_cache = load_pool_cache(fname)
+    if pool_cache and pool_cache['files'].get(ftype) == os.path.abspath(fname):
+      RESOURCE_CACHE[cache_key] = pool_cache_dict(pool_cache, ftype)
+  if cache_key not in RESOURCE_CACHE:
+    dict_input = open_file(fname, 'r')
+    RESOURCE_CACHE[cache_key] = dict_from_csv(csv.DictReader(dict_input, delimiter='\t', quoting=csv.QUOTE_NONE), ftype)
+    dict_input.close()
+  return dict((ckey, dict(cvalues)) for (ckey, cvalues) in RESOURCE_CACHE[cache_key].items())
+
 def increment_dict_ct(dict, dkey):
   if dkey in dict.keys():
     dict[dkey] += 1
@@ -56,18 +127,25 @@ def flank_seq(flankseq, pr5or3):
   else:
     return flankseq[0:FLANK_SIZE]
 
-def motif_search(seq, rlen, motif, min_repeat):
-  multi_motif  = ''.join([motif]*min_repeat)
-  motif_length = len(motif)
+def motif_run(seq, probe_rec):
+  # First maximal run of at least min_repeat consecutive motifs in seq: (motif_idx, motif_cnt), or (-1, 0) if none
+  # Leftmost occurrence of min_repeat motifs (multi_motif) is the start of the run, which is then extended by
+  #   matching motif repeats from that position only (precompiled motif_regex, anchored), so seq is scanned once
+  motif_idx = seq.find(probe_rec['multi_motif'])
+  if motif_idx < 0:
+    return (-1, 0)
+  count('motif_runs')
+  run_end = probe_rec['motif_regex'].match(seq, motif_idx).end()
+  return (motif_idx, (run_end - motif_idx) / probe_rec['motif_len'])
+
+def motif_search(seq, rlen, probe_rec):
+  # Search for at least min_repeat consecutive motifs (motif_run), and check for truncation of STR flanks
+  motif_length = probe_rec['motif_len']
   str_values   = {'motif_cnt': 0}
   
-  if seq.find(multi_motif) >= 0:
-    # For a motif 'GATA' and min repeat of 3, regex string will be: r'((GATA){3,})'
-    regex_string = r'((%s){%d,})' % (motif, min_repeat)
-    motif_match = re.search(regex_string, seq)
-    matched_string = motif_match.group(1)
-    motif_idx   = seq.find(matched_string) #Get starting position of matched string
-    motif_cnt   = len(matched_string) / motif_length #Calculate number of repeats for motif
+  (motif_idx, motif_cnt) = motif_run(seq, probe_rec)
+  if motif_cnt > 0:
+    matched_string = seq[motif_idx:motif_idx + motif_cnt * motif_length]
 
     # Check for possible truncation of STR at beginning(5') or end(3') of read
     flanking_5pr_start = max(0, motif_idx - FLANK_SIZE)
@@ -93,6 +171,1562 @@ def motif_search(seq, rlen, motif, min_repeat):
                   'f3pr_beg': flanking_3pr_start, 'f3pr_end': flanking_3pr_end, 'trunc_flag': trunc_flag}
   return str_values 
 
+def flank_matchers(str_info):
+  # Build precompiled flank/STR matchers for each STR, once at startup, rather than building and
+  #   compiling regex strings for every read.  Flanking sequences must already be arrays (ref + alt flanks)
+  matchers = {}
+  for str_name, str_vals in str_info.items():
+    multi_motif = str_vals['str_motif'] * str_vals['min_repeats']
+    matchers[str_name] = flank_matcher(str_vals['flanking_5pr'], str_vals['flanking_3pr'], multi_motif)
+  return matchers
+
+def flank_matcher(flanks_5pr, flanks_3pr, multi_motif):
+  # For flanks ['AAC','ATC'], ['GGT'] and multi_motif 'CACACA', matcher will contain:
+  #   any_flank: r'(?:AAC|ATC)(.*CACACA.*)(?:GGT)'  (true if any 5'/3' flank pair matches)
+  #   flank_pairs: [('AAC','GGT',r'AAC(.*CACACA.*)GGT'), ('ATC','GGT',r'ATC(.*CACACA.*)GGT')]
+  #   flanks: (['AAC','ATC'], ['GGT']), for approximate matching (flank_approx_search)
+  #   flank_seeds: (5pr, 3pr) flank seeds, eg. FLANK_MISMATCH 1: [('A',0),('AC',1),('TC',1)], [('G',0),('GT',1)]
+  # Flank pairs are kept in the same order they were previously tested in, so that the first
+  #   matching pair (and therefore the reported 5'/3' bases) is unchanged
+  # **NOTE**: The original nested loop advanced the 5pr flank once more before breaking out, so the 5pr
+  #   flank reported for a match is the next 5pr flank in the array (if any). This is retained here so
+  #   that bases_5pr output does not change.
+  any_regex   = r'(?:%s)(.*%s.*)(?:%s)' % ('|'.join(flanks_5pr), multi_motif, '|'.join(flanks_3pr))
+  last_5pr    = len(flanks_5pr) - 1
+  flank_pairs = [(flanks_5pr[min(i+1, last_5pr)], flanking_3pr, re.compile(flanking_5pr + r'(.*' + multi_motif + r'.*)' + flanking_3pr))
+                   for i, flanking_5pr in enumerate(flanks_5pr) for flanking_3pr in flanks_3pr]
+  return {'multi_motif': multi_motif, 'any_flank': re.compile(any_regex), 'flank_pairs': flank_pairs, 'flanks': (flanks_5pr, flanks_3pr),
+          'flank_seeds': (flank_seeds(flanks_5pr), flank_seeds(flanks_3pr))}
+
+def flank_seeds(flanks):
+  # Each flank split into FLANK_MISMATCH + 1 (non-overlapping) seeds, as (seed, index in flank); a read sequence matching
+  #   a flank with at most FLANK_MISMATCH mismatches contains at least one of the flank's seeds exactly, at its index
+  nr_seeds = FLANK_MISMATCH + 1
+  return sorted(set((flank[len(flank) * i // nr_seeds:len(flank) * (i+1) // nr_seeds], len(flank) * i // nr_seeds)
+                    for flank in flanks for i in range(nr_seeds)))
+
+def flank_search(matcher, seq):
+  # Returns (STR sequence, 5pr flank, 3pr flank) for first flank pair found in seq, or None if no match
+  # If no exact match and STR_FLANK_MISMATCH > 0, flanks are matched allowing mismatches (flank_approx_search)
+  if seq.find(matcher['multi_motif']) < 0:
+    return None
+
+  # Number of regex searches is counted (flank_regex_searches metrics counter)
+  flank_pairs = matcher['flank_pairs']
+  if len(flank_pairs) > 1:
+    count('flank_regex_searches')
+    if not matcher['any_flank'].search(seq):
+      return flank_approx_search(matcher, seq) if FLANK_MISMATCH > 0 else None
+
+  for pair_nr, (flanking_5pr, flanking_3pr, flank_regex) in enumerate(flank_pairs):
+    flanking_match = flank_regex.search(seq)
+    if flanking_match:
+      count('flank_regex_searches', pair_nr + 1)
+      return (flanking_match.group(1), flanking_5pr, flanking_3pr)
+  count('flank_regex_searches', len(flank_pairs))
+  return flank_approx_search(matcher, seq) if FLANK_MISMATCH > 0 else None
+
+def flank_offsets(seq, seeds, flank_len):
+  # Offsets in seq at which a flank can match with at most FLANK_MISMATCH mismatches (a flank seed found at its index in
+  #   flank), in increasing order; flank mismatches are only computed at these offsets, not at every offset
+  # Eg. seq 'AACCACACAGGT', flank 'AAC', FLANK_MISMATCH 1 (seeds [('A',0),('AC',1)]): [0, 1, 3, 4, 5, 6, 8]
+  last_offset = len(seq) - flank_len
+  offsets = set()
+  for (seed, seed_idx) in seeds:
+    seq_idx = seq.find(seed, seed_idx)
+    while 0 <= seq_idx <= last_offset + seed_idx:
+      offsets.add(seq_idx - seed_idx)
+      seq_idx = seq.find(seed, seq_idx + 1)
+  return sorted(offsets)
+
+def flank_mismatches(seq, flanks, offsets):
+  # Hamming distance of flank at each offset in read: minimum over flanks (ref + alt)
+  # Eg. seq 'AACCACACAGGT', flanks ['AAC'], offsets [0, 1, 3, 4, 5, 6, 8]: [0, 1, 1, 2, 1, 2, 2]
+  # Few offsets per read (flank_offsets), so bases are compared in python rather than with numpy arrays
+  flank_len = len(flanks[0])
+  return [min(map(operator.ne, seq[offset:offset + flank_len], flank).count(True) for flank in flanks) for offset in offsets]
+
+def best_offset(flank_mism, offsets):
+  # Offset with fewest flank mismatches, if at most FLANK_MISMATCH and unique, otherwise None
+  # All offsets with at most FLANK_MISMATCH mismatches are in offsets (flank_offsets), so the best offset and ties are
+  #   the same as if mismatches were computed at every offset
+  if len(flank_mism) == 0:
+    return None
+  best_mism = min(flank_mism)
+  if best_mism > FLANK_MISMATCH or flank_mism.count(best_mism) > 1:
+    return None
+  return offsets[flank_mism.index(best_mism)]
+
+def flank_approx_search(matcher, seq):
+  # Match 5pr and 3pr flanks with up to FLANK_MISMATCH mismatches each, around the STR motif
+  # Best (fewest mismatches) 5pr and 3pr offsets are used.  Flanks are often repetitive, so a flank shifted by the
+  #   repeat period can match with the same number of mismatches; reads with tied best offsets are not used
+  # 5pr/3pr flanks returned are the read bases
+  # Returns (STR sequence, 5pr bases, 3pr bases), or None if either flank is not found
+  multi_motif = matcher['multi_motif']
+  (flanks_5pr, flanks_3pr) = matcher['flanks']
+  (seeds_5pr, seeds_3pr) = matcher['flank_seeds']
+  # Reads without any 3pr flank offset after motif repeats (eg. 3pr flank past end of read) are rejected first
+  if not flank_offsets(seq[seq.find(multi_motif) + len(multi_motif):], seeds_3pr, len(flanks_3pr[0])):
+    return None
+
+  # 5pr flank must end before last occurrence of motif repeats: only read prefix before motif repeats is searched
+  offsets_5pr = flank_offsets(seq[:seq.rfind(multi_motif)], seeds_5pr, len(flanks_5pr[0]))
+  best_5pr = best_offset(flank_mismatches(seq, flanks_5pr, offsets_5pr), offsets_5pr)
+  if best_5pr == None:
+    return None
+  end_5pr = best_5pr + len(flanks_5pr[0])
+
+  # 3pr flank must start after first occurrence of motif repeats following 5pr flank
+  start_3pr = seq.find(multi_motif, end_5pr) + len(multi_motif)
+  seq_3pr = seq[start_3pr:]
+  offsets_3pr = flank_offsets(seq_3pr, seeds_3pr, len(flanks_3pr[0]))
+  best_3pr = best_offset(flank_mismatches(seq_3pr, flanks_3pr, offsets_3pr), offsets_3pr)
+  if best_3pr == None:
+    return None
+  start_3pr += best_3pr
+
+  count('flank_approx_matches')
+  return (seq[end_5pr:start_3pr], seq[best_5pr:end_5pr], seq[start_3pr:start_3pr + len(flanks_3pr[0])])
+
+def bam_regions(ref_names, ref_lengths, nr_regions, positions):
+  # Split bam references into (contig, start, end) regions, in bam header order, for parallel processing
+  # positions is a dictionary of positions per contig (eg. probe start positions); each contig is split 
+  #   at midpoints between positions, so that regions contain roughly the same number of positions.
+  #   Contigs with no positions are returned as a single region.
+  tot_positions = sum(len(contig_pos) for contig_pos in positions.values())
+  region_size   = max(1, -(-tot_positions // max(1, nr_regions)))
+  
+  regions = []
+  for contig, contig_length in zip(ref_names, ref_lengths):
+    contig_pos = sorted(positions.get(contig, []))
+    start = 0
+    for i in range(region_size, len(contig_pos), region_size):
+      split_pos = (contig_pos[i-1] + contig_pos[i]) // 2
+      if split_pos > start:
+        regions.append((contig, start, split_pos))
+        start = split_pos
+    regions.append((contig, start, contig_length))
+  return regions
+
+def fetch_regions(region_fn, pad, ref_names):
+  # Read probe (<pool>.str_probes.txt) or bed file positions, padded by pad bases and merged, 
+  #   into regions to fetch from bam, in bam header order.  Regions are (contig, start, end, prev_end), where
+  #   prev_end is end of previous region on the contig (reads starting before prev_end overlap previous region)
+  # Eg: [('1', 1036712, 1037243, 0), ('1', 1585103, 1585421, 1037243), ...]
+  intervals = {}
+  for (contig, start, end) in region_positions(region_fn):
+    intervals.setdefault(contig, []).append((max(0, start - pad), end + pad))
+
+  regions = []
+  for contig in ref_names:
+    merged = []
+    for (start, end) in sorted(intervals.get(contig, [])):
+      if len(merged) > 0 and start <= merged[-1][1]:
+        merged[-1][1] = max(merged[-1][1], end)
+      else:
+        merged.append([start, end])
+
+    prev_end = 0
+    for (start, end) in merged:
+      regions.append((contig, start, end, prev_end))
+      prev_end = end
+  return regions
+
+def region_positions(region_fn):
+  # (contig, start, end) for each probe (start = end = probe start) or bed row, from pool resource cache if available
+  pool_cache = load_pool_cache(region_fn)
+  cache_ftype = [ftype for (ftype, fname) in pool_cache['files'].items() if fname == os.path.abspath(region_fn)] if pool_cache else []
+  if cache_ftype == ['probe_info']:
+    probes = pool_cache['probes']
+    return zip(probes['chr'].tolist(), probes['start'].tolist(), probes['start'].tolist())
+  elif len(cache_ftype) > 0:
+    bed = pool_cache['beds'][cache_ftype[0]]
+    return zip(bed['chr'].tolist(), bed['start'].tolist(), bed['end'].tolist())
+
+  positions = []
+  region_input = open_file(region_fn, 'r')
+  probe_file = region_input.readline().split('\t')[0] == 'Probe'
+  if not probe_file: region_input.seek(0)
+  for line in region_input:
+    cols = line.rstrip('\n').split('\t')
+    if probe_file:
+      positions.append((cols[1], int(cols[2]), int(cols[2])))
+    elif len(cols) >= 3 and cols[1].isdigit():
+      positions.append((cols[0], int(cols[1]), int(cols[2])))
+    #else: bed track/browser lines
+  region_input.close()
+  return positions
+
+def bed_arrays(bed_fn):
+  # Bed rows as arrays: {'chr', 'name': object arrays, 'start', 'end': int64 arrays}, from pool resource cache if available
+  pool_cache = load_pool_cache(bed_fn)
+  cache_ftype = [ftype for (ftype, fname) in pool_cache['files'].items() if fname == os.path.abspath(bed_fn)] if pool_cache else []
+  if len(cache_ftype) > 0 and cache_ftype[0] in pool_cache['beds']:
+    return pool_cache['beds'][cache_ftype[0]]
+
+  bed_input = open_file(bed_fn, 'r')
+  bed_rows = [line.rstrip('\n').split('\t') for line in bed_input]
+  bed_rows = [bed_row for bed_row in bed_rows if len(bed_row) >= 3 and bed_row[1].isdigit()]
+  bed_input.close()
+  return {'chr': np.array([bed_row[0] for bed_row in bed_rows], dtype=object),
+          'start': np.array([int(bed_row[1]) for bed_row in bed_rows], dtype=np.int64),
+          'end': np.array([int(bed_row[2]) for bed_row in bed_rows], dtype=np.int64),
+          'name': np.array([bed_row[3] if len(bed_row) > 3 else '' for bed_row in bed_rows], dtype=object)}
+
+def region_reads(sam_input, regions, fetch_unmapped=False):
+  # Reads from bam regions (or whole bam if regions is None), and optionally unmapped reads without coordinates
+  # Reads overlapping more than one region are returned once, from the first region
+  if regions == None:
+    for sam_row in sam_input.fetch():
+      yield sam_row
+  else:
+    for (contig, start, end, prev_end) in regions:
+      for sam_row in sam_input.fetch(contig, start, end):
+        if sam_row.pos >= prev_end:
+          yield sam_row
+
+  if fetch_unmapped:
+    for sam_row in sam_input.fetch('*'):
+      yield sam_row
+
+#-----------------------------------------------------------------------------#
+# Overlapped bam reading: reads are decoded (decode thread), processed (main  #
+#   thread) and results written (writer thread) in batches of STR_READ_BATCH #
+#   reads, through queues of STR_QUEUE_DEPTH batches (0: run serially)       #
+#-----------------------------------------------------------------------------#
+# Decode thread iterates the bam (pysam releases the GIL while reading, and decompresses with STR_BAM_THREADS
+#   htslib threads), and the writer thread formats/writes detail rows, so elapsed time is that of the slowest stage
+#   rather than the sum.  Time each stage waits on a queue is counted in metrics (decode/process/write_stall_secs)
+def read_batches(sam_rows, batch_size):
+  batch = []
+  for sam_row in sam_rows:
+    batch.append(sam_row)
+    if len(batch) >= batch_size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+def queue_put(item_queue, item, stall_counter):
+  try:
+    item_queue.put_nowait(item)
+  except Queue.Full:
+    wait_start = time.time()
+    item_queue.put(item)
+    count(stall_counter, time.time() - wait_start)
+
+def queue_get(item_queue, stall_counter):
+  try:
+    return item_queue.get_nowait()
+  except Queue.Empty:
+    wait_start = time.time()
+    item = item_queue.get()
+    count(stall_counter, time.time() - wait_start)
+    return item
+
+def start_thread(target, *args):
+  thread = threading.Thread(target=target, args=args)
+  thread.daemon = True
+  thread.start()
+  return thread
+
+def decode_batches(sam_rows, batch_queue):
+  # Decode thread: queue (batch, None) for each batch of reads, then (None, None) at end, or (None, exc_info) if error
+  try:
+    for batch in read_batches(sam_rows, READ_BATCH):
+      queue_put(batch_queue, (batch, None), 'decode_stall_secs')
+    queue_put(batch_queue, (None, None), 'decode_stall_secs')
+  except Exception:
+    queue_put(batch_queue, (None, sys.exc_info()), 'decode_stall_secs')
+
+def write_batches(write_batch, result_queue, write_errors):
+  # Writer thread: write results until None; after an error, results are discarded so that the main thread is not blocked
+  while True:
+    results = queue_get(result_queue, 'write_stall_secs')
+    if results == None:
+      return
+    if not write_errors:
+      try:
+        write_batch(results)
+      except Exception:
+        write_errors.append(sys.exc_info())
+
+def overlap_reads(sam_rows, process_batch, write_batch):
+  # Call process_batch for each batch of reads (list of pysam reads), and write_batch with its result, with reads
+  #   decoded and results written in separate threads if STR_QUEUE_DEPTH > 0.  Returns number of reads
+  nr_reads = 0
+  if QUEUE_DEPTH <= 0:
+    for batch in read_batches(sam_rows, READ_BATCH):
+      nr_reads += len(batch)
+      write_batch(process_batch(batch))
+    return nr_reads
+
+  batch_queue = Queue.Queue(QUEUE_DEPTH); result_queue = Queue.Queue(QUEUE_DEPTH); write_errors = []
+  decode_thread = start_thread(decode_batches, sam_rows, batch_queue)
+  write_thread  = start_thread(write_batches, write_batch, result_queue, write_errors)
+  while True:
+    (batch, exc_info) = queue_get(batch_queue, 'process_stall_secs')
+    if exc_info:
+      raise exc_info[0], exc_info[1], exc_info[2]
+    if batch == None:
+      break
+    nr_reads += len(batch)
+    count('read_batches')
+    queue_put(result_queue, process_batch(batch), 'process_stall_secs')
+  queue_put(result_queue, None, 'process_stall_secs')
+  decode_thread.join()
+  write_thread.join()
+  if write_errors:
+    exc_info = write_errors[0]
+    raise exc_info[0], exc_info[1], exc_info[2]
+  return nr_reads
+
+def add_flank_alleles(str_info, fsnv_csv):
+  # Add alternate flanking sequences to str_info if variants in flank positions
+  # Flanking sequences in str_info are converted to arrays: [ref flank, alt flank1, ...]
+  for str_name, str_vals in str_info.items():
+    str_vals['flanking_5pr'] = [str_vals['flanking_5pr']]
+    str_vals['flanking_3pr'] = [str_vals['flanking_3pr']]
+
+  for frow in fsnv_csv:
+    str_name = frow['STRName']
+    flank5or3 = 'flanking_' + frow['5or3pr']
+  
+    snv_index   = int(frow['SNVPos']) - (int(frow['FlankStart'])+1)
+    ref_base    = frow['Ref']
+    alt_alleles = frow['Alt']
+    allele_freq = frow['AF']
+  
+    bases_wfreq = snv_ref_alt(ref_base, alt_alleles, allele_freq)
+    log('debug', "Bases w/freq: {0}", bases_wfreq)
+  
+    # Add alternate flanking, for non-reference alleles with frequency > 0
+    for (snv_base, afreq) in bases_wfreq[1:]:
+      if afreq == 0:
+        continue 
+    
+      # Modify reference and current alt flanking sequences with alternate SNV base
+      # Result is that reference, individual mutations and combination mutations are all tested for in flanking sequence
+      nr_flanking = len(str_info[str_name][flank5or3])
+      for i in range(nr_flanking):
+        flank_seq = str_info[str_name][flank5or3][i]
+        alt_flank = flank_seq[0:snv_index] + snv_base + flank_seq[snv_index+1:]
+        if alt_flank not in str_info[str_name][flank5or3]:
+          str_info[str_name][flank5or3].append(alt_flank)
+          log('debug', "Alt {0} flanking for STR: {1} is: {2}", frow['5or3pr'], str_name, alt_flank)
+  return str_info
+
+def probe_records(probe_info, str_info, str_matchers):
+  # Per probe record for R1 read dispatch, built once: probe_idx (row in probe_cts), STR name/strand/motif,
+  #   multi_motif and compiled motif regex (motif_search), flank matcher, and summary key (ref flanking)
+  # Probes for STRs not in str_info have no record (reads for these probes are ignored)
+  probe_recs = {}
+  for probe_idx, probe_nr in enumerate(sorted(probe_info)):
+    probe_nr_info = probe_info[probe_nr]
+    str_name = probe_nr_info['str_name']
+    if str_name not in str_info:
+      continue
+    str_nm_info = str_info[str_name]
+    (motif, min_repeats, strand) = (str_nm_info['str_motif'], str_nm_info['min_repeats'], probe_nr_info['strand'])
+    probe_recs[probe_nr] = {'probe_idx': probe_idx, 'probe_nr': probe_nr, 'str_name': str_name, 'strand': strand, 
+                            'motif': motif, 'motif_len': len(motif), 'multi_motif': motif * min_repeats,
+                            'motif_regex': re.compile(r'(?:%s)+' % motif), 'matcher': str_matchers[str_name],
+                            'summary_key': (str_name, strand, motif, str_nm_info['flanking_5pr'][0], str_nm_info['flanking_3pr'][0])}
+  return probe_recs
+
+def new_probe_cts(probe_info):
+  # Per probe read counts: [probe_reads, motif_reads, full_str_rds] for each probe, in probe_nr order (probe_idx)
+  return np.zeros((len(probe_info), 3), dtype=np.int64)
+
+def str_tot_reads(probe_recs, probe_cts):
+  # Total probe reads by (STR name, strand)
+  tot_reads = {}
+  for probe_rec in probe_recs.values():
+    str_key = (probe_rec['str_name'], probe_rec['strand'])
+    tot_reads[str_key] = tot_reads.get(str_key, 0) + int(probe_cts[probe_rec['probe_idx'], 0])
+  return tot_reads
+
+def str_read_call(sam_input, sam_row, probe_rec, probe_cts, ref_flank_rds):
+  # Check R1 read for STR motif and flanking sequences; probe_rec is probe record (probe_records) for read ZP tag
+  # Accumulates counts in probe_cts ([probe_reads, motif_reads, full_str_rds] per probe) and ref_flank_rds
+  # Returns STRln_detail row (tuple, R1DTL_HDGS order) if read has full STR between flanking sequences, otherwise None
+  probe_idx = probe_rec['probe_idx']
+  strand    = probe_rec['strand']
+  probe_cts[probe_idx, 0] += 1
+
+  seq_5prto3pr = rev_complement(sam_row.seq) if (strand == 'M' and sam_row.is_unmapped == True) else sam_row.seq
+  found_motif  = motif_search(seq_5prto3pr, sam_row.rlen, probe_rec)
+
+  if found_motif['motif_cnt'] > 0:
+    probe_cts[probe_idx, 1] += 1 
+    
+  flank_found = flank_search(probe_rec['matcher'], seq_5prto3pr)
+  if flank_found == None:
+    return None
+  (str_sequence, flanking_5pr, flanking_3pr) = flank_found
+
+  probe_cts[probe_idx, 2] += 1
+  chr_ref = '*' if sam_row.is_unmapped else sam_input.getrname(sam_row.tid)    
+  motif_start = chr_pos_motif(sam_row.pos, found_motif['motif_idx'], strand)
+  str_len      = len(str_sequence)
+  motif_cnt    = "{0:.5g}".format(str_len * 1.0 / probe_rec['motif_len'])
+
+  # Accumulate summary counts (use ref flanking, not actual flanking in summary)
+  str_len_cts = ref_flank_rds.setdefault(probe_rec['summary_key'], {})
+  str_len_cts[str_len] = str_len_cts.get(str_len, 0) + 1
+
+  return (probe_rec['str_name'], probe_rec['motif'], probe_rec['probe_nr'], strand, sam_row.qname, chr_ref, sam_row.pos, 'NA',
+          sam_row.rlen, motif_start, motif_cnt, str_len, str_sequence, flanking_5pr, flanking_3pr, found_motif['trunc_flag'],
+          seq_5prto3pr, sam_row.mapq, sam_row.qqual)
+
+def write_str_summary(str_out_csv, ref_flank_rds, tot_reads, str_info):
+  # Write summary output: All reads with at least minimum STR repeats, between exact match to 
+  #   flanking sequences (either reference seq or alt allele)
+  str_out_csv.writerow(STR_SUMM_HDGS)
+  
+  if len(ref_flank_rds) > 0:
+    for str_flank_key in sorted(ref_flank_rds):
+      str_len_cts = ref_flank_rds[str_flank_key]
+      (str_name, strand, str_motif, flank_5pr, flank_3pr) = str_flank_key
+
+      for str_len in sorted(str_len_cts):
+        motif_rd_cnt = str_len_cts[str_len]
+        nr_motifs = "{0:.5g}".format(str_len * 1.0 / len(str_motif))
+        str_out_csv.writerow([str_name, strand, str_motif, str_info[str_name]['min_repeats'], tot_reads[(str_name, strand)], 
+                              flank_5pr, flank_3pr, str_len, nr_motifs, motif_rd_cnt])
+  else:
+    str_out_csv.writerow(['NA', 'NA', 'NA', 0, 0, 'NA', 'NA', 0, 0, 0])
+
+def write_probe_cts(probeout_csv, probe_info, probe_cts):
+  # Write probe counts: Total probe reads per STR and reads which include at least the minimum 
+  #   number of repeats of STR motif (irrespective of flanking).  probeout_csv is DictWriter with PROBE_CT_HDGS
+  # {'probe_start_pos': 12009236, 'chromosome': '3', 'str_name': 'trf533283', 'strand': 'P', 'probe_reads': 2355, 'probe_nr': 499,  
+  #   'motif_reads': 419, 'full_str_rds': 156}
+  probeout_csv.writeheader()
+  probe_idxs = dict((probe_nr, probe_idx) for (probe_idx, probe_nr) in enumerate(sorted(probe_info)))
+  for probe_nr in probe_info:
+    (probe_info[probe_nr]['probe_reads'], probe_info[probe_nr]['motif_reads'], probe_info[probe_nr]['full_str_rds']) = probe_cts[probe_idxs[probe_nr]].tolist()
+    probe_info[probe_nr]['probe_nr'] = probe_nr
+    probeout_csv.writerow(probe_info[probe_nr])
+
+def snv_info_from_csv(snv_reader):
+  # Load SNV positions (FreeBayes or 1000kG format, header already skipped) into dictionary by chromosome
+  # Eg: {'1': {7142604: [('C',0),('G',1)], 64304937: [('C',0.5),('T',0.5)]}, ...}
+  snv_info = {}
+  for snv_row in snv_reader:
+    snv_chr = snv_row[0]
+    snv_pos = int(snv_row[1]) # Convert to 0-based positions for matching with pysam/bam  
+    ref_bases = snv_row[2]
+    alt_bases = snv_row[3]
+    allele_freq = get_allele_freq(snv_row)
+    if allele_freq not in ['0', '0.5', '1']:
+      continue
+    ref_alt_bases = snv_ref_alt(ref_bases, alt_bases, allele_freq)
+    # Output from snv_ref_alt is array of tuples:  
+    # Eg: [('G',0),('T',0.5),('C',0.5)], where first tuple is reference and can be 0 freq.
+    snv_info.setdefault(snv_chr, {})[snv_pos] = ref_alt_bases
+  return snv_info
+
+def get_allele_freq(snv_row):
+  allele_freq = 0
+  if len(snv_row) == 6:
+    allele_freq = snv_row[5]
+  elif len(snv_row) > 8:
+    genotype = snv_row[8].split(':')[0]
+    allele_freq = gt_to_af(genotype)
+  return allele_freq
+  
+def gt_to_af(genotype):
+# Genotypes: 0|1 or 0\1 or 1|1 or 1/2 etc.
+  allele1 = genotype[0]  #First char of string
+  allele2 = genotype[2]  #Third char of string
+  afreq   = '0'
+  
+  if allele1 == allele2: 
+    if allele1 in ['0', '1']:  # 0-homozygous ref; 1-homozygous alt1
+      afreq = allele1
+    elif allele1 == '2': # 2-homozygous alt2
+      afreq = '0,1'
+    elif allele1 == '3':
+      afreq = '0,0,1'    # 3-homozygous alt3
+    
+  elif allele1 in ['0','1'] and allele2 in ['0','1']: # heterozygous ref/alt
+    afreq = '0.5'
+  else:
+    afreq = '0.5,0.5'    # 1/2 or 2/1
+  
+  return afreq
+
+def snv_pos_index(snv_info):
+  # Sorted array of SNV positions per chromosome, for finding SNVs covered by a read using binary search
+  # Eg: {'1': array([7142604, 64304937, ...]), ...}
+  return dict((snv_chr, np.array(sorted(snv_info[snv_chr]), dtype=np.int64)) for snv_chr in snv_info)
+
+def snv_union_info(source_snv_infos):
+  # Union of SNV positions from several sources (list of snv_info), with ref/alt bases for each source at position
+  # Eg: {'1': {7142604: [(0, [('C',0),('G',1)]), (2, [('C',0.5),('G',0.5)])], ...}, ...} (source 0 and 2 have SNV)
+  union_info = {}
+  for (source_nr, snv_info) in enumerate(source_snv_infos):
+    for (snv_chr, chr_snvs) in snv_info.items():
+      chr_union = union_info.setdefault(snv_chr, {})
+      for (snv_pos, ref_alt_bases) in chr_snvs.items():
+        chr_union.setdefault(snv_pos, []).append((source_nr, ref_alt_bases))
+  return union_info
+
+def aligned_blocks(sam_row):
+  # Aligned (M/=/X) blocks of read as (ref start, ref end, query start), query positions including soft clips
+  # Eg: 10S50M2D90M -> [(7142487, 7142537, 10), (7142539, 7142629, 60)]
+  blocks = []
+  ref_pos = sam_row.reference_start
+  query_pos = 0
+  for (cigar_op, op_len) in sam_row.cigartuples:
+    if cigar_op in (0, 7, 8):
+      blocks.append((ref_pos, ref_pos + op_len, query_pos))
+    if cigar_op in (0, 1, 4, 7, 8):
+      query_pos += op_len
+    if cigar_op in (0, 2, 3, 7, 8):
+      ref_pos += op_len
+  return blocks
+
+def query_index(blocks, ref_pos):
+  # Position in read aligned to reference position, or None if reference position is deleted/not covered
+  for (ref_start, ref_end, query_start) in blocks:
+    if ref_start <= ref_pos < ref_end:
+      return query_start + ref_pos - ref_start
+  return None
+
+def snv_in_region_to_exclude(snv_index, strand, query_length, debug):
+  # Exclude any SNVs in synthetic (probe) region, or end base of read
+  if strand == 'm' and (snv_index > (query_length - 40) or snv_index == 0):
+    exclude_snv = 'Y'
+  elif strand == 'p' and (snv_index < 40 or snv_index == query_length-1):
+    exclude_snv = 'Y'
+  else:
+    exclude_snv = 'N'
+
+  if debug: print "SNV index: {0}, R2 strand: {1}, R2 length: {2}".format(snv_index, strand, query_length)
+  return exclude_snv
+
+def ref_or_alt(ref_alt_bases, snv_filter):
+  if snv_filter == 'both':
+    return [ref_alt_base[0] for ref_alt_base in ref_alt_bases]
+  elif snv_filter == 'alt':
+    return [ref_alt_base[0] for ref_alt_base in ref_alt_bases if ref_alt_base[1] > 0]
+  else: #snv_filter == 'all'
+    return ['A', 'C', 'G', 'T']
+ 
+def print_variant(qname, probe_nr, snv_chr, snv_pos, snv_base, ref_bases, probe_region_flag):
+  refbases    = [ref_base[0] for ref_base in ref_bases]
+  is_or_isnot = 'is not' if probe_region_flag == 'N' else 'IS'
+  msg_prefix  = ''       if probe_region_flag == 'N' else '**'
+  print "{7} {0}Base: {1} at pos: {2}:{3} {4} in probe {5} synthetic region.  Ref/Alt: {6}".format(msg_prefix, snv_base, snv_chr, snv_pos, is_or_isnot, probe_nr, refbases, qname)
+
+def read_snv_bases(sam_row, sam_chr, snv_positions, debug=False):
+  # (SNV position, read base, probe region flag) for each SNV position covered by R2 read
+  #   snv_positions is from snv_pos_index(snv_info)
+  # **NOTE**: Read positions are 0-based, but positions from vcf file are 1-based.  SNV position is matched to an
+  #   aligned 0-based read position (snv_pos), and read base is taken from 0-based position snv_pos-1 (as previously
+  #   done using intersect with read positions, and get_aligned_pairs()), so only SNVs from read start+1 to end-1
+  if sam_chr not in snv_positions:
+    return []
+  chr_snv_pos = snv_positions[sam_chr]
+  (idx_start, idx_end) = chr_snv_pos.searchsorted([sam_row.reference_start + 1, sam_row.reference_end])
+  if idx_start == idx_end:
+    return []
+
+  blocks = aligned_blocks(sam_row)
+  r2_strand = 'm' if sam_row.is_reverse else 'p'
+  r2_length = sam_row.query_length
+  if debug: print "\nFound variant pos in R2: {0}, {1}:{2}".format(sam_row.qname, sam_chr, chr_snv_pos[idx_start:idx_end].tolist())
+
+  snv_bases = []
+  for snv_pos in chr_snv_pos[idx_start:idx_end].tolist():
+    snv_index = query_index(blocks, snv_pos - 1)
+    if debug: print "SNV index: {0}, Aligned blocks: {1}".format(snv_index, blocks)
+    if snv_index == None or query_index(blocks, snv_pos) == None:
+      continue
+    probe_region_flag = snv_in_region_to_exclude(snv_index, r2_strand, r2_length, debug)
+    snv_bases.append((snv_pos, sam_row.query_alignment_sequence[snv_index], probe_region_flag))
+  return snv_bases
+
+def r2_snv_rows(sam_row, sam_chr, probe_nr, snv_info, snv_positions, snv_filter, debug=False):
+  # Returns SNV_detail rows for R2 read, for each SNV position covered by read outside of synthetic (probe) region
+  #   snv_positions is from snv_pos_index(snv_info)
+  # Eg: [['r0001', 48, '1', 37154689, 'C', 'C/T'], ...]
+  snv_rows = []
+  for (snv_pos, sam_base, probe_region_flag) in read_snv_bases(sam_row, sam_chr, snv_positions, debug):
+    ref_alt_bases = snv_info[sam_chr][snv_pos]
+    if debug: print_variant(sam_row.qname, probe_nr, sam_chr, snv_pos, sam_base, ref_alt_bases, probe_region_flag)
+    if probe_region_flag == 'N' and sam_base in ref_or_alt(ref_alt_bases, snv_filter):
+      snv_rows.append([sam_row.qname, probe_nr, sam_chr, snv_pos, sam_base, '/'.join(ref_alt_base[0] for ref_alt_base in ref_alt_bases)])
+  return snv_rows
+
+def r2_source_snv_rows(sam_row, sam_chr, probe_nr, union_info, snv_positions, source_names, snv_filter, debug=False):
+  # SNV_detail rows (SNV_SRC_DTL_HDGS) for R2 read, for union SNV positions (snv_union_info) covered by read outside of
+  #   synthetic region: one row per SNV position, with sources for which read base is ref/alt (or any base, for all),
+  #   and ref/alt bases of all of those sources (ref first)
+  # Eg: [['r0001', 48, '1', 37154689, 'C', 'C/T', 'minorA,minorC'], ...]
+  snv_rows = []
+  for (snv_pos, sam_base, probe_region_flag) in read_snv_bases(sam_row, sam_chr, snv_positions, debug):
+    source_bases = union_info[sam_chr][snv_pos]
+    if debug: print_variant(sam_row.qname, probe_nr, sam_chr, snv_pos, sam_base, source_bases[0][1], probe_region_flag)
+    if probe_region_flag != 'N':
+      continue
+    source_bases = [(source_nr, ref_alt_bases) for (source_nr, ref_alt_bases) in source_bases
+                    if sam_base in ref_or_alt(ref_alt_bases, snv_filter)]
+    if len(source_bases) == 0:
+      continue
+    ref_alt = []
+    for (source_nr, ref_alt_bases) in source_bases:
+      ref_alt += [ref_alt_base[0] for ref_alt_base in ref_alt_bases if ref_alt_base[0] not in ref_alt]
+    snv_rows.append([sam_row.qname, probe_nr, sam_chr, snv_pos, sam_base, '/'.join(ref_alt),
+                     ','.join(source_names[source_nr] for (source_nr, ref_alt_bases) in source_bases)])
+  return snv_rows
+
+def str_snv_counts(str_cts, snv_cts, str_row, snv_rows):
+  # Accumulate STR/SNV counts for one STR (R1) read and its matching SNV (R2) rows, as for a left join on
+  #   qname/probe_nr.  str_row is STRln_detail key values (R1DTL_KEY_HDGS order, see r1dtl_key_values),
+  #   snv_rows are SNV_detail rows (empty if no SNVs in R2)
+  # Eg. str_cts: {(48,'trf15940','M','AGGG..','GTAT..','16'): 12}
+  #     snv_cts: {(48,'trf15940','M','AGGG..','GTAT..','16','1','37154689','T'): 12}
+  (qname, probe_nr, str_name, strand, bases_5pr, bases_3pr, motif_cnt) = str_row
+  str_key = (int(probe_nr), str_name, strand, bases_5pr, bases_3pr, str(motif_cnt))
+  str_cts[str_key] = str_cts.get(str_key, 0) + 1
+
+  if len(snv_rows) == 0:
+    snv_rows = [[None, None, '-', 0, '-']]
+  for snv_row in snv_rows:
+    snv_key = str_key + (str(snv_row[2]), str(snv_row[3]), snv_row[4])
+    snv_cts[snv_key] = snv_cts.get(snv_key, 0) + 1
+
+def snv_rows_by_read(snv_reader):
+  # Index SNV_detail rows (csv reader, after header) by (qname, probe_nr), for joining to STRln_detail rows
+  #   using str_snv_counts.  SNV values are shared between reads, so only qnames are held per read
+  # Eg: {('r0001', 48): [(None, None, '1', '37154689', 'C')], ...}
+  snv_values = {}; read_snvs = {}
+  for snv_row in snv_reader:
+    snv_value = (None, None, snv_row[2], snv_row[3], snv_row[4])
+    snv_value = snv_values.setdefault(snv_value, snv_value)
+    read_snvs.setdefault((snv_row[0], int(snv_row[1])), []).append(snv_value)
+  return read_snvs
+
+def pandas_floats(values):
+  # Float values of text, as parsed by pandas read_csv (not always the nearest float, eg: '2.087' -> 2.0869999999999997)
+  # Eg: {'2.087': 2.0869999999999997, '16': 16.0}
+  import pandas as pd, StringIO
+  df_values = pd.read_csv(StringIO.StringIO('\n'.join(values)), header=None, dtype=float)
+  return dict(zip(values, df_values[0]))
+
+def write_str_snv_counts(dtl_csv, summ_csv, str_cts, snv_cts):
+  # Write STR_SNV detail (with probe_nr) and summary files from STR/SNV counts
+  # Rows are ordered, and motif counts formatted, as previously output from pandas by pstr_merge_str_snv.py:
+  #   sorted by STR keys (numeric motif count) and then by SNV chr/pos/base as text
+  motif_cnts = set(str_key[5] for str_key in str_cts)
+  int_motifs = all(re.match(r'^-?\d+$', motif_cnt) for motif_cnt in motif_cnts)
+  if int_motifs:
+    fmt_motif = lambda motif_cnt: motif_cnt
+  else:
+    motif_floats = pandas_floats(sorted(motif_cnts))
+    fmt_motif = lambda motif_cnt: repr(motif_floats[motif_cnt])
+
+  str_snv_keys = {}
+  for snv_key in snv_cts:
+    str_snv_keys.setdefault(snv_key[0:6], []).append(snv_key[6:])
+
+  dtl_csv.writerow(STR_SNV_HDGS)
+  summ_csv.writerow(STR_SNV_HDGS[1:])
+  for str_key in sorted(str_cts, key=lambda str_key: str_key[0:5] + (float(str_key[5]),)):
+    for snv_vals in sorted(str_snv_keys.get(str_key, [])):
+      str_snv_row = list(str_key[0:5]) + [fmt_motif(str_key[5]), str_cts[str_key]] + list(snv_vals) + [snv_cts[str_key + snv_vals]]
+      dtl_csv.writerow(str_snv_row)
+      summ_csv.writerow(str_snv_row[1:])
+
+#-----------------------------------------------------------------------------#
+# Logging, metrics and profiling                                              #
+#   STR_LOG_LEVEL: info (default) or debug; STR_METRICS: Y writes             #
+#   <base>.<stage>.metrics.json (default N); STR_PROFILE_MS: sampling         #
+#   profiler interval                                                         #
+#-----------------------------------------------------------------------------#
+# Metrics file: stage, args, wall/cpu secs, peak RSS, wall secs per phase (in order), and counters, eg:
+#   {"stage": "str_lengths_R1ref", "phases": [["load_resources", 0.4], ["read_bam", 9.1], ..],
+#    "counters": {"reads": 200000, "motif_reads": 151000, "flank_regex_searches": 160000, ..}, ..}
+# Profile file (<base>.<stage>.profile.txt, if STR_PROFILE_MS > 0): sampled stacks in collapsed (flamegraph) format,
+#   caller frames as file:function, leaf frame as file:function:line, with number of samples.  Samples are
+#   only taken in the main process (interval timers are not inherited by STR_NR_PROCS worker processes)
+# Counters are only kept if metrics are written (STR_METRICS=Y), and then updated with METRICS_LOCK held, as count is
+#   called from decode, worker and writer threads
+def log(level, msg, *args):
+  # Print message if level (info or debug) is enabled; formatting is skipped for disabled levels
+  if LOG_LEVELS[level] <= LOG_LEVEL:
+    print msg.format(*args) if args else msg
+
+def start_metrics(stage):
+  # Reset metrics for stage (script name), start first phase, and start sampling profiler if STR_PROFILE_MS set
+  METRICS.update({'stage': os.path.splitext(stage)[0], 'start_time': time.time(), 'start_cpu': time.clock(),
+                  'phase': None, 'phases': [], 'counters': {}, 'profile': {}})
+  phase('load_resources')
+  if PROFILE_MS > 0:
+    signal.signal(signal.SIGPROF, profile_sample)
+    signal.siginterrupt(signal.SIGPROF, False)
+    signal.setitimer(signal.ITIMER_PROF, PROFILE_MS / 1000.0, PROFILE_MS / 1000.0)
+
+def phase(name):
+  # End current phase (if any) and start named phase; phases are timed in wall secs
+  now = time.time()
+  if METRICS['phase']:
+    METRICS['phases'].append([METRICS['phase'], round(now - METRICS['phase_start'], 4)])
+  METRICS['phase'] = name
+  METRICS['phase_start'] = now
+
+def count(name, n=1):
+  if not WRITE_METRICS:
+    return
+  with METRICS_LOCK:
+    METRICS['counters'][name] = METRICS['counters'].get(name, 0) + n
+
+def take_counters():
+  # Return and reset counters, eg to return counts from a worker process for merging with add_counters
+  with METRICS_LOCK:
+    counters = METRICS['counters']
+    METRICS['counters'] = {}
+  return counters
+
+def add_counters(counters):
+  if not WRITE_METRICS:
+    return
+  with METRICS_LOCK:
+    for (name, n) in counters.items():
+      METRICS['counters'][name] = METRICS['counters'].get(name, 0) + n
+
+def profile_sample(signum, frame):
+  # SIGPROF handler: add sampled stack (leaf frame with line number) to profile counts
+  stack = ['{0}:{1}:{2}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name, frame.f_lineno)]
+  frame = frame.f_back
+  while frame:
+    stack.append('{0}:{1}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+    frame = frame.f_back
+  stack_key = ';'.join(reversed(stack))
+  METRICS['profile'][stack_key] = METRICS['profile'].get(stack_key, 0) + 1
+
+def write_metrics(out_base):
+  # End last phase, stop profiler and write <out_base>.<stage>.metrics.json (and profile.txt, if profiling)
+  phase(None)
+  if PROFILE_MS > 0:
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+  if not WRITE_METRICS or METRICS['stage'] == None:
+    return
+  metrics_fn = '{0}.{1}.metrics.json'.format(out_base, METRICS['stage'])
+  metrics = {'stage': METRICS['stage'], 'args': sys.argv[1:], 'pid': os.getpid(),
+             'start': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(METRICS['start_time'])),
+             'wall_secs': round(time.time() - METRICS['start_time'], 4), 'cpu_secs': round(time.clock() - METRICS['start_cpu'], 4),
+             'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+             'phases': METRICS['phases'], 'counters': METRICS['counters'], 'profile_samples': sum(METRICS['profile'].values())}
+  metrics_output = open_file(metrics_fn, 'w')
+  json.dump(metrics, metrics_output, indent=1, sort_keys=True)
+  metrics_output.close()
+
+  if METRICS['profile']:
+    profile_output = open_file('{0}.{1}.profile.txt'.format(out_base, METRICS['stage']), 'w')
+    for (stack_key, samples) in sorted(METRICS['profile'].items(), key=lambda item: -item[1]):
+      profile_output.write('{0} {1}\n'.format(stack_key, samples))
+    profile_output.close()
+
+#-----------------------------------------------------------------------------#
+# Detail (per read) outputs, as tab-delimited text and/or binary table        #
+#   STR_TABLE_FORMAT: tsv (default), bin or both                              #
+#   STR_DETAIL_COMPRESS: gz or zstd, to compress tab-delimited text           #
+#-----------------------------------------------------------------------------#
+# Tab-delimited detail files are <name>.txt, or <name>.txt.gz/<name>.txt.zst if compressed (zstd uses zstd executable)
+# Binary tables are zip files (.npz) of numpy arrays, written in chunks of TABLE_CHUNK_ROWS rows:
+#   c<col#>.<chunk#>.npy: column values for chunk (int, codes for cat columns, or int32 end offsets of text values); int
+#                         values and codes are the smallest int type (int8 .. int64) holding the chunk's values
+#   Members are compressed (zip deflate), as text columns (qnames, sequences) are most of the table size
+#   b<col#>.<chunk#>.npy: text column values for chunk, concatenated (uint8)
+#   v<col#>.npy:          values for cat column codes
+#   table.json:           headings, column types, number of chunks/rows
+def table_fn(txt_fn):
+  return re.sub(r'\.txt$', '', txt_fn) + '.npz'
+
+def table_text(value):
+  # Column value as text, as written by csv module
+  return '' if value == None else repr(value) if type(value) == float else str(value)
+
+def open_table(tbl_fn, hdgs, col_types):
+  return {'zip': zipfile.ZipFile(tbl_fn, 'w', zipfile.ZIP_DEFLATED, True), 'hdgs': list(hdgs), 
+          'types': [col_types.get(hdg, 'cat') for hdg in hdgs], 'codes': [{} for hdg in hdgs], 
+          'rows': [], 'nr_chunks': 0, 'nr_rows': 0}
+
+def write_table_array(tbl_zip, array_name, col_array):
+  array_bytes = StringIO.StringIO()
+  np.lib.format.write_array(array_bytes, col_array)
+  tbl_zip.writestr(array_name + '.npy', array_bytes.getvalue())
+
+def int_array(values):
+  # Array of int values, as smallest int type holding the values
+  int_values = np.array(values, dtype=np.int64)
+  for int_type in [np.int8, np.int16, np.int32]:
+    if len(int_values) == 0 or (int_values.min() >= np.iinfo(int_type).min and int_values.max() <= np.iinfo(int_type).max):
+      return int_values.astype(int_type)
+  return int_values
+
+def write_table_rows(table, rows):
+  # rows are lists of values, in order of table headings
+  table['rows'].extend(rows)
+  if len(table['rows']) >= TABLE_CHUNK_ROWS:
+    write_table_chunk(table)
+
+def write_table_chunk(table):
+  if len(table['rows']) == 0:
+    return
+  for col_nr, col_values in enumerate(zip(*table['rows'])):
+    col_type = table['types'][col_nr]
+    if col_type == 'int':
+      col_array = int_array([int(value) for value in col_values])
+    elif col_type == 'text':
+      text_values = [table_text(value) for value in col_values]
+      col_array = np.cumsum([len(text_value) for text_value in text_values], dtype=np.int32)
+      text_bytes = np.frombuffer(''.join(text_values), dtype=np.uint8)
+      write_table_array(table['zip'], 'b{0}.{1}'.format(col_nr, table['nr_chunks']), text_bytes)
+    else:
+      codes = table['codes'][col_nr]
+      col_array = int_array([codes.setdefault(table_text(value), len(codes)) for value in col_values])
+    write_table_array(table['zip'], 'c{0}.{1}'.format(col_nr, table['nr_chunks']), col_array)
+  table['nr_rows']  += len(table['rows'])
+  table['nr_chunks'] += 1
+  table['rows'] = []
+
+def close_table(table):
+  write_table_chunk(table)
+  for col_nr, codes in enumerate(table['codes']):
+    if table['types'][col_nr] == 'cat':
+      write_table_array(table['zip'], 'v{0}'.format(col_nr), np.array(sorted(codes, key=codes.get), dtype=str))
+  table_info = dict((info_key, table[info_key]) for info_key in ['hdgs', 'types', 'nr_chunks', 'nr_rows'])
+  table['zip'].writestr('table.json', json.dumps(table_info))
+  table['zip'].close()
+
+def read_table_array(tbl_zip, array_name):
+  return np.lib.format.read_array(StringIO.StringIO(tbl_zip.read(array_name + '.npy')))
+
+def table_chunks(tbl_fn, cols=None):
+  # Yields list of column value lists (cat columns decoded) for each chunk of binary table, for cols (default all)
+  tbl_zip = zipfile.ZipFile(tbl_fn, 'r')
+  table_info = json.loads(tbl_zip.read('table.json'))
+  col_nrs = [table_info['hdgs'].index(col) for col in (cols or table_info['hdgs'])]
+  cat_values = dict((col_nr, read_table_array(tbl_zip, 'v{0}'.format(col_nr))) for col_nr in col_nrs 
+                    if table_info['types'][col_nr] == 'cat')
+  for chunk_nr in range(table_info['nr_chunks']):
+    chunk_cols = []
+    for col_nr in col_nrs:
+      col_array = read_table_array(tbl_zip, 'c{0}.{1}'.format(col_nr, chunk_nr))
+      if col_nr in cat_values:
+        chunk_cols.append(cat_values[col_nr][col_array].tolist())
+      elif table_info['types'][col_nr] == 'text':
+        text_bytes = read_table_array(tbl_zip, 'b{0}.{1}'.format(col_nr, chunk_nr)).tostring()
+        text_ends = col_array.tolist()
+        chunk_cols.append([text_bytes[text_start:text_end] for (text_start, text_end) in zip([0] + text_ends[:-1], text_ends)])
+      else:
+        chunk_cols.append(col_array.tolist())
+    yield chunk_cols
+  tbl_zip.close()
+
+def table_hdgs(tbl_fn):
+  tbl_zip = zipfile.ZipFile(tbl_fn, 'r')
+  hdgs = json.loads(tbl_zip.read('table.json'))['hdgs']
+  tbl_zip.close()
+  return [str(hdg) for hdg in hdgs]
+
+COMPRESS_EXT = {'gz': '.gz', 'zstd': '.zst'}
+
+def row_values(col_nrs):
+  # Function returning values of columns col_nrs from row, as tuple (operator.itemgetter, also for a single column)
+  if len(col_nrs) == 1:
+    return lambda row: (row[col_nrs[0]],)
+  return operator.itemgetter(*col_nrs)
+
+# STRln_detail key values (R1DTL_KEY_HDGS) from full STRln_detail row (str_read_call), for str_snv_counts
+r1dtl_key_values = row_values([R1DTL_HDGS.index(hdg) for hdg in R1DTL_KEY_HDGS])
+
+def detail_fn(txt_fn):
+  # Detail file written for txt_fn: binary table (STR_TABLE_FORMAT=bin), or tab-delimited text (compressed if STR_DETAIL_COMPRESS)
+  return table_fn(txt_fn) if TABLE_FORMAT == 'bin' else txt_fn + COMPRESS_EXT.get(DETAIL_COMPRESS, '')
+
+def open_tsv(tsv_fn, rw):
+  # Open tab-delimited text, compressed (.gz or .zst) or not; returns [file, zstd process or None]
+  try:
+    if tsv_fn[-3:] == '.gz':
+      return [gzip.open(tsv_fn, rw + 'b', 1), None]
+    elif tsv_fn[-4:] == '.zst':
+      zstd_args = ['zstd', '-q', '-f', '-o', tsv_fn] if rw == 'w' else ['zstd', '-q', '-d', '-c', tsv_fn]
+      zstd_proc = subprocess.Popen(zstd_args, stdin=subprocess.PIPE if rw == 'w' else None, 
+                                   stdout=subprocess.PIPE if rw == 'r' else None)
+      return [zstd_proc.stdin if rw == 'w' else zstd_proc.stdout, zstd_proc]
+  except (IOError, OSError) as e:
+    print "Unable to open {0} file: {1} ({2})".format('output' if rw == 'w' else 'input', tsv_fn, e)
+    sys.exit(1)
+  return [open_file(tsv_fn, rw), None]
+
+def close_tsv(tsv_file, zstd_proc):
+  tsv_file.close()
+  if zstd_proc and zstd_proc.wait() != 0:
+    raise IOError('zstd failed, exit status {0}'.format(zstd_proc.returncode))
+
+def detail_hdgs(dtl_fn):
+  # Column headings of detail file (binary table or tab-delimited text)
+  if dtl_fn[-4:] == '.npz':
+    return table_hdgs(dtl_fn)
+  [detail_input, zstd_proc] = open_tsv(dtl_fn, 'r')
+  hdgs = detail_input.readline().rstrip('\n').split('\t')
+  if zstd_proc:
+    zstd_proc.terminate()
+    zstd_proc.wait()
+  detail_input.close()
+  return hdgs
+
+def detail_rows(dtl_fn, cols):
+  # Yields rows (lists of cols values) from tab-delimited (.txt, .txt.gz, .txt.zst) or binary table (.npz) detail file
+  if dtl_fn[-4:] == '.npz':
+    for chunk_cols in table_chunks(dtl_fn, cols):
+      for row in itertools.izip(*chunk_cols):
+        yield row
+  else:
+    [detail_input, zstd_proc] = open_tsv(dtl_fn, 'r')
+    detail_csv = csv.reader(detail_input, delimiter='\t', quoting=csv.QUOTE_NONE)
+    hdgs = next(detail_csv)
+    col_values = row_values([hdgs.index(col) for col in cols])
+    for row in detail_csv:
+      yield col_values(row)
+    close_tsv(detail_input, zstd_proc)
+
+def open_detail(txt_fn, hdgs, col_types, header=True, out_hdgs=None, compress=True):
+  # Open detail output as tab-delimited text (txt_fn, compressed if STR_DETAIL_COMPRESS and compress) and/or binary
+  #   table (.npz), depending on STR_TABLE_FORMAT.  Rows are written with hdgs columns, or only out_hdgs columns 
+  #   if specified (none if out_hdgs is empty), and are buffered (DETAIL_BUFFER_ROWS)
+  out_hdgs = hdgs if out_hdgs == None else out_hdgs
+  detail = {'txt_fn': txt_fn, 'hdgs': out_hdgs, 'tsv_output': None, 'tsv_proc': None, 'tsv_csv': None, 'table': None, 'rows': [],
+            'out_cols': row_values([hdgs.index(hdg) for hdg in out_hdgs]) if out_hdgs and out_hdgs != hdgs else None}
+  if len(out_hdgs) == 0:
+    return detail
+  if TABLE_FORMAT != 'bin':
+    tsv_fn = txt_fn + COMPRESS_EXT.get(DETAIL_COMPRESS, '') if compress else txt_fn
+    [detail['tsv_output'], detail['tsv_proc']] = open_tsv(tsv_fn, 'w')
+    detail['tsv_csv'] = csv.writer(detail['tsv_output'], delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', 
+                                   escapechar='', quoting=csv.QUOTE_NONE)
+    if header: detail['tsv_csv'].writerow(out_hdgs)
+  if TABLE_FORMAT in ['bin', 'both']:
+    detail['table'] = open_table(table_fn(txt_fn), out_hdgs, col_types)
+  return detail
+
+def write_detail_rows(detail, rows):
+  # rows are lists or tuples of values, in order of headings (hdgs passed to open_detail)
+  if detail['tsv_csv'] == None and detail['table'] == None:
+    return
+  if detail['out_cols']:
+    rows = [detail['out_cols'](row) for row in rows]
+  detail['rows'].extend(rows)
+  if len(detail['rows']) >= DETAIL_BUFFER_ROWS:
+    flush_detail(detail)
+
+def flush_detail(detail):
+  if detail['tsv_csv']:
+    detail['tsv_csv'].writerows(detail['rows'])
+  if detail['table']:
+    write_table_rows(detail['table'], detail['rows'])
+  detail['rows'] = []
+
+def append_detail(detail, part_txt_fn):
+  # Append detail output written (without header, uncompressed, and closed) to part_txt_fn, and remove part files
+  flush_detail(detail)
+  if detail['tsv_csv']:
+    part_input = open_file(part_txt_fn, 'r')
+    detail['tsv_output'].writelines(part_input)
+    part_input.close()
+    os.remove(part_txt_fn)
+  if detail['table']:
+    for chunk_cols in table_chunks(table_fn(part_txt_fn)):
+      write_table_rows(detail['table'], zip(*chunk_cols))
+    os.remove(table_fn(part_txt_fn))
+
+def close_detail(detail):
+  flush_detail(detail)
+  if detail['tsv_output']:
+    close_tsv(detail['tsv_output'], detail['tsv_proc'])
+  if detail['table']:
+    close_table(detail['table'])
+
+#-----------------------------------------------------------------------------#
+# Stage manifest: per sample record of completed pipeline stages, so that a   #
+#   rerun skips completed stages (strseq_genotype.sh, str_batch_genotype.py) #
+#-----------------------------------------------------------------------------#
+# Manifest (<base>.manifest.json) has version, and for each completed stage: parameters (command, and STR_* env
+#   settings for python stages), and input/output files as file_stamp lists (name, size, mtime, md5), eg:
+#   {"version": 1, "stages": {"r1_str": {"params": {"command": "python ..", "FLANK_SIZE": "15", ..},
+#    "inputs": {"s1_R1.bam": ["s1_R1.bam", 51200000, 1792300000.0, "9e10.."], ..}, "outputs": {..},
+#    "secs": 0.4, "completed": "2026-10-18 10:00:00"}, ..}}
+# A stage is complete if its parameters are unchanged and its inputs/outputs have the recorded contents (md5 is only
+#   computed if size/mtime differ, as for the pool cache), so a rerun restarts from the first stale stage.  A stage
+#   which is rerun with the same output contents does not make later stages stale.
+# Env settings recorded for stages running each script (settings which change the script's outputs)
+MANIFEST_ENV = [(['str_lengths_R1ref.py', 'pstr_fused_str_snv.py', 'str_ctlen_genotype.py', 'pstr_genotyping.py'], ['FLANK_SIZE']),
+                (['str_lengths_R1ref.py', 'pstr_fused_str_snv.py'], ['STR_FLANK_MISMATCH', 'STR_FETCH_UNMAPPED', 'STR_DETAIL_LEVEL']),
+                (['str_lengths_R1ref.py', 'pstr_extract_R2snv.py', 'pstr_fused_str_snv.py'],
+                 ['STR_REGION_FILE', 'STR_REGION_PAD', 'STR_TABLE_FORMAT', 'STR_DETAIL_COMPRESS']),
+                (['str_ctlen_genotype.py', 'pstr_genotyping.py'], ['STR_THRESHOLD_VALS']),
+                (['pstr_fused_str_snv.py'], ['STR_MATE_WINDOW']),
+                (['pstr_haplotype_cts.py'], ['STR_MINOR_BASE_MIN'])]
+
+def read_manifest(manifest_fn):
+  # Manifest dict, or new (empty) manifest if file does not exist or is an earlier version
+  if os.path.isfile(manifest_fn):
+    manifest_input = open_file(manifest_fn, 'r')
+    manifest = json.load(manifest_input)
+    manifest_input.close()
+    if manifest.get('version') == MANIFEST_VERSION:
+      return manifest
+  return {'version': MANIFEST_VERSION, 'stages': {}}
+
+def stage_params(command, params=None):
+  # Stage parameters: command and any other params, with env settings (MANIFEST_ENV) for scripts run by command
+  all_params = dict(params or {})
+  all_params['command'] = command
+  scripts = set(os.path.basename(script_fn) for script_fn in re.findall(r'\S+\.py\b', command))
+  for (env_scripts, env_names) in MANIFEST_ENV:
+    if scripts.intersection(env_scripts):
+      all_params.update((env_name, os.environ[env_name]) for env_name in env_names if env_name in os.environ)
+  return all_params
+
+def stamps_valid(file_stamps, fns):
+  # True if files (fns) are those with file_stamps, and have the recorded contents
+  if sorted(file_stamps) != sorted(fns):
+    return False
+  for fn in fns:
+    if not os.path.isfile(fn):
+      return False
+    [name, size, mtime, md5] = file_stamps[fn]
+    if [size, mtime] != file_stamp(fn, md5)[1:3] and md5 != file_md5(fn):
+      return False
+  return True
+
+def stage_complete(manifest, stage, params, input_fns, output_fns):
+  stage_info = manifest['stages'].get(stage)
+  return (stage_info != None and stage_info['params'] == params and stamps_valid(stage_info['inputs'], input_fns) and
+          stamps_valid(stage_info['outputs'], output_fns))
+
+def start_stage(manifest_fn, manifest, stage):
+  # Remove stage from manifest before it is run, so that it is not complete if the run fails/is interrupted
+  if manifest['stages'].pop(stage, None) != None:
+    write_json_atomic(manifest_fn, manifest)
+
+def record_stage(manifest_fn, manifest, stage, params, input_fns, output_fns, secs=None):
+  # Record completed stage in manifest; md5s are reused for files recorded by other stages with same size/mtime
+  known_md5s = {}
+  for stage_info in manifest['stages'].values():
+    for (fn, [name, size, mtime, md5]) in stage_info['inputs'].items() + stage_info['outputs'].items():
+      known_md5s[(fn, size, mtime)] = md5
+  file_stamps = {}
+  for fn in set(input_fns + output_fns):
+    fstat = os.stat(fn)
+    file_stamps[fn] = file_stamp(fn, known_md5s.get((fn, fstat.st_size, fstat.st_mtime)))
+  manifest['stages'][stage] = {'params': params, 'inputs': dict((fn, file_stamps[fn]) for fn in input_fns),
+                               'outputs': dict((fn, file_stamps[fn]) for fn in output_fns), 'secs': secs,
+                               'completed': time.strftime('%Y-%m-%d %H:%M:%S')}
+  write_json_atomic(manifest_fn, manifest)
+
+def run_script(script, script_args):
+  # Run pipeline script (in this directory) in this process, as if from command line, eg for stages of
+  #   str_batch_genotype.py and str_regenotype.py; returns exit status (sys.exit code, 1 for a sys.exit message)
+  script_fn = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+  saved_argv = sys.argv
+  sys.argv = [script_fn] + script_args
+  try:
+    runpy.run_path(script_fn, run_name='__main__')
+  except SystemExit as e:
+    return e.code if isinstance(e.code, int) else (0 if e.code == None else 1)
+  finally:
+    sys.argv = saved_argv
+    sys.stdout.flush()
+  return 0
+
+#-----------------------------------------------------------------------------#
+# Pool resource cache: str_info, str_probes, flank and genomic noSTR beds for #
+#   pool, compiled into <pool>.pool_cache.npz (see str_pool_cache.py)        #
+#-----------------------------------------------------------------------------#
+# Cache is a zip file of numpy arrays (text columns as tab-prefixed values, uint8), plus pool.json with cache version and
+#   source files (name, size, mtime, md5).  STRs and probes are keyed by integer id (row# in cache arrays):
+#   str.<col>.npy:   name, motif, min_repeats, flank_5pr, end_5pr, flank_3pr, start_3pr (str_info rows, then
+#                    any STR names only in probe file)
+#   probe.<col>.npy: probe_nr, chr, start, str_id, strand
+#   bed.<type>.<col>.npy: chr, start, end, name for each bed (5prflank, 3prflank, genomic_<rdlen>b)
+# Cache is only written by str_pool_cache.py (not as a side effect of genotyping, as resources directory may be read-only
+#   or shared by concurrent runs); scripts read the resource text files if cache is missing, or out of date (source
+#   files changed, md5 checked if size/mtime differ).  Flanks are stored in full, and cut to FLANK_SIZE when str_info
+#   dict is built, so the same cache is used for all flank sizes
+POOL_STR_COLS   = [('name', 'STRName'), ('motif', 'Motif'), ('min_repeats', 'MinRepeat'), ('flank_5pr', '5PrFlank'),
+                   ('end_5pr', '5PrEnd'), ('flank_3pr', '3PrFlank'), ('start_3pr', '3PrStart')]
+POOL_PROBE_COLS = ['probe_nr', 'chr', 'start', 'str_id', 'strand']
+POOL_BED_COLS   = ['chr', 'start', 'end', 'name']
+
+def pool_files(resource_fn):
+  # Pool resource files (absolute paths, if file exists) for pool of any resource file, eg: OS0035.str_info.txt
+  pool_prefix = os.path.join(os.path.dirname(os.path.abspath(resource_fn)), 
+                             os.path.basename(resource_fn).split('.')[0].split('_genomic_')[0])
+  files = {'str_info': pool_prefix + '.str_info.txt', 'probe_info': pool_prefix + '.str_probes.txt',
+           '5prflank': pool_prefix + '.5prflank.st.bed', '3prflank': pool_prefix + '.3prflank.st.bed'}
+  for bed_fn in glob.glob(pool_prefix + '_genomic_*.noSTR_plus5b.bed'):
+    files[os.path.basename(bed_fn).split('.')[0][len(os.path.basename(pool_prefix))+1:]] = bed_fn
+  return [pool_prefix + '.pool_cache.npz', dict((ftype, fname) for (ftype, fname) in files.items() if os.path.isfile(fname))]
+
+def file_md5(fname):
+  # md5 of file contents, read in 1MB blocks (eg for bams)
+  md5_hash = hashlib.md5()
+  file_input = open_file(fname, 'rb')
+  for block in iter(lambda: file_input.read(1 << 20), ''):
+    md5_hash.update(block)
+  file_input.close()
+  return md5_hash.hexdigest()
+
+def file_stamp(fname, md5=None):
+  fstat = os.stat(fname)
+  return [os.path.basename(fname), fstat.st_size, fstat.st_mtime, md5 or file_md5(fname)]
+
+def pool_cache_valid(pool_info, files):
+  # Cache is valid if same version and source files; files with changed size/mtime are checked by md5
+  if pool_info.get('version') != POOL_CACHE_VERSION or sorted(pool_info['files']) != sorted(files):
+    return False
+  for (ftype, fname) in files.items():
+    [name, size, mtime, md5] = pool_info['files'][ftype]
+    if name != os.path.basename(fname):
+      return False
+    if [size, mtime] != file_stamp(fname, md5)[1:3] and md5 != file_md5(fname):
+      return False
+  return True
+
+def cache_text(values):
+  # Text column for pool cache, as tab-prefixed values (uint8); decoded to object array by read_pool_cache
+  return np.frombuffer(''.join('\t' + value for value in values), dtype=np.uint8)
+
+def compile_pool_cache(cache_fn, files):
+  # Parse pool resource files and write cache (to temp file, then renamed, in case of concurrent scripts)
+  if 'str_info' not in files or 'probe_info' not in files:
+    raise ValueError('Pool cache requires str_info and str_probes files', files)
+  arrays = {}
+  str_input = open_file(files['str_info'], 'r')
+  str_rows = list(csv.DictReader(str_input, delimiter='\t', quoting=csv.QUOTE_NONE))
+  str_input.close()
+  str_names = [srow['STRName'] for srow in str_rows]
+  str_ids = dict((str_name, str_id) for (str_id, str_name) in enumerate(str_names))
+
+  probe_input = open_file(files['probe_info'], 'r')
+  probe_rows = list(csv.DictReader(probe_input, delimiter='\t', quoting=csv.QUOTE_NONE))
+  probe_input.close()
+  for prow in probe_rows:
+    if prow['STRName'] not in str_ids:
+      str_ids[prow['STRName']] = len(str_names)
+      str_names.append(prow['STRName'])
+
+  for (col, hdg) in POOL_STR_COLS:
+    col_values = [srow[hdg] for srow in str_rows]
+    arrays['str.' + col] = np.array([int(value) for value in col_values], dtype=np.int32) if col == 'min_repeats' else cache_text(col_values)
+  arrays['str.name'] = cache_text(str_names)
+  arrays['probe.probe_nr'] = np.array([int(prow['Probe']) for prow in probe_rows], dtype=np.int32)
+  arrays['probe.chr']      = cache_text([prow['Chr'] for prow in probe_rows])
+  arrays['probe.start']    = np.array([int(prow['StartPos']) for prow in probe_rows], dtype=np.int64)
+  arrays['probe.str_id']   = np.array([str_ids[prow['STRName']] for prow in probe_rows], dtype=np.int32)
+  arrays['probe.strand']   = cache_text([prow['Strand'] for prow in probe_rows])
+
+  for (ftype, fname) in files.items():
+    if ftype in ['str_info', 'probe_info']:
+      continue
+    bed_input = open_file(fname, 'r')
+    bed_rows = [line.rstrip('\n').split('\t') for line in bed_input]
+    bed_rows = [bed_row for bed_row in bed_rows if len(bed_row) >= 3 and bed_row[1].isdigit()]
+    bed_input.close()
+    arrays['bed.{0}.chr'.format(ftype)]   = cache_text([bed_row[0] for bed_row in bed_rows])
+    arrays['bed.{0}.start'.format(ftype)] = np.array([int(bed_row[1]) for bed_row in bed_rows], dtype=np.int64)
+    arrays['bed.{0}.end'.format(ftype)]   = np.array([int(bed_row[2]) for bed_row in bed_rows], dtype=np.int64)
+    arrays['bed.{0}.name'.format(ftype)]  = cache_text([bed_row[3] if len(bed_row) > 3 else '' for bed_row in bed_rows])
+
+  pool_info = {'version': POOL_CACHE_VERSION, 'nr_str_info': len(str_rows),
+               'files': dict((ftype, file_stamp(fname)) for (ftype, fname) in files.items())}
+  tmp_fn = '{0}.{1}.tmp'.format(cache_fn, os.getpid())
+  cache_zip = zipfile.ZipFile(tmp_fn, 'w', zipfile.ZIP_STORED, True)
+  for (array_name, cache_array) in sorted(arrays.items()):
+    write_table_array(cache_zip, array_name, cache_array)
+  cache_zip.writestr('pool.json', json.dumps(pool_info))
+  cache_zip.close()
+  os.rename(tmp_fn, cache_fn)
+
+def read_pool_cache(cache_fn):
+  # Pool cache, with arrays grouped as: {'info': pool.json, 'strs': {col: array}, 'probes': {..}, 'beds': {type: {..}}}
+  cache_zip = zipfile.ZipFile(cache_fn, 'r')
+  pool_cache = {'info': json.loads(cache_zip.read('pool.json')), 'strs': {}, 'probes': {}, 'beds': {}}
+  for member in cache_zip.namelist():
+    if member[-4:] != '.npy':
+      continue
+    name_parts = member[:-4].split('.')
+    cache_array = read_table_array(cache_zip, member[:-4])
+    if cache_array.dtype == np.uint8:
+      cache_array = np.array(cache_array.tostring().split('\t')[1:], dtype=object)
+    if name_parts[0] == 'str':
+      pool_cache['strs'][name_parts[1]] = cache_array
+    elif name_parts[0] == 'probe':
+      pool_cache['probes'][name_parts[1]] = cache_array
+    else:
+      pool_cache['beds'].setdefault(name_parts[1], {})[name_parts[2]] = cache_array
+  cache_zip.close()
+  return pool_cache
+
+def load_pool_cache(resource_fn):
+  # Pool cache for pool of resource file; None if pool files are not found, or cache is missing or out of date
+  #   (resource text files are then read).  Loaded once per process
+  [cache_fn, files] = pool_files(resource_fn)
+  if 'str_info' not in files or 'probe_info' not in files:
+    return None
+  if ('pool_cache', cache_fn) in RESOURCE_CACHE:
+    return RESOURCE_CACHE[('pool_cache', cache_fn)]
+
+  pool_cache = None
+  if os.path.isfile(cache_fn):
+    try:
+      pool_cache = read_pool_cache(cache_fn)
+    except (zipfile.BadZipfile, KeyError, ValueError, IOError):
+      pool_cache = None
+    if pool_cache and not pool_cache_valid(pool_cache['info'], files):
+      log('info', 'Pool cache out of date, not used (rewrite with str_pool_cache.py): {0}', cache_fn)
+      pool_cache = None
+  if pool_cache:
+    pool_cache['files'] = files
+  RESOURCE_CACHE[('pool_cache', cache_fn)] = pool_cache
+  return pool_cache
+
+def pool_cache_dict(pool_cache, ftype):
+  # str_info or probe_info dict (as dict_from_csv) from pool cache arrays
+  cdict = {}
+  strs = dict((col, pool_cache['strs'][col].tolist()) for (col, hdg) in POOL_STR_COLS)
+  if ftype == 'str_info':
+    for str_id in range(pool_cache['info']['nr_str_info']):
+      cdict[strs['name'][str_id]] = {'str_motif': strs['motif'][str_id], 'min_repeats': strs['min_repeats'][str_id],
+                                     'flanking_5pr': flank_seq(strs['flank_5pr'][str_id], '5pr'), '5r_end_pos': strs['end_5pr'][str_id],
+                                     'flanking_3pr': flank_seq(strs['flank_3pr'][str_id], '3pr'), '3pr_start_pos': strs['start_3pr'][str_id]}
+  else:
+    probes = dict((col, pool_cache['probes'][col].tolist()) for col in POOL_PROBE_COLS)
+    for (probe_nr, chrom, start, str_id, strand) in zip(*[probes[col] for col in POOL_PROBE_COLS]):
+      cdict[probe_nr] = {'chromosome': chrom, 'probe_start_pos': start, 'str_name': strs['name'][str_id], 'strand': strand,
+                         'probe_reads': 0, 'motif_reads': 0, 'full_str_rds': 0}
+  return cdict
+
+#-----------------------------------------------------------------------------#
+# Genotype store: per sample read counts by motif repeats, for STRs (STRln)   #
+#   or STR/SNV alleles, from which alleles/haplotypes are determined          #
+#-----------------------------------------------------------------------------#
+# Written by str_ctlen_genotype.py (<base>.STRln_store.npz) and pstr_genotyping.py (<base>.STR_SNV.store.npz), so that
+#   final outputs can be redetermined with other THRESHOLD_VALS/MINOR_BASE_MIN, without bams (str_regenotype.py)
+# Store is a zip file of numpy arrays (as pool cache), plus store.json with version, store type and key columns:
+#   key.<col>.npy:   key values for each STR (STRln: str_name) or STR/SNV allele (STR_SNV: str_name, ref_chr, snv_pos, snv_base)
+#   nr_cts.npy:      number of motif repeats for each key; motif_rpts.npy/rds.npy: motif repeats/reads, in key order
+#   probe.<col>.npy: str_name, probe_reads, motif_reads, full_str_rds (probe counts totalled by STR)
+STORE_KEY_COLS   = {'STRln': ['str_name'], 'STR_SNV': ['str_name', 'ref_chr', 'snv_pos', 'snv_base']}
+STORE_PROBE_COLS = ['probe_reads', 'motif_reads', 'full_str_rds']
+
+def store_column(values):
+  # Integer key column as int64, otherwise text (cache_text)
+  if len(values) > 0 and all(isinstance(value, (int, long, np.integer)) for value in values):
+    return np.array(values, dtype=np.int64)
+  return cache_text([str(value) for value in values])
+
+def write_genotype_store(store_fn, store_type, summary_items, str_probe_cts):
+  # summary_items: [(key, [motif_rpts, rds]), ..] as used for determine_alleles_batch; str_probe_cts as 
+  #   pandas to_dict of probe counts by STR: {'probe_reads': {str_name: rds, ..}, 'motif_reads': {..}, ..}
+  key_cols = STORE_KEY_COLS[store_type]
+  keys = [skey if isinstance(skey, tuple) else (skey,) for (skey, svalues) in summary_items]
+  arrays = {'nr_cts': np.array([len(svalues[0]) for (skey, svalues) in summary_items], dtype=np.int64),
+            'motif_rpts': np.fromiter(itertools.chain.from_iterable(svalues[0] for (skey, svalues) in summary_items), dtype=np.float64),
+            'rds': np.fromiter(itertools.chain.from_iterable(svalues[1] for (skey, svalues) in summary_items), dtype=np.int64)}
+  for col_nr, col in enumerate(key_cols):
+    arrays['key.' + col] = store_column([skey[col_nr] for skey in keys])
+  probe_strs = sorted(str_probe_cts[STORE_PROBE_COLS[0]])
+  arrays['probe.str_name'] = cache_text(probe_strs)
+  for col in STORE_PROBE_COLS:
+    arrays['probe.' + col] = np.array([str_probe_cts[col][str_name] for str_name in probe_strs], dtype=np.int64)
+
+  store_info = {'version': GENOTYPE_STORE_VERSION, 'store_type': store_type, 'key_cols': key_cols, 'nr_keys': len(keys)}
+  tmp_fn = '{0}.{1}.tmp'.format(store_fn, os.getpid())
+  store_zip = zipfile.ZipFile(tmp_fn, 'w', zipfile.ZIP_DEFLATED, True)
+  for (array_name, store_array) in sorted(arrays.items()):
+    write_table_array(store_zip, array_name, store_array)
+  store_zip.writestr('store.json', json.dumps(store_info))
+  store_zip.close()
+  os.rename(tmp_fn, store_fn)
+
+def read_genotype_store(store_fn):
+  # Returns [store_info, summary_items, str_probe_cts], as passed to write_genotype_store
+  store_zip = zipfile.ZipFile(store_fn, 'r')
+  store_info = json.loads(store_zip.read('store.json'))
+  if store_info.get('version') != GENOTYPE_STORE_VERSION:
+    raise ValueError('Unsupported genotype store version', store_fn, store_info.get('version'))
+  arrays = {}
+  for member in store_zip.namelist():
+    if member[-4:] == '.npy':
+      store_array = read_table_array(store_zip, member[:-4])
+      arrays[member[:-4]] = store_array.tostring().split('\t')[1:] if store_array.dtype == np.uint8 else store_array.tolist()
+  store_zip.close()
+
+  key_values = [arrays['key.' + col] if store_info['nr_keys'] > 0 else [] for col in store_info['key_cols']]
+  keys = zip(*key_values) if len(key_values) > 1 else key_values[0]
+  ends = np.cumsum(arrays['nr_cts']).tolist()
+  summary_items = [(skey, [arrays['motif_rpts'][end - nr_cts:end], arrays['rds'][end - nr_cts:end]]) 
+                   for (skey, nr_cts, end) in zip(keys, arrays['nr_cts'], ends)]
+  str_probe_cts = dict((col, dict(zip(arrays['probe.str_name'], arrays['probe.' + col]))) for col in STORE_PROBE_COLS)
+  return [store_info, summary_items, str_probe_cts]
+
+def str_probe_rds(str_probe_cts, str_name):
+  # (probe reads, reads with motif, full STR reads) for STR, 0 if no probe counts for STR
+  return [str_probe_cts[col][str_name] if str_name in str_probe_cts[col] else 0 for col in STORE_PROBE_COLS]
+
+def write_strln_final(final_csv, summary_items, allele_results, str_info, str_probe_cts):
+  # Write STRln_final rows (STRLN_FINAL_HDGS) for STRs in summary_items, with alleles from determine_alleles_batch
+  final_csv.writerow(STRLN_FINAL_HDGS)
+  for (str_name, svalues), [status, str_alleles] in zip(summary_items, allele_results):
+    str_nm_info  = str_info[str_name]
+    [probe_rds, motif_rds, full_str_rds] = str_probe_rds(str_probe_cts, str_name)
+  
+    motif_cts = ', '.join("{0:.5g}".format(motif_rpts) for motif_rpts in svalues[0])
+    str_reads = ', '.join(str(str_rds) for str_rds in svalues[1])
+    allele_string = ', '.join("{0:.5g}".format(float(str_allele)) for str_allele in str_alleles)
+  
+    final_csv.writerow([str_name, str_nm_info['str_motif'], str_nm_info['min_repeats'], probe_rds, str_nm_info['flanking_5pr'],  
+                         str_nm_info['flanking_3pr'], full_str_rds, motif_cts, str_reads, allele_string])
+
+def write_str_snv_final(final_csv, summary_items, allele_results, str_info, str_probe_cts):
+  # Write STR_SNV.final rows (STR_SNV_FINAL_HDGS), one per STR/SNV allele, with alleles from determine_alleles_batch
+  final_csv.writerow(STR_SNV_FINAL_HDGS)
+  for (summ_key, svalues), [status, str_alleles] in zip(summary_items, allele_results):
+    log('debug', "{0} {1}", summ_key, svalues)
+    (str_name, snv_chr, snv_pos, snv_base) = summ_key  
+    str_nm_info = str_info[str_name]
+    [probe_rds, motif_rds, full_str_rds] = str_probe_rds(str_probe_cts, str_name)
+
+    str_reads = ', '.join(str(str_rds) for str_rds in svalues[1])
+    motif_rpts = ', '.join("{0:.5g}".format(motif_cts) for motif_cts in svalues[0])
+    allele_string = ', '.join("{0:.5g}".format(float(str_allele)) for str_allele in str_alleles)
+  
+    final_csv.writerow([str_name, str_nm_info['str_motif'], str_nm_info['min_repeats'], probe_rds, motif_rds, 
+                         str_nm_info['flanking_5pr'], str_nm_info['flanking_3pr'], full_str_rds,
+                         snv_chr, snv_pos, snv_base, sum(svalues[1]), motif_rpts, str_reads, allele_string])
+
+#-----------------------------------------------------------------------------#
+# Cohort count cube: STR read counts by motif repeats (and STR/SNV allele)    #
+#   and called alleles for many samples, from genotype stores                 #
+#-----------------------------------------------------------------------------#
+# Compiled by str_cohort_cube.py into <cohort_dir>, and extended as samples are added.  Counts are kept as record
+#   arrays (the non-zero cells of a sample x STR (or STR/SNV allele) x motif repeat cube), in segments of up to
+#   COHORT_SEGMENT_SAMPLES samples.  In each segment file (<segment>.<record type>.bin), records are grouped by key
+#   (STR or STR/SNV allele number), in sample order, with key start offsets in <segment>.<record type>.idx, so a
+#   query reads one (memory mapped) slice per segment.  Segments are merged into one when there are more than
+#   COHORT_MAX_SEGMENTS.  cohort.json has version, THRESHOLD_VALS used for alleles, samples, STRs, STR/SNV allele
+#   keys (str_name, ref_chr, snv_pos, snv_base) and segments (name, number of samples), eg:
+#   {"version": 3, "samples": ["s1", ..], "strs": ["D16S539", ..], "snv_keys": [["D16S539", "16", 86386213, "A"], ..],
+#    "segments": [["seg00000", 500], ["seg00001", 12]], "next_segment": 2, "threshold_vals": [0.45, ..]}
+#   Segment files are written before cohort.json, so an interrupted add leaves the cohort unchanged
+#   Motif repeats and alleles are float64, as in genotype stores, so fractional repeats (eg 17 bases / 3) are not rounded
+COHORT_RECORDS = {'strln_rds': [('sample', '<i4'), ('rpts', '<f8'), ('rds', '<i4')],
+                  'strln_alleles': [('sample', '<i4'), ('allele', '<f8')],
+                  'snv_rds': [('sample', '<i4'), ('rpts', '<f8'), ('rds', '<i4')],
+                  'snv_alleles': [('sample', '<i4'), ('allele', '<f8')]}
+COHORT_KEYS = {'strln_rds': 'strs', 'strln_alleles': 'strs', 'snv_rds': 'snv_keys', 'snv_alleles': 'snv_keys'}
+COHORT_SEGMENT_SAMPLES = 500
+COHORT_MAX_SEGMENTS = 16
+COHORT_MERGE_KEYS = 1000
+COHORT_RPT_TOL = 0.001
+
+def open_cohort(cohort_dir):
+  # Cohort dict: cohort.json info, key indexes, and memory mapped (read only) segment records/key offsets, eg:
+  #   {'dir': .., 'info': {..}, 'str_idx': {'D16S539': 0, ..}, 'snv_idx': {('D16S539', '16', 86386213, 'A'): 0, ..},
+  #    'segments': [{'strln_rds': [memmap([(0, 11., 119), ..]), memmap([0, 5, ..])], ..}, ..]}
+  info_fn = os.path.join(cohort_dir, 'cohort.json')
+  if os.path.isfile(info_fn):
+    info_input = open_file(info_fn, 'r')
+    info = json.load(info_input)
+    info_input.close()
+    if info.get('version') != COHORT_VERSION:
+      raise ValueError('Unsupported cohort version', cohort_dir, info.get('version'))
+  else:
+    info = {'version': COHORT_VERSION, 'threshold_vals': THRESHOLD_VALS, 'samples': [], 'strs': [], 'snv_keys': [],
+            'segments': [], 'next_segment': 0}
+  return {'dir': cohort_dir, 'info': info,
+          'sample_idx': dict((sample, sample_nr) for (sample_nr, sample) in enumerate(info['samples'])),
+          'str_idx': dict((str_name, str_nr) for (str_nr, str_name) in enumerate(info['strs'])),
+          'snv_idx': dict((tuple(snv_key), snv_nr) for (snv_nr, snv_key) in enumerate(info['snv_keys'])),
+          'segments': [open_cohort_segment(cohort_dir, seg_name) for (seg_name, nr_samples) in info['segments']]}
+
+def open_cohort_segment(cohort_dir, seg_name):
+  # {record type: [records, key offsets]} for segment, memory mapped
+  segment = {}
+  for (rec_type, rec_dtype) in COHORT_RECORDS.items():
+    seg_fn = os.path.join(cohort_dir, '{0}.{1}'.format(seg_name, rec_type))
+    key_offsets = np.memmap(seg_fn + '.idx', dtype='<i8', mode='r')
+    records = np.memmap(seg_fn + '.bin', dtype=rec_dtype, mode='r') if key_offsets[-1] > 0 else np.zeros(0, dtype=rec_dtype)
+    segment[rec_type] = [records, key_offsets]
+  return segment
+
+def cohort_sample_records(cohort, sample, store_fns):
+  # Counts and alleles of sample from its genotype stores (one STRln and/or one STR_SNV), as
+  #   {record type: [key numbers, records]}; new STR/SNV keys are added to cohort.  Alleles are determined
+  #   with THRESHOLD_VALS (as cohort threshold_vals)
+  info = cohort['info']
+  sample_nr = len(info['samples'])
+  sample_recs = {}
+  for store_fn in store_fns:
+    [store_info, summary_items, str_probe_cts] = read_genotype_store(store_fn)
+    if store_info['store_type'] == 'STRln':
+      [key_idx, key_list, rec_prefix] = [cohort['str_idx'], info['strs'], 'strln']
+    else:
+      [key_idx, key_list, rec_prefix] = [cohort['snv_idx'], info['snv_keys'], 'snv']
+    if rec_prefix + '_rds' in sample_recs:
+      raise ValueError('More than one {0} genotype store for sample'.format(store_info['store_type']), sample, store_fn)
+    for (skey, svalues) in summary_items:
+      if skey not in key_idx:
+        key_idx[skey] = len(key_list)
+        key_list.append(list(skey) if isinstance(skey, tuple) else skey)
+
+    nr_cts = np.array([len(svalues[0]) for (skey, svalues) in summary_items], dtype=np.int64)
+    rds_recs = np.zeros(nr_cts.sum(), dtype=COHORT_RECORDS[rec_prefix + '_rds'])
+    rds_recs['sample'] = sample_nr
+    rds_recs['rpts'] = list(itertools.chain.from_iterable(svalues[0] for (skey, svalues) in summary_items))
+    rds_recs['rds'] = list(itertools.chain.from_iterable(svalues[1] for (skey, svalues) in summary_items))
+    key_nrs = np.array([key_idx[skey] for (skey, svalues) in summary_items], dtype=np.int64)
+    sample_recs[rec_prefix + '_rds'] = [np.repeat(key_nrs, nr_cts), rds_recs]
+
+    allele_results = determine_alleles_batch([svalues[1] for (skey, svalues) in summary_items],
+                                             [svalues[0] for (skey, svalues) in summary_items])
+    key_alleles = [(key_idx[skey], str_allele) for ((skey, svalues), [status, str_alleles]) in zip(summary_items, allele_results)
+                   for str_allele in str_alleles]
+    allele_recs = np.zeros(len(key_alleles), dtype=COHORT_RECORDS[rec_prefix + '_alleles'])
+    allele_recs['sample'] = sample_nr
+    allele_recs['allele'] = [str_allele for (key_nr, str_allele) in key_alleles]
+    sample_recs[rec_prefix + '_alleles'] = [np.array([key_nr for (key_nr, str_allele) in key_alleles], dtype=np.int64), allele_recs]
+  return sample_recs
+
+def write_cohort_segment(cohort, seg_recs):
+  # Write new segment from {record type: [key numbers, records]} (records in sample order), grouped by key
+  #   Returns segment name
+  info = cohort['info']
+  seg_name = 'seg{0:05d}'.format(info['next_segment'])
+  info['next_segment'] += 1
+  for rec_type in COHORT_RECORDS:
+    [key_nrs, records] = seg_recs.get(rec_type, [np.zeros(0, dtype=np.int64), np.zeros(0, dtype=COHORT_RECORDS[rec_type])])
+    order = np.argsort(key_nrs, kind='mergesort')
+    key_offsets = np.searchsorted(key_nrs[order], np.arange(len(info[COHORT_KEYS[rec_type]]) + 1)).astype('<i8')
+    seg_fn = os.path.join(cohort['dir'], '{0}.{1}'.format(seg_name, rec_type))
+    records[order].tofile(seg_fn + '.bin')
+    key_offsets.tofile(seg_fn + '.idx')
+  return seg_name
+
+def cohort_add_samples(cohort, sample_stores):
+  # Add samples ([(sample, [store_fn, ..]), ..], not in cohort) to cohort, in segments of COHORT_SEGMENT_SAMPLES;
+  #   cohort.json is written after each segment.  Returns {record type: number of records added} per sample
+  info = cohort['info']
+  add_cts = []
+  for seg_start in range(0, len(sample_stores), COHORT_SEGMENT_SAMPLES):
+    seg_recs = dict((rec_type, [[], []]) for rec_type in COHORT_RECORDS)
+    for (sample, store_fns) in sample_stores[seg_start:seg_start + COHORT_SEGMENT_SAMPLES]:
+      sample_recs = cohort_sample_records(cohort, sample, store_fns)
+      for (rec_type, [key_nrs, records]) in sample_recs.items():
+        seg_recs[rec_type][0].append(key_nrs)
+        seg_recs[rec_type][1].append(records)
+      cohort['sample_idx'][sample] = len(info['samples'])
+      info['samples'].append(sample)
+      add_cts.append(dict((rec_type, len(records)) for (rec_type, [key_nrs, records]) in sample_recs.items()))
+    seg_recs = dict((rec_type, [np.concatenate(key_nrs), np.concatenate(records)]) for (rec_type, [key_nrs, records]) in seg_recs.items()
+                    if len(records) > 0)
+    seg_name = write_cohort_segment(cohort, seg_recs)
+    info['segments'].append([seg_name, len(sample_stores[seg_start:seg_start + COHORT_SEGMENT_SAMPLES])])
+    write_json_atomic(os.path.join(cohort['dir'], 'cohort.json'), info)
+    cohort['segments'].append(open_cohort_segment(cohort['dir'], seg_name))
+
+  if len(info['segments']) > COHORT_MAX_SEGMENTS:
+    merge_cohort_segments(cohort)
+  return add_cts
+
+def merge_cohort_segments(cohort):
+  # Merge all segments into one, COHORT_MERGE_KEYS keys at a time (segments are in sample order, so records of a
+  #   key stay in sample order), then remove merged segment files
+  info = cohort['info']
+  seg_name = 'seg{0:05d}'.format(info['next_segment'])
+  info['next_segment'] += 1
+  for rec_type in COHORT_RECORDS:
+    nr_keys = len(info[COHORT_KEYS[rec_type]])
+    seg_fn = os.path.join(cohort['dir'], '{0}.{1}'.format(seg_name, rec_type))
+    rec_output = open(seg_fn + '.bin', 'wb')
+    key_offsets = [np.zeros(1, dtype='<i8')]
+    nr_written = 0
+    for key_start in range(0, nr_keys, COHORT_MERGE_KEYS):
+      key_end = min(key_start + COHORT_MERGE_KEYS, nr_keys)
+      [key_nrs, records] = [[np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=COHORT_RECORDS[rec_type])]]
+      for segment in cohort['segments']:
+        [seg_records, seg_offsets] = segment[rec_type]
+        seg_keys = np.arange(key_start, min(key_end, len(seg_offsets) - 1))
+        if len(seg_keys) > 0:
+          records.append(seg_records[seg_offsets[key_start]:seg_offsets[seg_keys[-1] + 1]])
+          key_nrs.append(np.repeat(seg_keys, np.diff(seg_offsets[key_start:seg_keys[-1] + 2])))
+      [key_nrs, records] = [np.concatenate(key_nrs), np.concatenate(records)]
+      order = np.argsort(key_nrs, kind='mergesort')
+      records[order].tofile(rec_output)
+      key_offsets.append(nr_written + np.searchsorted(key_nrs[order], np.arange(key_start + 1, key_end + 1)))
+      nr_written += len(records)
+    rec_output.close()
+    np.concatenate(key_offsets).astype('<i8').tofile(seg_fn + '.idx')
+
+  merged_segs = [merged_name for (merged_name, nr_samples) in info['segments']]
+  info['segments'] = [[seg_name, len(info['samples'])]]
+  write_json_atomic(os.path.join(cohort['dir'], 'cohort.json'), info)
+  cohort['segments'] = [open_cohort_segment(cohort['dir'], seg_name)]
+  for merged_name in merged_segs:
+    for rec_type in COHORT_RECORDS:
+      for ext in ['bin', 'idx']:
+        os.remove(os.path.join(cohort['dir'], '{0}.{1}.{2}'.format(merged_name, rec_type, ext)))
+
+def cohort_key_records(cohort, rec_type, key_nr):
+  # Records of key (STR or STR/SNV allele number), in sample order: one slice of each segment
+  key_records = [records[key_offsets[key_nr]:key_offsets[key_nr + 1]] for (records, key_offsets) in
+                 [segment[rec_type] for segment in cohort['segments']] if 0 <= key_nr < len(key_offsets) - 1]
+  return np.concatenate(key_records) if key_records else np.zeros(0, dtype=COHORT_RECORDS[rec_type])
+
+def cohort_str_counts(cohort, str_name):
+  # Dense (sample x motif repeats) read counts for STR: [motif repeats array, counts array (samples x repeats)]
+  str_recs = cohort_key_records(cohort, 'strln_rds', cohort['str_idx'].get(str_name, -1))
+  [rpts, rpt_idx] = np.unique(str_recs['rpts'], return_inverse=True)
+  counts = np.zeros((len(cohort['info']['samples']), len(rpts)), dtype=np.int64)
+  np.add.at(counts, (str_recs['sample'], rpt_idx), str_recs['rds'])
+  return [rpts, counts]
+
+def cohort_allele_freqs(cohort, str_name):
+  # Allele frequencies of STR in cohort (samples with 1 allele, ie homozygous, count the allele twice), and number of
+  #   samples with allele.  Samples without alleles (-1: >2 alleles, -2: unresolved) are not counted
+  #   Returns [alleles array, frequencies array, carrier samples array, number of samples with alleles]
+  allele_recs = cohort_key_records(cohort, 'strln_alleles', cohort['str_idx'].get(str_name, -1))
+  allele_recs = allele_recs[allele_recs['allele'] >= 0]
+  sample_alleles = np.bincount(allele_recs['sample'], minlength=len(cohort['info']['samples']))
+  nr_samples = np.count_nonzero(sample_alleles)
+  [alleles, allele_idx] = np.unique(allele_recs['allele'], return_inverse=True)
+  freqs = np.bincount(allele_idx, weights=1.0 / sample_alleles[allele_recs['sample']], minlength=len(alleles)) / max(nr_samples, 1)
+  carriers = np.bincount(allele_idx, minlength=len(alleles))
+  return [alleles, freqs, carriers, nr_samples]
+
+def cohort_haplotype_samples(cohort, str_name, snv_chr, snv_pos, snv_base, str_allele):
+  # Samples with STR/SNV haplotype (SNV base with STR allele, as in haplotype_cts files), in cohort sample order
+  snv_nr = cohort['snv_idx'].get((str_name, str(snv_chr), int(snv_pos), snv_base), -1)
+  allele_recs = cohort_key_records(cohort, 'snv_alleles', snv_nr)
+  haplo_recs = allele_recs[np.abs(allele_recs['allele'] - float(str_allele)) < COHORT_RPT_TOL]
+  return [cohort['info']['samples'][sample_nr] for sample_nr in np.unique(haplo_recs['sample']).tolist()]
+
+def cohort_sample_alleles(cohort, rec_type):
+  # Number of alleles (records of strln_alleles or snv_alleles) of each sample, in cohort sample order
+  sample_cts = np.zeros(len(cohort['info']['samples']), dtype=np.int64)
+  for segment in cohort['segments']:
+    sample_cts += np.bincount(segment[rec_type][0]['sample'], minlength=len(sample_cts))
+  return sample_cts
+
 def rev_complement(seq):
   base_complement = string.maketrans('ACTGN.', 'TGACNN')
   return seq.translate(base_complement)[::-1]
@@ -152,6 +1786,100 @@ def determine_alleles(str_rds, motif_rpts):
         result = evaluate_minor_alleles(rd_ct_instances, sorted_arr, i)
   return result
   
+def determine_alleles_batch(str_rds_list, motif_rpts_list):
+  # Batch version of determine_alleles, for list of STR (or STR/SNV) read counts and motif repeats
+  #   Returns list of results, same as determine_alleles for each STR, eg: [['Done',[12,14]], ['Done',[-1]], ..]
+  nr_cts     = np.array([len(str_rds) for str_rds in str_rds_list], dtype=np.int64)
+  str_rds    = np.fromiter(itertools.chain.from_iterable(str_rds_list), dtype=np.float64, count=nr_cts.sum())
+  motif_rpts = np.fromiter(itertools.chain.from_iterable(motif_rpts_list), dtype=np.float64, count=nr_cts.sum())
+  [alleles1, alleles2] = determine_alleles_arrays(nr_cts, str_rds, motif_rpts)
+  return [['Done', [allele1]] if allele2 != allele2 else ['Done', [allele1, allele2]] 
+            for (allele1, allele2) in zip(alleles1.tolist(), alleles2.tolist())]
+
+def determine_alleles_arrays(nr_cts, str_rds, motif_rpts):
+  # Determine alleles for STRs as grouped arrays: nr_cts is # of motif repeats for each STR, str_rds/motif_rpts
+  #   are reads/motif repeats for all STRs (in STR order).  Returns arrays of 1st and 2nd allele for each STR
+  #   (2nd allele is nan if only one allele), with -1 (>2 alleles) and -2 (minor allele unresolved) as determine_alleles
+  # STRs are evaluated together as padded (STR x motif repeat) arrays, grouped by # of motif repeats so that 
+  #   padded arrays are of limited size
+  nr_strs  = len(nr_cts)
+  offsets  = np.cumsum(nr_cts) - nr_cts
+  alleles1 = np.zeros(nr_strs)
+  alleles2 = np.zeros(nr_strs)
+  widths   = np.ones(nr_strs, dtype=np.int64)
+  while (widths < nr_cts).any():
+    widths[widths < nr_cts] *= 2
+
+  for width in np.unique(widths):
+    width_strs = np.flatnonzero(widths == width)
+    batch_size = max(1, 2000000 // int(width * width))
+    for batch_start in range(0, len(width_strs), batch_size):
+      batch_strs = width_strs[batch_start:batch_start + batch_size]
+      [alleles1[batch_strs], alleles2[batch_strs]] = alleles_padded_batch(nr_cts[batch_strs], offsets[batch_strs], 
+                                                                        str_rds, motif_rpts)
+  return [alleles1, alleles2]
+
+def alleles_padded_batch(nr_cts, offsets, str_rds, motif_rpts):
+  # Evaluate alleles for STRs as padded (STR x motif repeat) arrays; see determine_alleles_arrays
+  nr_strs = len(nr_cts)
+  width   = nr_cts.max()
+  pad_rows = np.repeat(np.arange(nr_strs), nr_cts)
+  pad_cols = np.arange(nr_cts.sum()) - np.repeat(np.cumsum(nr_cts) - nr_cts, nr_cts)
+  rds     = np.full((nr_strs, width), -1, dtype=np.float64)
+  rpts    = np.zeros((nr_strs, width), dtype=np.float64)
+  rds[pad_rows, pad_cols]  = str_rds[np.repeat(offsets, nr_cts) + pad_cols]
+  rpts[pad_rows, pad_cols] = motif_rpts[np.repeat(offsets, nr_cts) + pad_cols]
+
+  # Sort each STR by reads, then motif repeats (descending), as sorted_arr in determine_alleles; padding is last
+  sort_idx = np.lexsort((-rpts, -rds))
+  row_idx  = np.arange(nr_strs)[:,None]
+  rds  = rds[row_idx, sort_idx]
+  rpts = rpts[row_idx, sort_idx]
+  valid    = rds >= 0
+  max_rds  = rds[:, 0:1]
+  max_rpts = rpts[:, 0:1]
+
+  # Number of motif repeats with same read count (rd_ct_instances), and local maximum (local_max)
+  same_rds  = (rds[:,:,None] == rds[:,None,:]) & valid[:,None,:]
+  rd_ct_instances = same_rds.sum(2)
+  in_window = (rpts[:,None,:] <= rpts[:,:,None] + 1) & (rpts[:,None,:] >= rpts[:,:,None] - 1) & valid[:,None,:]
+  local_max = rds == np.where(in_window, rds[:,None,:], -1).max(2)
+  candidate = (np.abs(rpts - max_rpts) <= 1.5) | local_max
+  candidate &= valid
+  candidate[:, 0] = False
+
+  # Motif repeat to test against threshold: same motif repeat if read count is unique (check_threshold), 
+  #   otherwise best of motif repeats with same read count (get_best_minor)
+  pot_rpts    = np.where(same_rds, rpts[:,None,:], -np.inf)
+  pot_max     = pot_rpts.max(2)
+  pot_max_diff = pot_max - max_rpts
+  nr_right    = (same_rds & (rpts[:,None,:] > max_rpts[:,:,None])).sum(2)
+  test_rpts   = np.where(pot_max_diff == -1, max_rpts - 1, pot_max)
+  nr_best     = np.where(pot_max_diff > 0, nr_right, np.where(pot_max_diff == -1, 1, rd_ct_instances))
+  test_rpts   = np.where(rd_ct_instances == 1, rpts, test_rpts)
+  nr_best     = np.where(rd_ct_instances == 1, 1, nr_best)
+
+  rpt_diff  = test_rpts - max_rpts
+  threshold = np.where(rpt_diff < -1.0001, THRESHOLD_VALS[0], np.where(rpt_diff < 0, THRESHOLD_VALS[1], 
+                       np.where(rpt_diff > 1.0001, THRESHOLD_VALS[3], THRESHOLD_VALS[2])))
+  done = candidate & (rds > max_rds * threshold)
+  first_done = done.argmax(1)
+
+  # Alleles as determine_alleles: major allele(s) if 1 motif repeat or max read count is tied, otherwise
+  #   max motif repeat plus first minor allele over threshold (or -2 if minor allele is not unique)
+  done_rpts  = test_rpts[np.arange(nr_strs), first_done]
+  done_best  = nr_best[np.arange(nr_strs), first_done]
+  minor_done = done.any(1)
+  max_ties   = rd_ct_instances[:, 0]
+  second_rpts = rpts[:, 1] if width > 1 else np.zeros(nr_strs)
+
+  alleles1 = np.where((nr_cts > 1) & (max_ties > 2), -1, rpts[:, 0])
+  alleles2 = np.where(done_best > 1, -2, done_rpts)
+  alleles2 = np.where(minor_done, alleles2, np.nan)
+  alleles2 = np.where(max_ties == 2, second_rpts, alleles2)
+  alleles2 = np.where((nr_cts == 1) | (max_ties > 2), np.nan, alleles2)
+  return [alleles1, alleles2]
+
 def evaluate_minor_alleles(rd_ct_instances, sorted_arr, i):
   max_rd_values    = sorted_arr[0]
   min_rd_values    = sorted_arr[-1]
@@ -169,7 +1897,7 @@ def evaluate_minor_alleles(rd_ct_instances, sorted_arr, i):
       best_minor = get_best_minor(potential_minor_alleles, max_rd_values)
       result = check_threshold(max_rd_values, best_minor[0])
       if len(best_minor) > 1 and result[0] == 'Done':
-        print "Best minor", best_minor, result
+        log('debug', "Best minor {0} {1}", best_minor, result)
         result = ['Done',[max_motif_rpt, -2]]
   return result
   
@@ -207,7 +1935,7 @@ def local_max_window2(sorted_arr, i):
   return True if sorted_arr[i][0] == max(rds_in_window) else False
   
 def check_threshold(max_rd_values, i_values, idx_rds=0):
-  print "Checking threshold: Max allele {0}, Test allele {1}, Reads in position: {2}".format(max_rd_values, i_values, idx_rds)
+  log('debug', "Checking threshold: Max allele {0}, Test allele {1}, Reads in position: {2}", max_rd_values, i_values, idx_rds)
   idx_mrpt       = 1 if idx_rds == 0 else 0; 
   motif_rpt_diff = float(i_values[idx_mrpt]) - float(max_rd_values[idx_mrpt])
   motif_reads    = i_values[idx_rds]
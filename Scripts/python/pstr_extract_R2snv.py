@@ -4,11 +4,23 @@
 # Name: Sue Grimes
 # Desc: Script extracts SNV reads from input bam file, using the information
 #       contained in the variant .txt file (derived from .vcf)
+#       With @variant_list (lines: <source> <variant_file>, tab-delimited, or just <variant_file>), SNV positions
+#       from all variant files (eg candidate contributors of a mixture) are extracted in one pass of the bam, using a
+#       union position index.  SNV_detail has a sources column, with the sources for which the read base is an
+#       SNV base (alt) or for which the SNV position was given (all)
 #
 # 6/12/2015: Original version
 # 10/6/2015: Modify to use file_open method for input/output files
 # 2/8/2016:  Modify to deal with vcf GT values 2/1 or 1/2 etc (multiple alt alleles)
 #            Also with case where GT is null (./.)
+# 10/18/2026: Move SNV loading/extraction methods to msi_str, for use in combined R1/R2 processing
+# 10/18/2026: Find SNVs covered by read using sorted SNV positions per chromosome, and cigar blocks (faster for large vcfs)
+# 10/18/2026: Optionally read only probe/bed regions from bam (STR_REGION_FILE env variable)
+# 10/18/2026: Optionally write SNV_detail as binary table (STR_TABLE_FORMAT env variable)
+# 10/18/2026: Get probe# with get_tag, rather than scanning tag list
+# 10/18/2026: Write stage metrics (phase timings, read/SNV counters) with msi.start_metrics/write_metrics
+# 10/18/2026: Optionally decode, process and write reads in separate threads (STR_QUEUE_DEPTH, STR_READ_BATCH, STR_BAM_THREADS)
+# 10/18/2026: Extract SNVs from several variant files (sources) in one bam pass, with @variant_list
 
 import os, sys, csv, imp, MySQLdb, pysam, msi_str as msi
 
@@ -19,8 +31,10 @@ user_home   = os.path.expanduser("~")
 # Check for valid arguments, and that files exist                             #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 if len(sys.argv) < 3:
-  print "Usage: ", script_name, "<R2bam_file> <variant_file> [all|alt] [debug]"
+  print "Usage: ", script_name, "<R2bam_file> <variant_file|@variant_list> [all|alt] [debug]"
+  print "  @variant_list: file with one <source> <variant_file> (tab-delimited), or <variant_file>, per line"
   sys.exit(1)
+msi.start_metrics(script_name)
 
 snv_filter = 'alt'
 if len(sys.argv) > 3 and sys.argv[3] in ['all', 'both']:
@@ -38,81 +52,57 @@ csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='
 sam_fn = sys.argv[1]
 sam_or_bam = sam_fn[-3:]
 if os.path.isfile(sam_fn) and os.access(sam_fn, os.R_OK):
-  sam_input = pysam.Samfile(sam_fn,'rb') if sam_or_bam == 'bam' else pysam.Samfile(sam_fn,'r')
+  sam_input = pysam.Samfile(sam_fn,'rb', **msi.BAM_OPEN_ARGS) if sam_or_bam == 'bam' else pysam.Samfile(sam_fn,'r')
 else:
   print "Unable to open {0} file for input: {1}".format(sam_or_bam, sam_fn)
   sys.exit(1)
 
-snv_input = msi.open_file(sys.argv[2], 'r')
+if sys.argv[2][0] == '@':
+  list_input = msi.open_file(sys.argv[2][1:], 'r')
+  source_fns = [fn_line.strip().split('\t') for fn_line in list_input if fn_line.strip()]
+  list_input.close()
+  source_fns = [source_fn if len(source_fn) > 1 else [source_fn[0].split('/')[-1].split('.')[0], source_fn[0]] for source_fn in source_fns]
+  source_names = [source_fn[0] for source_fn in source_fns]
+  if len(source_fns) == 0 or len(set(source_names)) < len(source_names) or [name for name in source_names if ',' in name]:
+    print "Variant list must have at least one variant file, with unique source names (without commas): {0}".format(sys.argv[2][1:])
+    sys.exit(1)
+else:
+  source_fns = None
 
 bam_fbase = sam_fn.split('/')[-1].split('.')[0]
-r2_output = msi.open_file(bam_fbase + '.SNV_detail.txt', 'w')
-snv_out_csv = csv.writer(r2_output, dialect='tab_delim')
+r2_detail = msi.open_detail(bam_fbase + '.SNV_detail.txt', msi.SNV_SRC_DTL_HDGS if source_fns else msi.SNV_DTL_HDGS, msi.SNV_DTL_TYPES)
 
 print "\n**Running {0}, with R2 bam input: {1}".format(script_name, sam_fn)
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # General methods                                                             #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
-def intersect(a1, a2):
-  return list(set(a1) & set(a2))
-  
-def snv_in_region_to_exclude(snv_index, strand, query_length, debug):
-  # Exclude any SNVs in synthetic (probe) region, or end base of read
-  if strand == 'm' and (snv_index > (query_length - 40) or snv_index == 0):
-    exclude_snv = 'Y'
-  elif strand == 'p' and (snv_index < 40 or snv_index == query_length-1):
-    exclude_snv = 'Y'
-  else:
-    exclude_snv = 'N'
-
-  if debug: print "SNV index: {0}, R2 strand: {1}, R2 length: {2}".format(snv_index, strand, query_length)
-  return exclude_snv
-  
-def get_allele_freq(snv_row):
-  allele_freq = 0
-  if len(snv_row) == 6:
-    allele_freq = snv_row[5]
-  elif len(snv_row) > 8:
-    genotype = snv_row[8].split(':')[0]
-    allele_freq = gt_to_af(genotype)
-  return allele_freq
-  
-def gt_to_af(genotype):
-# Genotypes: 0|1 or 0\1 or 1|1 or 1/2 etc.
-  allele1 = genotype[0]  #First char of string
-  allele2 = genotype[2]  #Third char of string
-  afreq   = '0'
-  
-  if allele1 == allele2: 
-    if allele1 in ['0', '1']:  # 0-homozygous ref; 1-homozygous alt1
-      afreq = allele1
-    elif allele1 == '2': # 2-homozygous alt2
-      afreq = '0,1'
-    elif allele1 == '3':
-      afreq = '0,0,1'    # 3-homozygous alt3
-    
-  elif allele1 in ['0','1'] and allele2 in ['0','1']: # heterozygous ref/alt
-    afreq = '0.5'
-  else:
-    afreq = '0.5,0.5'    # 1/2 or 2/1
-  
-  return afreq
-
-def ref_or_alt(ref_alt_bases, snv_filter):
-  if snv_filter == 'both':
-    return [ref_alt_base[0] for ref_alt_base in ref_alt_bases]
-  elif snv_filter == 'alt':
-    return [ref_alt_base[0] for ref_alt_base in ref_alt_bases if ref_alt_base[1] > 0]
-  else: #snv_filter == 'all'
-    return ['A', 'C', 'G', 'T']
- 
-def print_variant(qname, probe_nr, snv_chr, snv_pos, snv_base, ref_bases, probe_region_flag):
-  refbases    = [ref_base[0] for ref_base in ref_bases]
-  is_or_isnot = 'is not' if probe_region_flag == 'N' else 'IS'
-  msg_prefix  = ''       if probe_region_flag == 'N' else '**'
-  print "{7} {0}Base: {1} at pos: {2}:{3} {4} in probe {5} synthetic region.  Ref/Alt: {6}".format(msg_prefix, snv_base, snv_chr, snv_pos, is_or_isnot, probe_nr, refbases, qname)
-          
+def snv_batch(sam_batch):
+  # SNV_detail rows for batch of reads (see msi.overlap_reads)
+  snv_rows = []
+  for sam_row in sam_batch:
+    sam_chr = '*' if sam_row.is_unmapped else sam_input.getrname(sam_row.reference_id)
+    snv_rows += msi.r2_snv_rows(sam_row, sam_chr, sam_row.get_tag('ZP'), snv_info, snv_positions, snv_filter, debug)
+  msi.count('snv_hits', len(snv_rows))
+  return snv_rows
+
+def source_snv_batch(sam_batch):
+  # SNV_detail rows, with sources, for batch of reads, for union of source SNV positions
+  snv_rows = []
+  for sam_row in sam_batch:
+    sam_chr = '*' if sam_row.is_unmapped else sam_input.getrname(sam_row.reference_id)
+    snv_rows += msi.r2_source_snv_rows(sam_row, sam_chr, sam_row.get_tag('ZP'), union_info, snv_positions, source_names,
+                                       snv_filter, debug)
+  msi.count('snv_hits', len(snv_rows))
+  return snv_rows
+
+def read_snv_info(snv_fn):
+  snv_input = msi.open_file(snv_fn, 'r')
+  snv_reader = csv.reader(snv_input, dialect='tab_delim')
+  next(snv_reader)  #Skip header
+  snv_info = msi.snv_info_from_csv(snv_reader)
+  snv_input.close()
+  return snv_info
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Main program logic                                                          #
@@ -135,70 +125,34 @@ def print_variant(qname, probe_nr, snv_chr, snv_pos, snv_base, ref_bases, probe_
 #1	742429	rs3094315	G	A	.	PASS	AA=g;DP=132;HM2;GP=1:752566;BN=103	GT:GQ:DP	1|1:99:44
 #1	742584	rs3131972	A	G	.	PASS	AA=a;DP=160;HM3;GP=1:752721;BN=103	GT:GQ:DP	1|1:99:60
 
-snv_info = {}
-snv_reader = csv.reader(snv_input, dialect='tab_delim')
-next(snv_reader)  #Skip header
-
-snv_array = list(snv_reader)
-for snv_row in snv_array:
-  snv_chr = snv_row[0]
-  snv_pos = int(snv_row[1]) # Convert to 0-based positions for matching with pysam/bam  
-  ref_bases = snv_row[2]
-  alt_bases = snv_row[3]
-  allele_freq = get_allele_freq(snv_row)
-  if allele_freq not in ['0', '0.5', '1']:
-    continue
-  ref_alt_bases = msi.snv_ref_alt(ref_bases, alt_bases, allele_freq)
-  # Output from msi.snv_ref_alt is array of tuples:  
-  # Eg: [('G',0),('T',0.5),('C',0.5)], where first tuple is reference and can be 0 freq.
-  if snv_chr in snv_info.keys():
-    snv_info[snv_chr][snv_pos] = ref_alt_bases
-  else:
-    snv_info[snv_chr] = {snv_pos: ref_alt_bases}
+if source_fns:
+  union_info = msi.snv_union_info([read_snv_info(snv_fn) for (source_name, snv_fn) in source_fns])
+  snv_positions = msi.snv_pos_index(union_info)
+  print "Variant sources: {0}, union SNV positions: {1}".format(', '.join(source_names),
+                                                                sum(len(chr_snvs) for chr_snvs in union_info.values()))
+  msi.count('sources', len(source_fns))
+else:
+  snv_info = read_snv_info(sys.argv[2])
+  snv_positions = msi.snv_pos_index(snv_info)
 
 #-----------------------------------------------------------------------------#
 # Read bam file, and check for SNV from input list                            #
+#   Only reads in STR_REGION_FILE regions are read from bam, if specified     #
+#   (unmapped R2 reads have no SNV positions, so are not read)                #
+#   Reads are decoded/written in separate threads if STR_QUEUE_DEPTH > 0      #
 #-----------------------------------------------------------------------------#
-sam_rows = sam_input.fetch()
-snv_out_csv.writerow(['qname', 'probe_nr', 'ref_chr', 'snv_pos', 'snv_base', 'ref/alt'])
-
-for sam_row in sam_rows:
-  sam_positions = sam_row.positions
-  sam_chr = '*' if sam_row.is_unmapped else sam_input.getrname(sam_row.reference_id)
-  sam_zp_tag = [ tag[1] for tag in sam_row.tags if tag[0] == 'ZP' ]
-  probe_nr = sam_zp_tag[0]
-  r2_strand = 'm' if sam_row.is_reverse else 'p'
-  r2_length = sam_row.query_length
-  
-  if sam_chr in snv_info.keys():
-    #if debug: print "Chr: {0} Reference SNVs: {1}".format(sam_chr, snv_info[sam_chr])
-    aligned_snv_pos = intersect(snv_info[sam_chr].keys(), sam_positions)
-
-    if len(aligned_snv_pos) > 0:
-      # Get_aligned_pairs() returns position in aligned read, and chromosome coordinate for each aligned base
-      # Eg: [(0, 7142487), (1, 7142488), (2, 7142489), (3, 7142490), ...]
-      # **NOTE**: These positions are 0-based, but positions from vcf file are 1-based
-      aligned_coords = sam_row.get_aligned_pairs()
-      if debug: print "\nFound variant pos in R2: {0}, {1}:{2}".format(sam_row.qname, sam_chr, aligned_snv_pos)
-
-      for snv_pos in aligned_snv_pos:
-        snv_indices = [seq_idx for (seq_idx, chr_coord) in aligned_coords if chr_coord != None and snv_pos == chr_coord+1]
-        if debug: print "SNV indices: {0}".format(snv_indices)
-        if debug: print sam_row.qname, sam_chr, sam_positions
-        if debug: print "Aligned Coords:{0}".format(aligned_coords)
-       
-        if len(snv_indices) == 0 or snv_indices[0] == None:
-          continue
- 
-        snv_index = snv_indices[0] #There will only be one value in array due to snv_pos == chr_coord+1 if test
-        probe_region_flag = snv_in_region_to_exclude(snv_index, r2_strand, r2_length, debug)
-        sam_base = sam_row.query_alignment_sequence[snv_index]
-        ref_alt_bases = snv_info[sam_chr][snv_pos]
-
-        if debug: print_variant(sam_row.qname, probe_nr, sam_chr, snv_pos, sam_base, ref_alt_bases, probe_region_flag)
-        if probe_region_flag == 'N' and sam_base in ref_or_alt(ref_alt_bases, snv_filter):
-          snv_out_csv.writerow([sam_row.qname, probe_nr, sam_chr, snv_pos, sam_base, '/'.join(ref_alt_base[0] for ref_alt_base in ref_alt_bases)])
+regions = None
+if msi.REGION_FILE and sam_or_bam == 'bam' and sam_input.has_index():
+  regions = msi.fetch_regions(msi.REGION_FILE, msi.REGION_PAD, sam_input.references)
+  print "Fetching reads from {0} regions in: {1}".format(len(regions), msi.REGION_FILE)
+
+msi.phase('read_bam')
+sam_rows = msi.region_reads(sam_input, regions)
+nr_reads = msi.overlap_reads(sam_rows, source_snv_batch if source_fns else snv_batch,
+                             lambda snv_rows: msi.write_detail_rows(r2_detail, snv_rows))
+msi.count('reads', nr_reads)
         
+msi.phase('write_outputs')
 sam_input.close()
-snv_input.close()
-r2_output.close()
\ No newline at end of file
+msi.close_detail(r2_detail)
+msi.write_metrics(bam_fbase)
\ No newline at end of file
@@ -0,0 +1,324 @@
+#!/usr/bin/python
+
+# File: pstr_fused_str_snv.py
+# Desc: Script extracts STR reads from R1, and SNV bases from the matching R2 reads, in a single
+#       pass over both bam files, and writes STR (STRln_*) and merged STR/SNV (STR_SNV.*) outputs directly.
+#       Replaces the R1 qname extraction/Picard filter/trim/sort steps, pstr_extract_R2snv.py and
+#       pstr_merge_str_snv.py when R2 SNV positions are already known (eg. from 1000 Genomes vcf).
+#       If R2 SNV positions need to be called (FreeBayes), use the two pass process instead.
+#
+#       R1/R2 bams must both be sorted by coordinate (and indexed), or both sorted by query name.
+#       Coordinate sorted: mates are matched by qname using a buffer of reads within STR_MATE_WINDOW (default 2000)
+#       bases of the current position; STR reads with mates further apart (or on another chr), and unplaced STR
+#       reads with placed mates, are not matched, and are counted (mates_outside_window, mates_unplaced).
+#       Name sorted: R1/R2 records are grouped by qname and merge joined on qname (lexicographical or natural
+#       (samtools sort -n) order, from header SS or order of first R1 qnames), so that extra/missing records in
+#       either bam (eg supplementary alignments, filtered reads) do not affect matching of other mates
+#       (qnames only in R1 or R2 are counted: r1_only_qnames, r2_only_qnames).
+#
+# 10/18/2026: Original version
+# 10/18/2026: Dispatch reads by ZP tag (get_tag) to precomputed probe records, with probe counts in numpy array
+# 10/18/2026: Write stage metrics (phase timings, read/SNV counters) with msi.start_metrics/write_metrics
+# 10/18/2026: Buffered STRln_detail writes, optionally slim/none (STR_DETAIL_LEVEL) and compressed (STR_DETAIL_COMPRESS);
+#               only STRln_detail key values are held for mate matching
+# 10/18/2026: Optionally decompress R1/R2 bams with htslib threads (STR_BAM_THREADS)
+# 10/18/2026: Merge join name sorted bams on qname (not record#); count STR reads with mates outside window/unplaced
+# 10/18/2026: Unmatched qname/mate counts kept in script (reported whether or not metrics are written)
+
+import os, sys, csv, imp, re, itertools, collections, pysam, msi_str as msi
+
+script_name = os.path.basename(__file__)
+user_home   = os.path.expanduser("~")
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments, and that files exist                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 7:
+  print "Usage: ", script_name, "<probe_info> <str_info> <flank_snvs> <R1bam_file> <R2bam_file> <variant_file> [all|alt] [debug]"
+  sys.exit(1)
+msi.start_metrics(script_name)
+
+snv_filter = 'alt'
+if len(sys.argv) > 7 and sys.argv[7] in ['all', 'both']:
+  snv_filter = sys.argv[7]
+
+debug = False
+if len(sys.argv) > 8 and sys.argv[8] == 'debug':
+  debug = True
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Open/initialize output files and general variables                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', escapechar='', quoting=csv.QUOTE_NONE)
+
+fsnv_input   = msi.open_file(sys.argv[3], 'r')
+fsnv_csv = csv.DictReader(fsnv_input, dialect='tab_delim')
+
+sam_inputs = []
+for sam_fn in sys.argv[4:6]:
+  if sam_fn[-3:] == 'bam' and os.path.isfile(sam_fn) and os.access(sam_fn, os.R_OK):
+    sam_inputs.append(pysam.Samfile(sam_fn,'rb', **msi.BAM_OPEN_ARGS))
+  else:
+    print "Unable to open bam file for input: {0}".format(sam_fn)
+    sys.exit(1)
+[r1_input, r2_input] = sam_inputs
+
+snv_input = msi.open_file(sys.argv[6], 'r')
+
+r1_base      = sys.argv[4].split('/')[-1].split('.')[0]
+summ_output  = msi.open_file(r1_base + '.STRln_summary.txt', 'w')
+probe_output = msi.open_file(r1_base + '.STRln_probects.txt', 'w')
+strsnv_dtl_output  = msi.open_file(r1_base + '.STR_SNV.detail.txt', 'w')
+strsnv_summ_output = msi.open_file(r1_base + '.STR_SNV.summary.txt', 'w')
+
+r1_detail = msi.open_detail(r1_base + '.STRln_detail.txt', msi.R1DTL_HDGS, msi.R1DTL_TYPES, out_hdgs=msi.R1DTL_OUT_HDGS)
+
+MATE_WINDOW = msi.MATE_WINDOW
+QNAME_ORDER_READS = 10000
+
+print "\n**Running {0}, with R1 bam: {1}, R2 bam: {2}".format(script_name, sys.argv[4], sys.argv[5])
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def sort_order(sam_input):
+  hd_values = sam_input.header.get('HD', {})
+  return hd_values.get('SO', 'unknown')
+
+def natural_key(qname):
+  # Sort key for samtools sort -n (natural) order: digit runs compare as numbers, with other characters,
+  #   by ascii value (below or above digits)
+  return [(1, int(part)) if part.isdigit() else (0 if part < '0' else 2, part) for part in re.split(r'(\d+)', qname) if part]
+
+def qname_order(sam_fn, sam_input):
+  # Query name sort key function: from header sub-sort (SS queryname:natural or queryname:lexicographical),
+  #   otherwise natural if first QNAME_ORDER_READS R1 qnames are in natural but not lexicographical order
+  ss_value = sam_input.header.get('HD', {}).get('SS', '')
+  if ss_value in ['queryname:natural', 'queryname:lexicographical']:
+    return natural_key if ss_value == 'queryname:natural' else None
+  order_input = pysam.Samfile(sam_fn, 'rb')
+  qnames = [qname for (qname, sam_rows) in itertools.groupby(itertools.islice(order_input.fetch(until_eof=True), QNAME_ORDER_READS),
+                                                              key=lambda sam_row: sam_row.qname)]
+  order_input.close()
+  lexical_order = all(qname1 <= qname2 for (qname1, qname2) in zip(qnames, qnames[1:]))
+  natural_order = all(natural_key(qname1) <= natural_key(qname2) for (qname1, qname2) in zip(qnames, qnames[1:]))
+  return natural_key if natural_order and not lexical_order else None
+
+def qname_groups(sam_input, qname_key):
+  # Returns (sort key, qname, [bam reads]) for each qname in name sorted bam (all records with qname, including
+  #   secondary/supplementary); qnames out of sort order are counted (qname_order_errors)
+  prev_key = None
+  for (qname, sam_rows) in itertools.groupby(sam_input.fetch(until_eof=True), key=lambda sam_row: sam_row.qname):
+    sort_key = qname_key(qname) if qname_key else qname
+    if prev_key != None and sort_key < prev_key:
+      mate_cts['qname_order_errors'] += 1
+    prev_key = sort_key
+    yield (sort_key, qname, list(sam_rows))
+
+def sam_stream(sam_input, regions):
+  # Returns (stream key, bam read) for each read in coordinate sorted bam.  Stream key is (chr id, position),
+  #   so that R1 and R2 streams can be interleaved
+  #   Unmapped reads without coordinates (STR_FETCH_UNMAPPED) are keyed after last chr, by record#
+  nr_refs = sam_input.nreferences
+  for read_nr, sam_row in enumerate(msi.region_reads(sam_input, regions, msi.FETCH_UNMAPPED)):
+    if sam_row.reference_id < 0:
+      yield ((nr_refs, read_nr), sam_row)
+    else:
+      yield ((sam_row.reference_id, sam_row.pos), sam_row)
+
+def add_r1_read(stream_key, sam_row):
+  # Check R1 read for STR; STR reads (key values) are held until R2 mates within window have been read
+  probe_rec = probe_recs.get(sam_row.get_tag('ZP'))
+  if not probe_rec:
+    return
+
+  str_dtl_row = msi.str_read_call(r1_input, sam_row, probe_rec, probe_cts, ref_flank_rds)
+  if str_dtl_row:
+    msi.write_detail_rows(r1_detail, [str_dtl_row])
+    str_key_values = msi.r1dtl_key_values(str_dtl_row)
+    if not name_sorted:
+      count_unmatched_mate(sam_row)
+    qname = sam_row.qname
+    if qname in pending_r1:
+      pending_r1[qname][1].append(str_key_values)
+    else:
+      mate_snv_rows = list(pending_r2[qname][1]) if qname in pending_r2 else []
+      pending_r1[qname] = [stream_key, [str_key_values], mate_snv_rows]
+
+def add_r2_read(stream_key, sam_row):
+  # Extract SNV bases from R2 read; R2 reads with SNVs are held until R1 mates within window have been read
+  sam_chr   = '*' if sam_row.is_unmapped else r2_input.getrname(sam_row.reference_id)
+  snv_rows  = msi.r2_snv_rows(sam_row, sam_chr, sam_row.get_tag('ZP'), snv_info, snv_positions, snv_filter, debug)
+  if len(snv_rows) == 0:
+    return
+  msi.count('snv_hits', len(snv_rows))
+
+  qname = sam_row.qname
+  if qname in pending_r1:
+    pending_r1[qname][2] += snv_rows
+  if qname in pending_r2:
+    pending_r2[qname][1] += snv_rows
+  else:
+    pending_r2[qname] = [stream_key, snv_rows]
+
+def count_unmatched_mate(sam_row):
+  # Count (coordinate sorted) STR read whose mate cannot be matched: mate on another chr or more than
+  #   MATE_WINDOW bases away, or read unplaced (keyed by record#, after last chr) with a placed mate
+  if not sam_row.is_paired or sam_row.mate_is_unmapped or sam_row.next_reference_id < 0:
+    return
+  if sam_row.reference_id < 0:
+    mate_cts['mates_unplaced'] += 1
+  elif sam_row.next_reference_id != sam_row.reference_id or abs(sam_row.next_reference_start - sam_row.pos) > MATE_WINDOW:
+    mate_cts['mates_outside_window'] += 1
+
+def count_r1_mates(r1_values):
+  # Count STR/SNV combinations for STR read(s) and matching R2 SNVs (same qname and probe#)
+  [stream_key, str_key_rows, mate_snv_rows] = r1_values
+  for str_key_values in str_key_rows:
+    snv_rows = [snv_row for snv_row in mate_snv_rows if snv_row[1] == str_key_values[1]]
+    msi.str_snv_counts(str_cts, snv_cts, str_key_values, snv_rows)
+
+def outside_window(pending_key, stream_key):
+  return pending_key[0] != stream_key[0] or pending_key[1] < stream_key[1] - MATE_WINDOW
+
+def release_mates(stream_key):
+  # Release buffered reads which are too far behind the current stream position to have a mate still to come
+  while len(pending_r1) > 0:
+    (qname, r1_values) = next(pending_r1.iteritems())
+    if not outside_window(r1_values[0], stream_key):
+      break
+    count_r1_mates(pending_r1.pop(qname))
+
+  while len(pending_r2) > 0:
+    (qname, r2_values) = next(pending_r2.iteritems())
+    if not outside_window(r2_values[0], stream_key):
+      break
+    del pending_r2[qname]
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+#-----------------------------------------------------------------------------#
+# Create probe_info and str_info dictionaries, and load R2 SNV positions      #
+#-----------------------------------------------------------------------------#
+str_info   = msi.dict_from_file(sys.argv[2], 'str_info')
+probe_info = msi.dict_from_file(sys.argv[1], 'probe_info')
+str_info   = msi.add_flank_alleles(str_info, fsnv_csv)
+str_matchers = msi.flank_matchers(str_info)
+probe_recs = msi.probe_records(probe_info, str_info, str_matchers)
+
+snv_reader = csv.reader(snv_input, dialect='tab_delim')
+next(snv_reader)  #Skip header
+snv_info = msi.snv_info_from_csv(snv_reader)
+snv_positions = msi.snv_pos_index(snv_info)
+
+#-----------------------------------------------------------------------------#
+# Read R1 and R2 bams together, in order of stream key (position) or qname    #
+#-----------------------------------------------------------------------------#
+sort_orders = [sort_order(r1_input), sort_order(r2_input)]
+if sort_orders == ['queryname', 'queryname']:
+  name_sorted = True
+elif sort_orders == ['coordinate', 'coordinate'] and r1_input.has_index() and r2_input.has_index():
+  name_sorted = False
+else:
+  print "R1/R2 bams must both be indexed and sorted by coordinate, or both sorted by query name: {0}".format(sort_orders)
+  sys.exit(1)
+
+# Only reads in STR_REGION_FILE regions are read from (coordinate sorted) bams, if specified
+regions = None
+if msi.REGION_FILE and not name_sorted:
+  regions = msi.fetch_regions(msi.REGION_FILE, msi.REGION_PAD, r1_input.references)
+  print "Fetching reads from {0} regions in: {1}".format(len(regions), msi.REGION_FILE)
+
+msi.phase('read_bams')
+probe_cts = msi.new_probe_cts(probe_info); ref_flank_rds = {}
+str_cts = {}; snv_cts = {}; nr_r1_reads = 0; nr_r2_reads = 0
+pending_r1 = collections.OrderedDict(); pending_r2 = collections.OrderedDict()
+# Unmatched qname/mate counts, for report (kept here, as metrics counters are only kept if STR_METRICS=Y)
+mate_cts = {'r1_only_qnames': 0, 'r2_only_qnames': 0, 'qname_order_errors': 0, 'mates_outside_window': 0, 'mates_unplaced': 0}
+
+if name_sorted:
+  # Merge join of qname groups: all mates of a qname have been read when groups are joined, so buffered reads
+  #   are counted/released after each qname
+  qname_key = qname_order(sys.argv[4], r1_input)
+  print "Query name order: {0}".format('natural' if qname_key else 'lexicographical')
+  r1_groups = qname_groups(r1_input, qname_key)
+  r2_groups = qname_groups(r2_input, qname_key)
+  r1_next = next(r1_groups, None)
+  r2_next = next(r2_groups, None)
+
+  while r1_next or r2_next:
+    r1_rows = []; r2_rows = []
+    if r2_next == None or (r1_next and r1_next[0] < r2_next[0]):
+      mate_cts['r1_only_qnames'] += 1
+      r1_rows = r1_next[2]; r1_next = next(r1_groups, None)
+    elif r1_next == None or r2_next[0] < r1_next[0]:
+      mate_cts['r2_only_qnames'] += 1
+      r2_rows = r2_next[2]; r2_next = next(r2_groups, None)
+    else:
+      r1_rows = r1_next[2]; r1_next = next(r1_groups, None)
+      r2_rows = r2_next[2]; r2_next = next(r2_groups, None)
+    for sam_row in r1_rows:
+      add_r1_read((0, 0), sam_row)
+    for sam_row in r2_rows:
+      add_r2_read((0, 0), sam_row)
+    [nr_r1_reads, nr_r2_reads] = [nr_r1_reads + len(r1_rows), nr_r2_reads + len(r2_rows)]
+    for r1_values in pending_r1.values():
+      count_r1_mates(r1_values)
+    pending_r1.clear(); pending_r2.clear()
+
+else:
+  r1_stream = sam_stream(r1_input, regions)
+  r2_stream = sam_stream(r2_input, regions)
+  r1_next = next(r1_stream, None)
+  r2_next = next(r2_stream, None)
+
+  while r1_next or r2_next:
+    if r2_next == None or (r1_next and r1_next[0] <= r2_next[0]):
+      (stream_key, sam_row) = r1_next
+      add_r1_read(stream_key, sam_row)
+      nr_r1_reads += 1
+      r1_next = next(r1_stream, None)
+    else:
+      (stream_key, sam_row) = r2_next
+      add_r2_read(stream_key, sam_row)
+      nr_r2_reads += 1
+      r2_next = next(r2_stream, None)
+    release_mates(stream_key)
+
+  for r1_values in pending_r1.values():
+    count_r1_mates(r1_values)
+
+msi.count('r1_reads', nr_r1_reads)
+msi.add_counters(mate_cts)
+msi.count('r2_reads', nr_r2_reads)
+if name_sorted:
+  print "Qnames only in R1: {0}, only in R2: {1}, out of sort order: {2}".format(mate_cts['r1_only_qnames'],
+          mate_cts['r2_only_qnames'], mate_cts['qname_order_errors'])
+  if mate_cts['qname_order_errors'] > 0:
+    print "*Warning - R1/R2 bams are not in the same query name order, mates of qnames out of order are not matched"
+else:
+  print "STR reads with mates not matched: mate more than {0} bases away or on another chr: {1}, read unplaced: {2}".format(MATE_WINDOW,
+          mate_cts['mates_outside_window'], mate_cts['mates_unplaced'])
+for (counter, probe_col) in [('probe_reads', 0), ('motif_reads', 1), ('flank_matches', 2)]:
+  msi.count(counter, int(probe_cts[:, probe_col].sum()))
+msi.phase('write_outputs')
+
+#-----------------------------------------------------------------------------#
+# Write STR summary, probe count, and merged STR/SNV outputs                  #
+#-----------------------------------------------------------------------------#
+msi.write_str_summary(csv.writer(summ_output, dialect='tab_delim'), ref_flank_rds, msi.str_tot_reads(probe_recs, probe_cts), str_info)
+msi.write_probe_cts(csv.DictWriter(probe_output, msi.PROBE_CT_HDGS, dialect='tab_delim'), probe_info, probe_cts)
+msi.write_str_snv_counts(csv.writer(strsnv_dtl_output, dialect='tab_delim'), csv.writer(strsnv_summ_output, dialect='tab_delim'),
+                         str_cts, snv_cts)
+
+# Close input/output files
+r1_input.close()
+r2_input.close()
+snv_input.close()
+msi.close_detail(r1_detail)
+summ_output.close()
+probe_output.close()
+strsnv_dtl_output.close()
+strsnv_summ_output.close()
+msi.write_metrics(r1_base)
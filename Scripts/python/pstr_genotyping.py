@@ -9,6 +9,10 @@
 # 10/19/2015: Use pandas to create summary file
 # **NOTE: Some input file and dictionary examples need to be modified **
 # 11/18/2015: Use new method (from GiWon) for determination of alleles
+# 10/18/2026: Determine alleles for all STRs in one batch (msi.determine_alleles_batch)
+# 10/18/2026: Write stage metrics (phase timings, counters); per STR/SNV print only at debug log level
+# 10/18/2026: Write genotype store (<base>.STR_SNV.store.npz) for str_regenotype.py; final rows written by msi.write_str_snv_final
+# 10/18/2026: Optional store=<file> parameter, genotype store file name (eg named by sample, str_batch_genotype.py)
 
 import os, sys, csv, imp, pysam, numpy as np, pandas as pd, msi_str as msi
 from decimal import Decimal
@@ -20,23 +24,27 @@ user_home   = os.path.expanduser("~")
 # Check for valid arguments, and that files exist                             #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 if len(sys.argv) < 4:
-  print "Usage: ", script_name, "<str_snv_summary_file> <str_info> <probe_cts> [debug]"
+  print "Usage: ", script_name, "<str_snv_summary_file> <str_info> <probe_cts> [debug] [store=<genotype_store>]"
   sys.exit(1)
+msi.start_metrics(script_name)
 
 debug = False
 if len(sys.argv) > 4 and sys.argv[4] == 'debug':
   debug = True 
 
+store_fn = None
+for arg in sys.argv[4:]:
+  if arg[0:6] == 'store=':
+    store_fn = arg[6:]
+
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Open/initialize output files and general variables                          #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', quoting=csv.QUOTE_NONE)
 
 summ_input  = msi.open_file(sys.argv[1], 'r')
-str_input   = msi.open_file(sys.argv[2], 'r')
 probe_input = msi.open_file(sys.argv[3], 'r')
 
-str_csv = csv.DictReader(str_input, dialect='tab_delim')
 summ_fbase = sys.argv[1].split('/')[-1].split('.')[0] 
 
 final_output = msi.open_file(summ_fbase + '.STR_SNV.final.txt', 'w')
@@ -62,7 +70,7 @@ print "Parameters: Flank size: {0}".format(FLANK_SIZE)
 # STR input example:
 #  STRName	Motif	MinRepeat	5PrEnd	5PrFlank		3PrStart	3PrFlank
 #  PIK3CA	A		5			6273772 GCTGAAGCAATCAGG	6273799		CTCGAAGTATGTTGC
-str_info   = msi.dict_from_csv(str_csv, 'str_info')
+str_info   = msi.dict_from_file(sys.argv[2], 'str_info')
 
 #-----------------------------------------------------------------------------#
 # Read probe/str counts file, and load into dictionary                        #
@@ -90,6 +98,7 @@ if debug: print "\nSTR Probe Counts:\n{0}".format(str_probe_cts)
 #D7S820	M	AATCTGTC	GTTAGTTC	8	673	7	83789477	N	2
 #D7S820	M	AATCTGTC	GTTAGTTC	8	673	7	83789477	T	1
 
+msi.phase('groupby')
 df_summ = pd.read_csv(summ_input,sep='\t',usecols=['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_cnt', 'snv_ct'], 
                                  dtype={'ref_chr': str, 'motif_cnt': float})
 df_summ = df_summ[df_summ.ref_chr != '-']
@@ -112,30 +121,19 @@ if debug: print "\nSummary STR dictionary:\n{0}".format(summary_str)
 #   ('trf605629', '4', 60021715, 'G'): [[17.5, 18.5], [196, 2]],
 #   ('trf873648_trf873649', '9', 105984015, 'A'): [[25.75, 27.75], [2, 3]], ...
 # 
-final_csv = csv.writer(final_output, dialect='tab_delim')
-final_hdgs = ['STR name', 'Motif', 'Min Rpts', 'Probe Rds', 'Rds w/motif', 'Flank-5pr', 'Flank-3pr', 'Full STR Rds', 'Ref Chr', 'SNV Pos',
-               'SNV Allele', 'SNV Reads', 'Motif Rpts', 'Motif Rpt Rds', 'STR Allele(s)']
-final_csv.writerow(final_hdgs)
-
-for summ_key, svalues in sorted(summary_str.items()):
-  print summ_key, svalues
-  (str_name, snv_chr, snv_pos, snv_base) = summ_key  
-  str_nm_info = str_info[str_name]
- 
-  probe_rds = str_probe_cts['probe_reads'][str_name] if str_name in str_probe_cts['probe_reads'] else 0
-  motif_rds   = str_probe_cts['motif_reads'][str_name] if str_name in str_probe_cts['motif_reads'] else 0
-  full_str_rds = str_probe_cts['full_str_rds'][str_name] if str_name in str_probe_cts['full_str_rds'] else 0
-
-  str_reads = ', '.join(str(str_rds) for str_rds in svalues[1])
-  motif_rpts = ', '.join("{0:.5g}".format(motif_cts) for motif_cts in svalues[0])
-  [status, str_alleles] = msi.determine_alleles(svalues[1], svalues[0])
-  allele_string = ', '.join("{0:.5g}".format(float(str_allele)) for str_allele in str_alleles)
-  
-  final_csv.writerow([str_name, str_nm_info['str_motif'], str_nm_info['min_repeats'], probe_rds, motif_rds, 
-                       str_nm_info['flanking_5pr'], str_nm_info['flanking_3pr'], full_str_rds,
-                       snv_chr, snv_pos, snv_base, sum(svalues[1]), motif_rpts, str_reads, allele_string])
+msi.phase('call_alleles')
+summary_items  = sorted(summary_str.items())
+msi.count('str_snv_alleles', len(summary_items))
+allele_results = msi.determine_alleles_batch([svalues[1] for (summ_key, svalues) in summary_items],
+                                             [svalues[0] for (summ_key, svalues) in summary_items])
+
+msi.phase('write_outputs')
+msi.write_str_snv_final(final_csv, summary_items, allele_results, str_info, str_probe_cts)
+
+# Keep STR/SNV read counts by motif repeats (genotype store), for redetermining alleles (str_regenotype.py)
+msi.write_genotype_store(store_fn or summ_fbase + '.STR_SNV.store.npz', 'STR_SNV', summary_items, str_probe_cts)
 
 # Close input/output files
 summ_input.close()
-str_input.close()
 final_output.close()
+msi.write_metrics(summ_fbase)
@@ -11,8 +11,13 @@
 #             Use pandas for some of the data structure manipulation/sorting
 # 2/16/2016:  Modify to handle case where same read counts for top 2 alleles,
 #             Sort by str repeat count (ascending) to pick highest repeat count as major.
+# 10/18/2026: Write stage metrics (per major/all run); per STR/SNV position print only at debug log level
+# 10/18/2026: Determine major haplotypes with dict/list accumulators, rather than pandas DataFrames per STR/SNV
+#             position (same output, including order of tied read counts).  Bulk mode: @<file_list> processes
+#             all STR_SNV.final files in list in one process
+# 10/18/2026: MINOR_BASE_MIN from msi (STR_MINOR_BASE_MIN env variable)
 
-import os, sys, csv, imp, pandas as pd, msi_str as msi
+import os, sys, csv, imp, numpy as np, msi_str as msi
 from decimal import Decimal
 from collections import OrderedDict
 
@@ -23,7 +28,8 @@ user_home   = os.path.expanduser("~")
 # Check for valid arguments, and that files exist                             #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 if len(sys.argv) < 2:
-  print "Usage: ", script_name, "<str_snv_final_file> [major|all]"
+  print "Usage: ", script_name, "<str_snv_final_file|@file_list> [major|all]"
+  print "  @file_list: file with one STR_SNV.final file name per line, processed in one run"
   sys.exit(1)
 
 alleles_to_report = 'all'
@@ -34,21 +40,19 @@ debug = False
 if len(sys.argv) > 3 and sys.argv[3] == 'debug':
   debug = True 
 
-MINOR_BASE_MIN = 0.15
+MINOR_BASE_MIN = msi.MINOR_BASE_MIN
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Open/initialize output files and general variables                          #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', quoting=csv.QUOTE_NONE)
 
-strsnv_input  = msi.open_file(sys.argv[1], 'r')
-strsnv_csv = csv.DictReader(strsnv_input, dialect='tab_delim') 
-
-haplo_fbase = sys.argv[1].split('/')[-1].split('.')[0]
-haplo_output = msi.open_file(haplo_fbase + '.haplotype_cts_' + alleles_to_report + '.txt', 'w')
-haplo_csv = csv.writer(haplo_output, dialect='tab_delim')
-
-print "\n**Running {0}, with STR-SNV input: {1}".format(script_name, sys.argv[1])
+if sys.argv[1][0] == '@':
+  list_input = msi.open_file(sys.argv[1][1:], 'r')
+  strsnv_fns = [fn_line.strip() for fn_line in list_input if fn_line.strip()]
+  list_input.close()
+else:
+  strsnv_fns = [sys.argv[1]]
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # General methods                                                             #
@@ -64,17 +68,23 @@ def extract_haplotypes(crow):
     haplo_tuples.append((snv_base, allele, snv_reads[i]))
   if debug: print "Haplotype tuples (all): {0}".format(haplo_tuples)
   return haplo_tuples
-  
+
+def rds_descending(key_rds):
+  # [[key, rds], ..] in descending order of reads, for {key: rds} accumulator.  Keys are sorted first, and reads
+  #   ordered as by pandas sort_values(ascending=False) (quicksort of reversed values, reversed), as previously
+  #   used after groupby, so that tied read counts are in the same order
+  key_rds = sorted(key_rds.items())
+  rev_rds = np.array([rds for (key, rds) in reversed(key_rds)], dtype=np.int64)
+  return [list(key_rds[len(key_rds) - 1 - i]) for i in rev_rds.argsort(kind='quicksort')[::-1]]
+
 def determine_haplotypes(snv_allele_rds):
 # snv_allele_rds: [(C,11,889),(T,11,926),(T,10,454)]
-  df = pd.DataFrame(snv_allele_rds, columns=['base', 'str_rpt', 'rds'])
-  df_bases = df.groupby(['base']).sum().reset_index()
-  df_bases.sort_values(by='rds', ascending=False, inplace=True)
-  major_bases = major_snv_bases(df_bases)
-  
-  df_repeats = df.groupby(['str_rpt']).sum().reset_index()
-  df_repeats.sort_values(by='rds', ascending=False, inplace=True) 
-  all_rpt_alleles =  df_repeats.values.tolist()
+  base_rds = {}; rpt_rds = {}
+  for (base, str_rpt, rds) in snv_allele_rds:
+    base_rds[base] = base_rds.get(base, 0) + rds
+    rpt_rds[str_rpt] = rpt_rds.get(str_rpt, 0) + rds
+  major_bases = major_snv_bases(rds_descending(base_rds))
+  all_rpt_alleles = rds_descending(rpt_rds)
   
   status = 'None'
   if len(all_rpt_alleles) > 1:
@@ -100,20 +110,22 @@ def determine_haplotypes(snv_allele_rds):
   else:
     return snv_allele_rds
   
-def major_snv_bases(df_bases):
+def major_snv_bases(bases_reads):
   # Need to add logic for case where >2 bases, and 2nd & 3rd base #reads are equal?
   # Eg. [['A',10], ['G',3], ['T',3]]
-  bases_reads = df_bases.values.tolist()
   if len(bases_reads) == 1 or (bases_reads[1][1] < (bases_reads[0][1] * MINOR_BASE_MIN)):
     return [bases_reads[0][0]]
   else:
     return [bases_reads[0][0], bases_reads[1][0]]
  
 def major_haplotypes(potential_alleles):
-  dfa = pd.DataFrame(potential_alleles, columns=['base', 'str_rpt', 'rds'])
-  dfg = dfa.groupby(['base','str_rpt']).sum().reset_index()
-  dfg.sort_values(by=['rds', 'str_rpt'], ascending=False, inplace=True)
-  alleles_srted = dfg.values.tolist()
+  # Haplotype reads by (base, str_rpt), sorted by reads then str_rpt (as text), descending; ties stay in
+  #   (base, str_rpt) order (stable sort, as pandas multi-column sort_values)
+  haplo_rds = {}
+  for (base, str_rpt, rds) in potential_alleles:
+    haplo_rds[(base, str_rpt)] = haplo_rds.get((base, str_rpt), 0) + rds
+  alleles_srted = sorted(([base, str_rpt, rds] for ((base, str_rpt), rds) in sorted(haplo_rds.items())),
+                         key=lambda allele_rds: (allele_rds[2], allele_rds[1]), reverse=True)
   final_alleles = [alleles_srted[0]]
   
   for i in range(1,len(alleles_srted)):
@@ -122,8 +134,8 @@ def major_haplotypes(potential_alleles):
       break
   return final_alleles  
 
-def format_haplo_csv(snv_allele_rds):
-# snv_allele_rds: [(C,11,889),(T,11,926),(T,10,454)]
+def format_haplo_csv(str_snv_pos, snv_allele_rds):
+# str_snv_pos: (STR name, SNV chr, SNV pos), snv_allele_rds: [(C,11,889),(T,11,926),(T,10,454)]
   alleles_rds_srted = sorted(snv_allele_rds, key=lambda x: int(x[2]), reverse=True)
   haplotypes  = [('-').join([base, str_allele]) for (base, str_allele, allele_rds) in alleles_rds_srted]
   
@@ -137,10 +149,54 @@ def format_haplo_csv(snv_allele_rds):
   tot_snv_reads = sum(haplo_rds)
   hap_rd_pcts  = [(allele_rds * 100.00/tot_snv_reads) for (base, str_allele, allele_rds) in alleles_rds_srted]
   
-  return [last_str, last_chr, last_pos, tot_snv_reads, ','.join(snv_bases_uniq), ','.join(str_alleles_uniq),
+  return list(str_snv_pos) + [tot_snv_reads, ','.join(snv_bases_uniq), ','.join(str_alleles_uniq),
             ','.join(haplotypes), ','.join([str(rds) for rds in haplo_rds]),
             ','.join(["{0:.2f}".format(hap_rd_pct) for hap_rd_pct in hap_rd_pcts])] 
   
+def str_snv_groups(strsnv_csv):
+  # Yield ((STR name, SNV chr, SNV pos), haplotype tuples) for each run of rows with same STR/SNV position
+  last_str_snv = None; snv_alleles = []
+  for crow in strsnv_csv:
+    str_snv_pos = (crow['STR name'], crow['Ref Chr'], crow['SNV Pos'])
+    if str_snv_pos != last_str_snv and last_str_snv != None:
+      yield (last_str_snv, snv_alleles)
+      snv_alleles = []
+    snv_alleles += extract_haplotypes(crow)
+    last_str_snv = str_snv_pos
+  if last_str_snv != None:
+    yield (last_str_snv, snv_alleles)
+
+def write_haplotypes(strsnv_fn):
+  # Write <base>.haplotype_cts_<major|all>.txt for STR_SNV.final file (and stage metrics)
+  msi.start_metrics('pstr_haplotype_cts_' + alleles_to_report)
+  print "\n**Running {0}, with STR-SNV input: {1}".format(script_name, strsnv_fn)
+  strsnv_input = msi.open_file(strsnv_fn, 'r')
+  strsnv_csv = csv.DictReader(strsnv_input, dialect='tab_delim') 
+
+  haplo_fbase = strsnv_fn.split('/')[-1].split('.')[0]
+  haplo_output = msi.open_file(haplo_fbase + '.haplotype_cts_' + alleles_to_report + '.txt', 'w')
+  haplo_csv = csv.writer(haplo_output, dialect='tab_delim')
+  haplo_csv.writerow(['STR Name', 'SNV Chr', 'SNV Pos', 'SNV Reads', 'SNV Bases', 'STR Alleles', 'Haplotypes', 'Reads', 'Read Pcts'])
+
+  msi.phase('haplotypes')
+  for (str_snv_pos, snv_alleles) in str_snv_groups(strsnv_csv):
+    # Have all data for STR/SNV position, so determine and write out haplotype reads
+    msi.log('debug', "Generating output row for {0}, {1}, {2}", *str_snv_pos)
+    msi.count('str_snv_positions')
+    if debug: print snv_alleles
+
+    final_alleles = snv_alleles
+    if alleles_to_report == 'major':
+      final_alleles = determine_haplotypes(snv_alleles)
+    if len(final_alleles) > 0:
+      haplo_csv.writerow(format_haplo_csv(str_snv_pos, final_alleles))
+    else:
+      print "*Error - empty array.  SNV alleles: {0}".format(snv_alleles)
+
+  strsnv_input.close()
+  haplo_output.close()
+  msi.write_metrics(haplo_fbase)
+
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Main program logic                                                          #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
@@ -157,58 +213,7 @@ def format_haplo_csv(snv_allele_rds):
 # ATM_2		11		108143311	32			A			4		A-4			32
 # BRCA1_1	17		41215825	2311		C,T			4		C-4,T-4		1180,1130
 # BRCA1_2	17		41245466	2750		A,G			8		A-8,G-8		1445,1294
-
-last_chr = 'N'; last_pos = 0; last_str = 'None'; 
-snv_alleles = {}
-haplo_csv.writerow(['STR Name', 'SNV Chr', 'SNV Pos', 'SNV Reads', 'SNV Bases', 'STR Alleles', 'Haplotypes', 'Reads', 'Read Pcts'])
-
-for crow in strsnv_csv:
-  # Accumulate all records for this STR (all SNV bases)
-  this_chr = crow['Ref Chr']
-  this_pos = crow['SNV Pos']
-  this_str = crow['STR name']
-  str_snv_pos = ('-').join([this_str, this_chr, str(this_pos)])
-  
-  if last_chr != 'N' and (this_chr != last_chr or this_pos != last_pos or this_str != last_str):
-    # Have all data for previous SNV position, so determine and write out haplotype reads
-    print "Generating output row for {0}, {1}, {2}".format(last_str, last_chr, last_pos)
-    if debug: print snv_alleles[last_str_snv]
-   
-    final_alleles = snv_alleles[last_str_snv]
-    if alleles_to_report == 'major':
-      final_alleles = determine_haplotypes(snv_alleles[last_str_snv])
-    if final_alleles and len(final_alleles) > 0:
-      haplo_csv.writerow(format_haplo_csv(final_alleles))
-    else:
-      print "*Error - empty array.  SNV alleles: {0}".format(snv_alleles[last_str_snv])
- 
-    # Then reset STR/SNV accumulators
-    snv_alleles = {}
-    snv_alleles[str_snv_pos] = extract_haplotypes(crow)
-  
-  else:
-    if (this_str == last_str and this_chr == last_chr and this_pos == last_pos):
-      # Keep accumulating data for this STR/SNV position combination
-      # Eg: snv_alleles:  {'ASTE1-3-130733039': [(C,11,889),(T,11,926),(T,10,454)]}
-
-      snv_alleles[str_snv_pos] += extract_haplotypes(crow)
-    else:
-      snv_alleles[str_snv_pos] = extract_haplotypes(crow)
-      
-  last_chr = this_chr
-  last_pos = this_pos
-  last_str = this_str
-  last_str_snv = str_snv_pos
-    
-# Process last STR-SNV
-final_alleles = snv_alleles[last_str_snv]
-if alleles_to_report == 'major':
-  final_alleles = determine_haplotypes(snv_alleles[last_str_snv])
-if len(final_alleles) > 0:
-  haplo_csv.writerow(format_haplo_csv(final_alleles))
-else:
-  print "*Error - empty array.  SNV alleles: {0}".format(snv_alleles[last_str_snv])
-
-# Close input/output files
-strsnv_input.close()
-haplo_output.close()
+#
+# Rows for an STR/SNV position are consecutive in input (pstr_genotyping.py output is sorted by STR/SNV)
+for strsnv_fn in strsnv_fns:
+  write_haplotypes(strsnv_fn)
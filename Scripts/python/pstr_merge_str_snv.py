@@ -7,6 +7,11 @@
 #
 # 6/?/2015:  Original version
 # 10/6/2015: Adding heading comments
+# 10/18/2026: Add streaming merge (now default), counting STR/SNV alleles without loading STR detail into pandas.
+#             Previous pandas merge can be run with optional 'pandas' parameter
+# 10/18/2026: Read STR/SNV detail from binary table (.npz) files, for stream merge
+# 10/18/2026: Write stage metrics (phase timings, read counters); DataFrame prints only at debug log level
+# 10/18/2026: Read compressed (.gz, .zst) and slim (key columns only) STR/SNV detail files, for stream merge
 
 import os, sys, csv, imp, pandas as pd, msi_str as msi
 
@@ -17,8 +22,10 @@ user_home   = os.path.expanduser("~")
 # Check for valid command line arguments                                      #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 if len(sys.argv) < 2:
-  print "Usage: ", script_name, " <R1_STR_file> <R2_SNV_file>"
+  print "Usage: ", script_name, " <R1_STR_file> <R2_SNV_file> [stream|pandas]"
+  print "  STR/SNV files can be tab-delimited (.txt, .txt.gz, .txt.zst) or binary table (.npz) detail files, for stream merge"
   sys.exit(1)
+msi.start_metrics(script_name)
 
 str_ifile = sys.argv[1]
 if not os.path.isfile(str_ifile) or not os.access(str_ifile, os.R_OK):
@@ -29,6 +36,17 @@ snv_ifile = sys.argv[2]
 if not os.path.isfile(snv_ifile) or not os.access(snv_ifile, os.R_OK):
   print "Unable to open SNV file for input: ", snv_ifile
   sys.exit(1)
+
+merge_mode = 'stream'
+if len(sys.argv) > 3 and sys.argv[3] == 'pandas':
+  merge_mode = 'pandas'
+
+if merge_mode == 'pandas' and (str_ifile[-4:] != '.txt' or snv_ifile[-4:] != '.txt'):
+  print "Binary table (.npz) and compressed (.gz, .zst) input files can only be used with stream merge"
+  sys.exit(1)
+if merge_mode == 'pandas' and 'seq' not in msi.detail_hdgs(str_ifile):
+  print "Slim STR detail file (STR_DETAIL_LEVEL=slim) can only be used with stream merge"
+  sys.exit(1)
   
 fnbase = str_ifile.split('/')[-1].split('.')[0]
 
@@ -40,6 +58,34 @@ dtl_ofile = fnbase + '.STR_SNV.detail.txt'
 summ_ofile = fnbase + '.STR_SNV.summary.txt'
 
 print "\n**Running {0}, with R1 STR: {1}, R2 SNV:{2}".format(script_name, str_ifile, snv_ifile)
+STR_KEY_COLS = msi.R1DTL_KEY_HDGS
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def stream_merge(str_ifile, snv_ifile, dtl_ofile, summ_ofile):
+  # Join STR detail rows (streamed, key columns only) with SNV detail rows (indexed by qname/probe#),
+  #   accumulating counts by STR and STR/SNV allele.  Memory is SNV index plus distinct alleles.
+  read_snvs = msi.snv_rows_by_read(msi.detail_rows(snv_ifile, msi.SNV_DTL_HDGS[0:5]))
+  msi.count('snv_reads', len(read_snvs))
+
+  msi.phase('merge')
+  str_cts = {}; snv_cts = {}; nr_str_rows = 0; nr_snv_matches = 0
+  for str_key_values in msi.detail_rows(str_ifile, STR_KEY_COLS):
+    snv_rows = read_snvs.get((str_key_values[0], int(str_key_values[1])), [])
+    msi.str_snv_counts(str_cts, snv_cts, str_key_values, snv_rows)
+    nr_str_rows += 1
+    nr_snv_matches += 1 if snv_rows else 0
+  msi.count('str_reads', nr_str_rows)
+  msi.count('str_reads_with_snv', nr_snv_matches)
+
+  print "STR alleles: {0}, STR/SNV alleles: {1}".format(len(str_cts), len(snv_cts))
+  msi.phase('write_outputs')
+  dtl_output  = msi.open_file(dtl_ofile, 'w')
+  summ_output = msi.open_file(summ_ofile, 'w')
+  msi.write_str_snv_counts(csv.writer(dtl_output, dialect='tab_delim'), csv.writer(summ_output, dialect='tab_delim'), str_cts, snv_cts)
+  dtl_output.close()
+  summ_output.close()
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Main program logic                                                          #
@@ -47,9 +93,15 @@ print "\n**Running {0}, with R1 STR: {1}, R2 SNV:{2}".format(script_name, str_if
 #-----------------------------------------------------------------------------#
 # Merge STR and SNV files on query name                                       #
 #-----------------------------------------------------------------------------#
+if merge_mode == 'stream':
+  stream_merge(str_ifile, snv_ifile, dtl_ofile, summ_ofile)
+  msi.write_metrics(fnbase)
+  sys.exit(0)
+
 df_str = pd.read_csv(str_ifile,sep='\t',dtype={'chrom': str})
 df_snv = pd.read_csv(snv_ifile,sep='\t',dtype={'ref_chr': str})
 
+msi.phase('merge')
 df = pd.merge(df_str,df_snv,on=('qname','probe_nr'),how='left')
 # Since not all STR reads will have an SNV in the matching R2, and we are doing a left join,
 #   integer columns which have missing values, will be converted to floating point, use
@@ -64,21 +116,22 @@ df['snv_base'] = df['snv_base'].fillna('-')
 # Summarize, counting reads by STR repeat allele
 key_cols=['probe_nr','str_name','strand', 'bases_5pr','bases_3pr','motif_cnt']
 dfstr_cts = pd.DataFrame({'str_ct': df_str.groupby(key_cols, sort=True)['seq'].count()}).reset_index()
-print dfstr_cts.describe
+msi.log('debug', "{0}", dfstr_cts.describe)
 #dfsumm['qname'].to_csv(summ_ofile,index=True,sep='\t',header=['read_ct'])
 
 # Summarize merged file, counting SNV alleles by STR repeat allele
 key_cols=['probe_nr','str_name','strand', 'bases_5pr','bases_3pr','motif_cnt', 'ref_chr', 'snv_pos', 'snv_base']
 dfsnv_cts = pd.DataFrame({'snv_ct': df.groupby(key_cols, sort=True)['seq'].count()}).reset_index()
-print dfsnv_cts.describe
+msi.log('debug', "{0}", dfsnv_cts.describe)
 
 # Merge STR and SNV allele counts, and summarize by probe#
 dfsumm = pd.merge(dfstr_cts,dfsnv_cts,on=('probe_nr','str_name','strand','bases_5pr','bases_3pr','motif_cnt'),how='left')
-print dfsumm
+msi.log('debug', "{0}", dfsumm)
+msi.phase('write_outputs')
 summ_cols = ['probe_nr', 'str_name', 'strand', 'bases_5pr', 'bases_3pr', 'motif_cnt', 'str_ct', 'ref_chr', 'snv_pos', 'snv_base', 'snv_ct']
 dfsumm[summ_cols].to_csv(dtl_ofile,index=False,sep='\t')
 
 # Summarize by STR name
 summ_cols = ['str_name', 'strand', 'bases_5pr', 'bases_3pr', 'motif_cnt', 'str_ct', 'ref_chr', 'snv_pos', 'snv_base', 'snv_ct']
 dfsumm[summ_cols].to_csv(summ_ofile,index=False,sep='\t')
-
+msi.write_metrics(fnbase)
@@ -6,8 +6,12 @@
 #         and outputs haplotypes from the list which occur in the STR/SNV file
 #
 # 1/20/2016: Original version
+# 10/18/2026: Index mixture STR/SNV summary once, by (STR, chr, pos, base, repeat) and (STR, chr, pos), rather
+#             than pandas groupbys and list scans.  Screen multiple minor (contributor) STR_SNV.final files against
+#             the mixture in one run (STR_NR_PROCS processes), writing minor haplotypes for each contributor and
+#             a summary ranked by fraction of contributor haplotypes found in mixture
 
-import os, sys, csv, imp, pysam, numpy as np, pandas as pd, msi_str as msi
+import os, sys, csv, imp, multiprocessing, numpy as np, pandas as pd, msi_str as msi
 from decimal import Decimal
 from collections import OrderedDict
 
@@ -18,27 +22,35 @@ user_home   = os.path.expanduser("~")
 # Check for valid arguments, and that files exist                             #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 if len(sys.argv) < 3:
-  print "Usage: ", script_name, "<str_snv_summary(mix)> <str_snv_final(minor)> [debug]"
+  print "Usage: ", script_name, "<str_snv_summary(mix)> <str_snv_final(minor)|@minor_list> [str_snv_final(minor2) ..] [debug]"
+  print "  @minor_list: file with one minor (contributor) STR_SNV.final file name per line"
   sys.exit(1)
 
 debug = False
-if len(sys.argv) > 3 and sys.argv[3] == 'debug':
+minor_args = sys.argv[2:]
+if minor_args[-1] == 'debug':
   debug = True 
+  minor_args = minor_args[:-1]
+
+minor_fns = []
+for minor_arg in minor_args:
+  if minor_arg[0] == '@':
+    list_input = msi.open_file(minor_arg[1:], 'r')
+    minor_fns += [fn_line.strip() for fn_line in list_input if fn_line.strip()]
+    list_input.close()
+  else:
+    minor_fns.append(minor_arg)
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Open/initialize output files and general variables                          #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', quoting=csv.QUOTE_NONE)
 
-summ_input   = msi.open_file(sys.argv[1], 'r')
-minor_input  = msi.open_file(sys.argv[2], 'r')
-
 summ_fbase = sys.argv[1].split('/')[-1].split('.')[0] 
+HAPLO_HDGS  = ['STR Name', 'SNV Chr', 'SNV Pos', 'SNV Rds', 'SNV Bases', 'STR Alleles', 'Haplotypes', 'Reads', 'Read Pcts']
+SCREEN_HDGS = ['Rank', 'Minor File', 'Minor Haplotypes', 'Tested', 'In Mixture', 'Pct In Mixture', 'Minor Reads', 'Mean Read Pct']
 
-haplo_output = msi.open_file(summ_fbase + '.STR_SNV.minor_haplotypes.txt', 'w')
-haplo_csv = csv.writer(haplo_output, dialect='tab_delim')
-
-print "\n**Running {0}, with STR/SNV inputs: {1}, {2}".format(script_name, sys.argv[1], sys.argv[2])
+print "\n**Running {0}, with STR/SNV inputs: {1}, {2}".format(script_name, sys.argv[1], ', '.join(minor_fns))
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # General methods                                                             #
@@ -59,7 +71,7 @@ def extract_haplotypes(snv_base, str_counts):
 def format_haplo_csv(str_snv_key, snv_allele_rds):
   (str_name, snv_chr, snv_pos) = str_snv_key
   alleles_rds_srted = sorted(snv_allele_rds, key=lambda x: int(x[2]), reverse=True) 
-  print str_snv_key, alleles_rds_srted
+  msi.log('debug', "{0} {1}", str_snv_key, alleles_rds_srted)
   
   snv_reads = alleles_rds_srted[0][4]  #total reads is repeated for each tuple, so just pick first one
 
@@ -78,35 +90,109 @@ def format_haplo_csv(str_snv_key, snv_allele_rds):
             ','.join(haplotypes), ','.join([str(rds) for rds in haplo_rds]),
             ','.join([hap_rd_pct for hap_rd_pct in hap_rd_pcts])]
 
+def mixture_index(summ_fn):
+  # Index mixture STR_SNV summary: reads by (STR, chr, pos, base, motif repeats) and total reads by (STR, chr, pos)
+  # Eg. haplo_rds: {('trf605629', '4', 60021715, 'G', 17.5): 196, ..}  snv_rds: {('trf605629', '4', 60021715): 198, ..}
+  # Read with pandas, so that motif repeats are parsed to the same floats as previously; rows with missing key
+  #   values are not counted (as previous groupby)
+  df_summ = pd.read_csv(summ_fn, sep='\t', usecols=['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_cnt', 'snv_ct'],
+                        dtype={'ref_chr': str, 'motif_cnt': float})
+  df_summ = df_summ[df_summ.ref_chr != '-']
+  haplo_rds = {}; snv_rds = {}
+  summ_cols = [df_summ[col].tolist() for col in ['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_cnt', 'snv_ct']]
+  for (str_name, ref_chr, snv_pos, snv_base, motif_cnt, snv_ct) in zip(*summ_cols):
+    if pd.isnull(str_name) or pd.isnull(ref_chr) or pd.isnull(snv_pos):
+      continue
+    snv_key = (str_name, ref_chr, snv_pos)
+    snv_rds[snv_key] = snv_rds.get(snv_key, 0) + snv_ct
+    if pd.isnull(snv_base) or pd.isnull(motif_cnt):
+      continue
+    haplo_key = snv_key + (snv_base, motif_cnt)
+    haplo_rds[haplo_key] = haplo_rds.get(haplo_key, 0) + snv_ct
+  return {'haplo_rds': haplo_rds, 'snv_rds': snv_rds}
+
+def minor_haplotypes(minor_fn):
+  # Read minor final summary file into dictionary
+  # Input example
+  #STR name	Motif	Ref Chr	SNV Pos	SNV Allele	SNV Reads	Motif Rpts			Motif Rpt Rds	STR Allele(s)
+  #D16S539	GATA	16		86386213	A		130			7, 8, 9, 10, 11		1, 1, 1, 8, 119		11
+  #D16S539	GATA	16		86386213	C		101			12, 13				100, 1				12
+  #D20S1082	ATA		20		53865850	G		25			11					25					11
+  #trf281749	ATT		15		92517426	T		58			12, 15, 16, 17, 18	1, 4, 27, 24, 2		16, 17
+  minor_input = msi.open_file(minor_fn, 'r')
+  minor_str = {}
+  for mrow in csv.DictReader(minor_input, dialect='tab_delim'):
+    mhap_key = (mrow['STR name'], mrow['Ref Chr'], int(mrow['SNV Pos']), mrow['SNV Allele'])
+    str_alleles = [str_allele for str_allele in mrow['STR Allele(s)'].split(', ')]
+    if mhap_key in minor_str:
+      minor_str[mhap_key] += str_alleles
+    else:
+      minor_str[mhap_key] = str_alleles
+  minor_input.close()
+  msi.log('debug', "\nMinor component STR dictionary:\n{0}", minor_str)
+  return minor_str
+
+def minor_in_mixture(minor_str):
+  # Minor alleles present in mixture, with mixture reads: {(STR, chr, pos, base): [[alleles], [reads], SNV pos reads]}
+  #   and screening counts (minor haplotype alleles, alleles at SNV positions with mixture reads, alleles in mixture)
+  # minor_str example:
+  #   ('trf605629', '4', 60021715, 'G'): ['17.5', '19.5']
+  haplo_rds = MIX_INDEX['haplo_rds']; snv_rds = MIX_INDEX['snv_rds']
+  minor_in_mix = {}; screen_cts = {'minor_haplotypes': 0, 'tested': 0, 'in_mixture': 0, 'minor_reads': 0, 'read_pcts': 0.0}
+  for mkey, mvalues in sorted(minor_str.items()):
+    snv_key = mkey[0:3]
+    tot_snv_reads = snv_rds.get(snv_key, 0)
+    for m_allele in mvalues:
+      screen_cts['minor_haplotypes'] += 1
+      screen_cts['tested'] += 1 if tot_snv_reads > 0 else 0
+      str_rds = haplo_rds.get(mkey + (float(m_allele),))
+      if str_rds == None:
+        continue
+
+      screen_cts['in_mixture'] += 1
+      screen_cts['minor_reads'] += str_rds
+      screen_cts['read_pcts'] += str_rds * 100.0 / tot_snv_reads
+      if mkey not in minor_in_mix:
+        minor_in_mix[mkey] = [[m_allele], [str_rds], tot_snv_reads]
+      else:
+        minor_in_mix[mkey][0].append(m_allele)
+        minor_in_mix[mkey][1].append(str_rds)
+  return [minor_in_mix, screen_cts]
+
+def write_minor_haplotypes(haplo_fn, minor_in_mix):
+  # Format minor haplotypes in mixture, one row per STR/SNV position (all SNV bases)
+  haplo_output = msi.open_file(haplo_fn, 'w')
+  haplo_csv = csv.writer(haplo_output, dialect='tab_delim')
+  haplo_csv.writerow(HAPLO_HDGS)
+
+  last_str_snv = None; snv_alleles = []
+  for nkey, nvalues in sorted(minor_in_mix.items()):
+    # Eg: snv_alleles: [('C',11,889,'0.48',1825),('T',11,926,'0.51',1825)]
+    if nkey[0:3] != last_str_snv and last_str_snv != None:
+      haplo_csv.writerow(format_haplo_csv(last_str_snv, snv_alleles))
+      snv_alleles = []
+    snv_alleles += extract_haplotypes(nkey[3], nvalues)
+    last_str_snv = nkey[0:3]
+  if last_str_snv != None:
+    haplo_csv.writerow(format_haplo_csv(last_str_snv, snv_alleles))
+  haplo_output.close()
+
+def screen_minor(minor_fn):
+  # Score one minor (contributor) file against mixture index, writing its minor haplotypes; returns screening counts
+  [minor_in_mix, screen_cts] = minor_in_mixture(minor_haplotypes(minor_fn))
+  if len(minor_fns) == 1:
+    haplo_fn = summ_fbase + '.STR_SNV.minor_haplotypes.txt'
+  else:
+    haplo_fn = '{0}.{1}.STR_SNV.minor_haplotypes.txt'.format(summ_fbase, minor_fn.split('/')[-1].split('.')[0])
+  write_minor_haplotypes(haplo_fn, minor_in_mix)
+  screen_cts['minor_fn'] = minor_fn
+  return screen_cts
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Main program logic                                                          #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 #-----------------------------------------------------------------------------#
-# Read minor final summary file, and load into dictionary                     #
-#-----------------------------------------------------------------------------#
-# Input example
-#STR name	Motif	Ref Chr	SNV Pos	SNV Allele	SNV Reads	Motif Rpts			Motif Rpt Rds	STR Allele(s)
-#D16S539	GATA	16		86386213	A		130			7, 8, 9, 10, 11		1, 1, 1, 8, 119		11
-#D16S539	GATA	16		86386213	C		101			12, 13				100, 1				12
-#D20S1082	ATA		20		53865850	G		25			11					25					11
-#trf281749	ATT		15		92517426	T		58			12, 15, 16, 17, 18	1, 4, 27, 24, 2		16, 17
-
-minor_csv = csv.DictReader(minor_input, dialect='tab_delim')
-minor_str = {}
-
-for mrow in minor_csv:
-  mhap_key = (mrow['STR name'], mrow['Ref Chr'], int(mrow['SNV Pos']), mrow['SNV Allele'])
-  str_alleles = [str_allele for str_allele in mrow['STR Allele(s)'].split(', ')]
-  if mhap_key in minor_str:
-    minor_str[mhap_key] += str_alleles
-  else:
-    minor_str[mhap_key] = str_alleles
-  
-if True: print "\nMinor component STR dictionary:\n{0}".format(minor_str)
-
-#-----------------------------------------------------------------------------#
-# Read STR_SNV summary csv file, and load into pandas DataFrame               #
+# Index mixture STR_SNV summary file (once, before forking for contributors)  #
 #-----------------------------------------------------------------------------#
 # Input example
 #str_name	strand	bases_5pr	bases_3pr	motif_cnt	str_ct	ref_chr	snv_pos	snv_base	snv_ct
@@ -116,111 +202,39 @@ if True: print "\nMinor component STR dictionary:\n{0}".format(minor_str)
 #D7S820	M	AATCTGTC	GTTAGTTC	8	673	7	83789477	C	2
 #D7S820	M	AATCTGTC	GTTAGTTC	8	673	7	83789477	N	2
 #D7S820	M	AATCTGTC	GTTAGTTC	8	673	7	83789477	T	1
+msi.start_metrics(script_name)
+MIX_INDEX = mixture_index(sys.argv[1])
+if debug: print "\nMixture haplotype reads:\n{0}".format(MIX_INDEX['haplo_rds'])
 
-df_summ = pd.read_csv(summ_input,sep='\t',usecols=['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_cnt', 'snv_ct'],
-                                  dtype={'ref_chr': str, 'motif_cnt': float})
-df_summ = df_summ[df_summ.ref_chr != '-']
-
-group_cols = ['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_cnt']
-dfsum_tots = df_summ.groupby(group_cols, sort=True).sum()
-
-# Add index columns back into dataframe as regular columns to allow additional groupby
-for i in range(5):
-  dfsum_tots[group_cols[i]] = dfsum_tots.index.get_level_values(i)
-
-df_summary = dfsum_tots.groupby(['str_name', 'ref_chr', 'snv_pos', 'snv_base']).apply(lambda row: [list(row.motif_cnt), list(row.snv_ct)])
-summary_str = df_summary.to_dict()
-
-if debug: print "\nMixture STR dictionary:\n{0}".format(summary_str)
- 
 #-----------------------------------------------------------------------------#
-# Extract only those entries in summary_str which correspond to an entry      # 
-#  in minor_str. Ie. only report minor haplotypes identified in mixture       #
+# Extract minor haplotypes (entries in each minor file) found in mixture,     #
+#   for each minor file, in STR_NR_PROCS processes                            #
 #-----------------------------------------------------------------------------#
-# summary_str example: 
-#   ('trf605629', '4', 60021715, 'G'): [[17.5, 18.5], [196, 2]],
-#   ('trf873648_trf873649', '9', 105984015, 'A'): [[25.75, 27.75], [2, 3]], ...
-# 
-# minor_str example:
-#   ('trf605629', '4', 60021715, 'G'): ['17.5', '19.5']
-
 print "Starting processing of minor/mixture STRs"
-
-# Calculate total reads per SNV position in mixture
-group_cols = ['str_name', 'ref_chr', 'snv_pos']
-dfsnv_rds  = df_summ.groupby(group_cols, sort=True).sum()
-dfsnv_rds  = dfsnv_rds.drop('motif_cnt', 1)
-if debug: print dfsnv_rds
-
-mixture_reads = dfsnv_rds.to_dict()
-if debug: print mixture_reads
-
-# Determine minor alleles present in mixture
-minor_in_mix = {}
-for mkey, mvalues in sorted(minor_str.items()):
-  (str_name, snv_chr, snv_pos, snv_base) = mkey
-  tot_snv_reads = 0
-  
-  if mkey in summary_str:
-    for m_allele in mvalues:
-      if float(m_allele) in summary_str[mkey][0]:
-        idx     = summary_str[mkey][0].index(float(m_allele))
-        str_rds = summary_str[mkey][1][idx]
-        tot_snv_reads = mixture_reads['snv_ct'][(str_name, snv_chr, snv_pos)]
-
-        if mkey not in minor_in_mix:
-          minor_in_mix[mkey] = [[m_allele], [str_rds], tot_snv_reads]
-        else:
-          minor_in_mix[mkey][0].append(m_allele)
-          minor_in_mix[mkey][1].append(str_rds) 
-
-if debug:
-  print "Minor_in_Mix"
-  for nkey, nvalues in sorted(minor_in_mix.items()):
-    print nkey, nvalues
+msi.phase('screen_minor')
+if msi.NR_PROCS > 1 and len(minor_fns) > 1:
+  minor_pool = multiprocessing.Pool(min(msi.NR_PROCS, len(minor_fns)))
+  screen_results = minor_pool.map(screen_minor, minor_fns)
+  minor_pool.close()
+  minor_pool.join()
+else:
+  screen_results = [screen_minor(minor_fn) for minor_fn in minor_fns]
 
 #-----------------------------------------------------------------------------#
-# Format minor haplotypes in mixture, for output                              #
+# Write minor files ranked by fraction of tested minor haplotypes in mixture  #
 #-----------------------------------------------------------------------------#
-last_chr = 'N'; last_pos = 0; last_str = 'None'; last_base = 'N'
-last_str_snv = 'None-N-000000'; snv_alleles = {}
-
-haplo_csv = csv.writer(haplo_output, dialect='tab_delim')
-haplo_hdgs = ['STR Name', 'SNV Chr', 'SNV Pos', 'SNV Rds', 'SNV Bases', 'STR Alleles', 'Haplotypes', 'Reads', 'Read Pcts']
-haplo_csv.writerow(haplo_hdgs)
-
-for nkey, nvalues in sorted(minor_in_mix.items()):
-  # Accumulate all records for this STR (all SNV bases)
-  (this_str, this_chr, this_pos, this_base) = nkey
-  
-  str_snv_pos = ('-').join([this_str, this_chr, str(this_pos)])
-  
-  if last_chr != 'N' and (this_chr != last_chr or this_pos != last_pos or this_str != last_str):
-    # Have all data for previous SNV position, so determine and write out haplotype reads
-    if debug: print "Generating output row for {0}, {1}, {2}".format(last_str, last_chr, last_pos)
-    if debug: print snv_alleles[last_str_snv]
-   
-    haplo_csv.writerow(format_haplo_csv((last_str, last_chr, last_pos), snv_alleles[last_str_snv]))
- 
-    # Then reset STR/SNV accumulators
-    snv_alleles = {}
-    snv_alleles[str_snv_pos] = extract_haplotypes(this_base, nvalues)
-  
-  else:
-    if (this_str == last_str and this_chr == last_chr and this_pos == last_pos):
-      # Keep accumulating data for this STR/SNV position combination
-      # Eg: snv_alleles:  {'ASTE1-3-130733039': [('C',11,889,'0.48',1825),('T',11,926,'0.51',1825)]}
-      snv_alleles[str_snv_pos] += extract_haplotypes(this_base, nvalues)
-    else:
-      snv_alleles[str_snv_pos] = extract_haplotypes(this_base, nvalues)
-      
-  (last_str, last_chr, last_pos, last_base) = nkey
-  last_str_snv = str_snv_pos
-    
-# Process last STR-SNV
-haplo_csv.writerow(format_haplo_csv((last_str, last_chr, last_pos), snv_alleles[last_str_snv]))
-
-# Close input/output files
-summ_input.close()
-minor_input.close()
-haplo_output.close()
+msi.phase('write_outputs')
+for screen_cts in screen_results:
+  screen_cts['pct_in_mixture'] = screen_cts['in_mixture'] * 100.0 / screen_cts['tested'] if screen_cts['tested'] > 0 else 0.0
+screen_results.sort(key=lambda screen_cts: (-screen_cts['pct_in_mixture'], -screen_cts['in_mixture'], screen_cts['minor_fn']))
+
+screen_output = msi.open_file(summ_fbase + '.STR_SNV.minor_screen.txt', 'w')
+screen_csv = csv.writer(screen_output, dialect='tab_delim')
+screen_csv.writerow(SCREEN_HDGS)
+for rank, screen_cts in enumerate(screen_results):
+  mean_read_pct = screen_cts['read_pcts'] / screen_cts['in_mixture'] if screen_cts['in_mixture'] > 0 else 0.0
+  screen_csv.writerow([rank + 1, screen_cts['minor_fn'], screen_cts['minor_haplotypes'], screen_cts['tested'], screen_cts['in_mixture'],
+                       "{0:.2f}".format(screen_cts['pct_in_mixture']), screen_cts['minor_reads'], "{0:.2f}".format(mean_read_pct)])
+screen_output.close()
+msi.count('minor_files', len(minor_fns))
+msi.write_metrics(summ_fbase)
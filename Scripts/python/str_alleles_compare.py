@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# File: str_alleles_compare.py
+# Desc: Regression check of batch allele calling (msi.determine_alleles_batch) against msi.determine_alleles.
+#       Compares alleles for random read count/motif repeat sets (including tied read counts and fractional
+#       motif repeats), and for STRs in STRln_summary/STR_SNV.summary files if specified.
+#       Prints any STRs where alleles differ, and exits with status 1 if there are differences.
+#
+# 10/18/2026: Original version
+
+import os, sys, time, random, pandas as pd, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments                                                   #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) > 1 and sys.argv[1] in ['-h', '--help']:
+  print "Usage: ", script_name, "[nr_random_strs] [summary_file1 summary_file2 ..]"
+  print "  Summary files can be STRln_summary.txt (R1) or STR_SNV.summary.txt (merged STR/SNV) files"
+  sys.exit(1)
+
+nr_random = 20000
+summ_fns = sys.argv[1:]
+if len(summ_fns) > 0 and summ_fns[0].isdigit():
+  nr_random = int(summ_fns[0])
+  summ_fns = summ_fns[1:]
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def random_str(rnd):
+  # Random motif repeats (consecutive, with gaps, or fractional) and read counts (few distinct values, to give ties)
+  nr_cts  = rnd.choice([1, 2, 3, 4, 6, 10, 25])
+  motif_unit = rnd.choice([1, 0.5, 0.25, 1.0/3])
+  start   = rnd.randint(3, 30)
+  steps   = [rnd.choice([1, 1, 1, 2, 4]) for i in range(nr_cts)]
+  motif_rpts = [round(start + motif_unit * sum(steps[:i+1]), 3) for i in range(nr_cts)]
+  max_rds = rnd.choice([5, 20, 100, 1000])
+  str_rds = [rnd.choice([max_rds, rnd.randint(1, max_rds), rnd.randint(1, max_rds / 2 + 1), 1]) for i in range(nr_cts)]
+  return [motif_rpts, str_rds]
+
+def summary_strs(summ_fn):
+  # Motif repeat/read counts by STR (or STR/SNV) from summary file, as in str_ctlen_genotype.py/pstr_genotyping.py
+  df_summ = pd.read_csv(summ_fn, sep='\t', dtype={'ref_chr': str})
+  if 'STR Name' in df_summ.columns:
+    df_summ = df_summ[['STR Name', 'Motif#', 'STR Rds']]
+    df_summ.columns = ['str_key', 'motif_ct', 'str_rds']
+    key_cols = ['str_key']
+  else:
+    df_summ = df_summ[df_summ.ref_chr != '-'][['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_cnt', 'snv_ct']]
+    df_summ.columns = ['str_name', 'ref_chr', 'snv_pos', 'snv_base', 'motif_ct', 'str_rds']
+    key_cols = ['str_name', 'ref_chr', 'snv_pos', 'snv_base']
+  dfsum_tots = df_summ.groupby(key_cols + ['motif_ct'], sort=True).sum().reset_index()
+  df_summary = dfsum_tots.groupby(key_cols).apply(lambda row: [list(row.motif_ct), list(row.str_rds)])
+  return sorted(df_summary.to_dict().items())
+
+def compare_alleles(desc, summary_items):
+  # Compare batch and scalar alleles (formatted as in genotyping output), and return number of differences
+  str_rds_list    = [svalues[1] for (str_key, svalues) in summary_items]
+  motif_rpts_list = [svalues[0] for (str_key, svalues) in summary_items]
+
+  start_time = time.time()
+  batch_results = msi.determine_alleles_batch(str_rds_list, motif_rpts_list)
+  batch_secs = time.time() - start_time
+
+  stdout = sys.stdout
+  sys.stdout = open(os.devnull, 'w')   # determine_alleles prints for each call
+  start_time = time.time()
+  scalar_results = [msi.determine_alleles(str_rds, motif_rpts) for (str_rds, motif_rpts) in zip(str_rds_list, motif_rpts_list)]
+  scalar_secs = time.time() - start_time
+  sys.stdout.close()
+  sys.stdout = stdout
+
+  nr_diffs = 0
+  for (str_key, svalues), batch_result, scalar_result in zip(summary_items, batch_results, scalar_results):
+    batch_alleles  = ', '.join("{0:.5g}".format(float(str_allele)) for str_allele in batch_result[1])
+    scalar_alleles = ', '.join("{0:.5g}".format(float(str_allele)) for str_allele in scalar_result[1])
+    if batch_result[0] != scalar_result[0] or batch_alleles != scalar_alleles:
+      nr_diffs += 1
+      print "DIFF {0}: {1} batch: {2} scalar: {3}".format(str_key, svalues, batch_alleles, scalar_alleles)
+
+  print "{0}: {1} STRs, {2} differences; batch {3:.3f}s, scalar {4:.3f}s".format(desc, len(summary_items), nr_diffs,
+                                                                                batch_secs, scalar_secs)
+  return nr_diffs
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+rnd = random.Random(0)
+tot_diffs = compare_alleles('random', [(str_nr, random_str(rnd)) for str_nr in range(nr_random)])
+
+for summ_fn in summ_fns:
+  tot_diffs += compare_alleles(summ_fn, summary_strs(summ_fn))
+
+sys.exit(1 if tot_diffs > 0 else 0)
@@ -0,0 +1,212 @@
+#!/usr/bin/python
+
+# File: str_batch_genotype.py
+# Desc: Script runs the python genotyping stages for all samples in a sample sheet, in one process:
+#       pool resources (str_info/str_probes) are loaded once, and python libraries imported once, then
+#       samples are run in a pool of (forked) worker processes.  Each stage script is run in the worker,
+#       as if run from the command line, with output (stdout/stderr) to <out_dir>/<sample>.batch_log.txt
+#
+#       Stages are as strseq_genotype.sh (with -s option) from str_flank_alleles.py onwards:
+#         str_flank_alleles -> pstr_fused_str_snv -> str_ctlen_genotype -> pstr_genotyping -> pstr_haplotype_cts
+#       or with two_pass option, str_lengths_R1ref -> pstr_extract_R2snv -> pstr_merge_str_snv replace pstr_fused_str_snv
+#       R1 FreeBayes must be run before this script (flank_snv is R1 vcf, or intersectBed output of vcf with flank beds),
+#       or if flank_snv is pileup, R1 flank SNVs are called from base counts at flank positions (str_flank_pileup.py)
+#
+#       Completed stages are recorded in <out_dir>/<sample>.manifest.json (parameters, input/output checksums, see
+#       msi_str.py Stage manifest).  A stage is skipped if it is complete in the manifest, so samples which are
+#       up to date are skipped, and failed/interrupted samples continue from the first stage not complete.
+#       Timings per sample/stage are written to <sample_sheet base>.batch_timings.txt
+#       Genotype stores are named by sample sheet sample (<out_dir>/<sample>.STRln_store.npz, .STR_SNV.store.npz),
+#       so that samples with the same bam base name (in different out_dirs) are distinct in str_cohort_cube.py
+#
+#       Sample sheet (tab-delimited, with heading):
+#         sample  r1bam  flank_snv  snv_coords  [r2bam]  [out_dir]
+#       r2bam defaults to r1bam with _R1 replaced by _R2, and out_dir to the current directory
+#
+# 10/18/2026: Original version
+# 10/18/2026: Detail file names (two_pass) from msi.detail_fn, for compressed detail files (STR_DETAIL_COMPRESS)
+# 10/18/2026: Skip stages recorded as complete in sample manifest (msi.stage_complete), rather than by file times
+# 10/18/2026: flank_snv pileup, to call flank SNVs with str_flank_pileup.py
+# 10/18/2026: flank_snv may be R1 vcf, overlapped with pool flank beds by str_flank_alleles.py
+# 10/18/2026: Genotype stores named by sample (<sample>.STRln_store.npz, <sample>.STR_SNV.store.npz), for str_cohort_cube.py
+# 10/18/2026: Stage scripts run with msi.run_script (shared with str_regenotype.py)
+
+import os, sys, csv, time, multiprocessing, pysam, numpy as np, pandas as pd, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments, and that files exist                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 4:
+  print "Usage: ", script_name, "<sample_sheet> <probe_info> <str_info> [nr_procs] [alt|all] [two_pass]"
+  print "  Sample sheet columns: sample, r1bam, flank_snv (or pileup), snv_coords, [r2bam], [out_dir]"
+  sys.exit(1)
+
+for fn in sys.argv[1:4]:
+  if not os.path.isfile(fn) or not os.access(fn, os.R_OK):
+    print "Unable to open file for input: {0}".format(fn)
+    sys.exit(1)
+
+[sheet_fn, probe_fn, str_fn] = [os.path.abspath(fn) for fn in sys.argv[1:4]]
+pool_fns = msi.pool_files(str_fn)[1]
+nr_procs = int(sys.argv[4]) if len(sys.argv) > 4 else max(1, msi.NR_PROCS)
+snv_filter = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] in ['all', 'alt'] else 'alt'
+haplo = 'all' if snv_filter == 'all' else 'major'
+two_pass = len(sys.argv) > 6 and sys.argv[6] == 'two_pass'
+if two_pass and msi.DETAIL_LEVEL == 'none':
+  print "STRln_detail is needed for two_pass merge, STR_DETAIL_LEVEL must be full or slim"
+  sys.exit(1)
+
+# Samples are run in parallel, so each sample's R1 STR extraction is run as a single process
+msi.NR_PROCS = 1
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def read_samples(sheet_fn):
+  # Sample dicts from sample sheet, with file paths made absolute
+  sheet_input = msi.open_file(sheet_fn, 'r')
+  samples = []
+  for srow in csv.DictReader(sheet_input, delimiter='\t', quoting=csv.QUOTE_NONE):
+    sample = dict((col, value.strip()) for (col, value) in srow.items() if value)
+    missing_cols = [col for col in ['sample', 'r1bam', 'flank_snv', 'snv_coords'] if col not in sample]
+    if missing_cols:
+      print "Sample sheet row is missing: {0}, {1}".format(missing_cols, srow)
+      sys.exit(1)
+    if 'r2bam' not in sample:
+      sample['r2bam'] = sample['r1bam'].replace('_R1', '_R2')
+    for col in ['r1bam', 'r2bam', 'flank_snv', 'snv_coords', 'out_dir']:
+      if col != 'flank_snv' or sample[col] != 'pileup':
+        sample[col] = os.path.abspath(sample.get(col, '.'))
+    samples.append(sample)
+  sheet_input.close()
+  return samples
+
+def sample_stages(sample):
+  # Stage list for sample: (stage name, script, arguments, input files, output files).  Scripts write output
+  #   files to the current directory (out_dir), except str_flank_alleles (next to flank_snv file)
+  r1base = os.path.basename(sample['r1bam']).split('.')[0]
+  r2base = os.path.basename(sample['r2bam']).split('.')[0]
+  [r1_dtl_fn, r2_dtl_fn] = [msi.detail_fn(r1base + '.STRln_detail.txt'), msi.detail_fn(r2base + '.SNV_detail.txt')]
+  str_files = [r1base + '.STRln_summary.txt', r1base + '.STRln_probects.txt']
+  store_fns = [sample['sample'] + '.STRln_store.npz', sample['sample'] + '.STR_SNV.store.npz']
+
+  if sample['flank_snv'] == 'pileup':
+    flank_alleles = r1base + '.flank_alleles.txt'
+    flank_beds = [pool_fns[flank_type] for flank_type in ['5prflank', '3prflank'] if flank_type in pool_fns]
+    stages = [('flank_alleles', 'str_flank_pileup.py', [str_fn, sample['r1bam'], flank_alleles],
+                 [str_fn, sample['r1bam']] + flank_beds, [flank_alleles])]
+  else:
+    flank_alleles = sample['flank_snv'].split('.')[0] + '.flank_alleles.txt'
+    flank_args = [sample['flank_snv']]
+    if sample['flank_snv'][-4:] == '.vcf' or sample['flank_snv'][-7:] == '.vcf.gz':
+      flank_args += [pool_fns.get('5prflank', ''), pool_fns.get('3prflank', '')]
+    stages = [('flank_alleles', 'str_flank_alleles.py', flank_args, flank_args, [flank_alleles])]
+  if two_pass:
+    stages += [('r1_str', 'str_lengths_R1ref.py', [probe_fn, str_fn, flank_alleles, sample['r1bam']],
+                  [probe_fn, str_fn, flank_alleles, sample['r1bam']], str_files + [r1_dtl_fn]),
+               ('r2_snv', 'pstr_extract_R2snv.py', [sample['r2bam'], sample['snv_coords'], snv_filter],
+                  [sample['r2bam'], sample['snv_coords']], [r2_dtl_fn]),
+               ('merge', 'pstr_merge_str_snv.py', [r1_dtl_fn, r2_dtl_fn], [r1_dtl_fn, r2_dtl_fn], [r1base + '.STR_SNV.summary.txt'])]
+  else:
+    stages += [('fused_str_snv', 'pstr_fused_str_snv.py',
+                  [probe_fn, str_fn, flank_alleles, sample['r1bam'], sample['r2bam'], sample['snv_coords'], snv_filter],
+                  [probe_fn, str_fn, flank_alleles, sample['r1bam'], sample['r2bam'], sample['snv_coords']],
+                  str_files + [r1base + '.STR_SNV.summary.txt'])]
+
+  stages += [('str_genotype', 'str_ctlen_genotype.py', str_files + [str_fn, 'store=' + store_fns[0]], str_files + [str_fn],
+                [r1base + '.STRln_final.txt', store_fns[0]]),
+             ('str_snv_genotype', 'pstr_genotyping.py', [r1base + '.STR_SNV.summary.txt', str_fn, str_files[1], 'store=' + store_fns[1]],
+                [r1base + '.STR_SNV.summary.txt', str_fn, str_files[1]], [r1base + '.STR_SNV.final.txt', store_fns[1]]),
+             ('haplotypes', 'pstr_haplotype_cts.py', [r1base + '.STR_SNV.final.txt', haplo],
+                [r1base + '.STR_SNV.final.txt'], [r1base + '.haplotype_cts_' + haplo + '.txt'])]
+  return stages
+
+def run_sample(sample):
+  # Run all stages for sample (in worker process), skipping stages which are complete in sample manifest
+  #   Returns [sample name, status, [(stage name, seconds or None if skipped), ..], total seconds]
+  sample_start = time.time()
+  stage_secs = []; status = 'ok'; stage = ''
+  [stdout, stderr] = [sys.stdout, sys.stderr]
+  if not os.path.isdir(sample['out_dir']):
+    os.makedirs(sample['out_dir'])
+  os.chdir(sample['out_dir'])
+  sys.stdout = msi.open_file(sample['sample'] + '.batch_log.txt', 'a')
+  sys.stderr = sys.stdout
+  manifest_fn = sample['sample'] + '.manifest.json'
+  try:
+    manifest = msi.read_manifest(manifest_fn)
+    for (stage, script, script_args, input_fns, output_fns) in sample_stages(sample):
+      missing_fns = [fn for fn in input_fns if not os.path.isfile(fn)]
+      if missing_fns:
+        status = 'failed: {0}, missing input {1}'.format(stage, missing_fns[0])
+        break
+      params = msi.stage_params(' '.join(['python', script] + script_args))
+      if msi.stage_complete(manifest, stage, params, input_fns, output_fns):
+        stage_secs.append((stage, None))
+        continue
+      msi.start_stage(manifest_fn, manifest, stage)
+      stage_start = time.time()
+      print "\n**Batch sample: {0}, stage: {1}, running: {2} {3}".format(sample['sample'], stage, script, ' '.join(script_args))
+      exit_status = msi.run_script(script, script_args)
+      stage_secs.append((stage, time.time() - stage_start))
+      if exit_status != 0:
+        status = 'failed: {0}, exit status {1}'.format(stage, exit_status)
+        break
+      missing_fns = [fn for fn in output_fns if not os.path.isfile(fn)]
+      if missing_fns:
+        status = 'failed: {0}, missing output {1}'.format(stage, missing_fns[0])
+        break
+      msi.record_stage(manifest_fn, manifest, stage, params, input_fns, output_fns, round(stage_secs[-1][1], 2))
+  except Exception as e:
+    status = 'failed: {0}, {1}: {2}'.format(stage, type(e).__name__, e)
+  finally:
+    sys.stdout.close()
+    [sys.stdout, sys.stderr] = [stdout, stderr]
+  if status == 'ok' and all(secs is None for (stage, secs) in stage_secs):
+    status = 'up to date'
+  return [sample['sample'], status, stage_secs, time.time() - sample_start]
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+batch_start = time.time()
+samples = read_samples(sheet_fn)
+sample_names = [sample['sample'] for sample in samples]
+if len(samples) == 0 or len(set(sample_names)) < len(sample_names):
+  print "Sample sheet must have at least one sample, and sample names must be unique"
+  sys.exit(1)
+
+timing_output = msi.open_file(os.path.basename(sheet_fn).split('.')[0] + '.batch_timings.txt', 'w')
+timing_csv = csv.writer(timing_output, delimiter='\t', lineterminator='\n')
+timing_csv.writerow(['sample', 'status', 'total_secs'] + [stage_values[0] for stage_values in sample_stages(samples[0])])
+
+# Load pool resources before forking worker processes, so they are shared by all samples
+msi.dict_from_file(str_fn, 'str_info')
+msi.dict_from_file(probe_fn, 'probe_info')
+
+print "\n**Running {0}, {1} samples with {2} processes, pool resources: {3}, {4}".format(script_name, len(samples), nr_procs,
+                                                                                          probe_fn, str_fn)
+if nr_procs > 1 and len(samples) > 1:
+  sample_pool = multiprocessing.Pool(min(nr_procs, len(samples)))
+  sample_results = sample_pool.imap_unordered(run_sample, samples)
+else:
+  sample_pool = None
+  sample_results = (run_sample(sample) for sample in samples)
+
+nr_failed = 0
+for [sample_name, status, stage_secs, tot_secs] in sample_results:
+  stage_text = ', '.join('{0}: {1}'.format(stage, 'skipped' if secs is None else '{0:.1f}s'.format(secs)) for (stage, secs) in stage_secs)
+  print "{0}: {1} in {2:.1f}s ({3})".format(sample_name, status, tot_secs, stage_text)
+  timing_csv.writerow([sample_name, status, '{0:.2f}'.format(tot_secs)] +
+                      ['skipped' if secs is None else '{0:.2f}'.format(secs) for (stage, secs) in stage_secs])
+  nr_failed += 0 if status in ['ok', 'up to date'] else 1
+
+if sample_pool:
+  sample_pool.close()
+  sample_pool.join()
+timing_output.close()
+
+print "Batch complete: {0} samples, {1} failed, in {2:.1f}s".format(len(samples), nr_failed, time.time() - batch_start)
+sys.exit(1 if nr_failed > 0 else 0)
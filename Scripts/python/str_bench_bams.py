@@ -0,0 +1,232 @@
+#!/usr/bin/python
+
+# File: str_bench_bams.py
+# Desc: Script generates synthetic STR-Seq R1/R2 bams (coordinate sorted and indexed) from pool resources
+#       (str_info/str_probes), for benchmarking and checking of genotyping scripts (see str_benchmark.py)
+#       R1 reads start in the 5' flank of an STR probe, and contain the STR (true allele, or stutter +/-1 repeat);
+#       R2 mates cover an R2 SNV position (het C/T, phased with the STR alleles).  Some STRs have a het SNV in the
+#       5' flank, on the second allele.  Reads carry ZP (probe#) tags, as aligned STR-Seq bams.  R1 reads which span
+#       the STR have an insertion/deletion (left aligned, at STR start) for the allele length difference from reference,
+#       so that bases after the STR are aligned to the 3' flank.
+#
+#       Writes: <out_prefix>_R1.bam, <out_prefix>_R2.bam (+ .bai), <out_prefix>_R1.flank_alleles.txt (as output by
+#               str_flank_alleles.py), <out_prefix>_R2.snv_coords.txt (FreeBayes format), and <out_prefix>.truth.json
+#               (true alleles, R2 SNV and flank SNV for each STR, and generator parameters)
+#
+#       Optional parameters (name=value): nr_strs (default 200, 0 for all STRs in pool with probes), seed (7),
+#         stutter (fraction of reads with -1/+1 repeat stutter, 0.1), flank_snv (fraction of STRs with 5' flank SNV, 0.15),
+#         noise (fraction of R1 reads with random sequence, 0.1), unmapped (fraction of R1 reads unmapped, 0.05),
+#         max_allele_diff (max repeats between alleles, 3), rdlen (read length, 150)
+#
+# 10/18/2026: Original version
+# 10/18/2026: R1 CIGAR with insertion/deletion for STR allele length (rather than rdlen M for all reads)
+
+import os, sys, csv, json, heapq, random, pysam, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments                                                   #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+BENCH_PARAMS = {'nr_strs': 200, 'seed': 7, 'stutter': 0.1, 'flank_snv': 0.15, 'noise': 0.1, 'unmapped': 0.05,
+                'max_allele_diff': 3, 'rdlen': 150}
+
+if len(sys.argv) < 5:
+  print "Usage: ", script_name, "<probe_info> <str_info> <nr_reads> <out_prefix> [name=value ..]"
+  print "  Optional parameters (defaults): {0}".format(', '.join('{0}={1}'.format(*param) for param in sorted(BENCH_PARAMS.items())))
+  sys.exit(1)
+
+nr_reads   = int(sys.argv[3])
+out_prefix = sys.argv[4]
+params = dict(BENCH_PARAMS)
+for param_arg in sys.argv[5:]:
+  (name, value) = param_arg.split('=', 1)
+  if name not in params:
+    print "Invalid parameter: {0}, valid parameters are: {1}".format(name, sorted(params))
+    sys.exit(1)
+  params[name] = type(params[name])(value)
+
+rnd = random.Random(params['seed'])
+rdlen = params['rdlen']
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+RANDOM_BASES = ''.join(rnd.choice('ACGT') for i in range(1 << 20))
+
+def random_seq(seq_len):
+  # Random sequence, as slice of pre-generated random bases (much faster than per base random choice)
+  seq_start = rnd.randint(0, len(RANDOM_BASES) - seq_len)
+  return RANDOM_BASES[seq_start:seq_start + seq_len]
+
+def str_truth(str_row):
+  # True alleles (motif repeats) for STR, close to reference length, R2 SNV position and optional 5' flank SNV
+  motif_len = len(str_row['Motif'])
+  ref_rpts  = max(int(str_row['MinRepeat']) + 1, (int(str_row['3PrStart']) - int(str_row['5PrEnd'])) // motif_len)
+  alleles   = sorted([ref_rpts, ref_rpts + rnd.randint(-min(2, params['max_allele_diff']), params['max_allele_diff'])])
+  alleles   = [max(int(str_row['MinRepeat']) + 1, allele) for allele in alleles]
+  snv_pos   = int(str_row['3PrStart']) + 15 + rnd.randint(50, 90)
+  flank_snv = None
+  if rnd.random() < params['flank_snv']:
+    flank_idx = rnd.randint(2, 12)
+    ref_base  = str_row['5PrFlank'][-15:][flank_idx]
+    flank_snv = [flank_idx, 'A' if ref_base != 'A' else 'G']
+  return {'alleles': alleles, 'snv': [str_row['Chr'], snv_pos], 'flank_snv': flank_snv}
+
+def r1_cigar(str_row, rpts, pre_len):
+  # R1 CIGAR: insertion/deletion at STR start (0-based [5PrEnd, 3PrStart) in reference) for the difference between
+  #   read and reference STR length, if read extends past STR; reads ending in the STR match reference repeats
+  aligned_5pr = pre_len + 15
+  str_len = len(str_row['Motif']) * rpts
+  str_len_diff = str_len - (int(str_row['3PrStart']) - int(str_row['5PrEnd']))
+  if str_len_diff == 0 or aligned_5pr + str_len >= rdlen:
+    return '{0}M'.format(rdlen)
+  elif str_len_diff > 0:
+    return '{0}M{1}I{2}M'.format(aligned_5pr, str_len_diff, rdlen - aligned_5pr - str_len_diff)
+  return '{0}M{1}D{2}M'.format(aligned_5pr, -str_len_diff, rdlen - aligned_5pr)
+
+def str_read_pair(read_nr, str_row, probe_row, truth):
+  # R1 (STR) and R2 (SNV) reads for one fragment: ((pos, read#, R1 segment), (pos, read#, R2 segment))
+  hap = rnd.randint(0, 1)
+  rpts = truth['alleles'][hap]
+  stutter = rnd.random()
+  if stutter < params['stutter'] * 0.8:
+    rpts -= 1
+  elif stutter < params['stutter']:
+    rpts += 1
+
+  flank_5pr = str_row['5PrFlank'][-15:]
+  if hap == 1 and truth['flank_snv']:
+    (flank_idx, alt_base) = truth['flank_snv']
+    flank_5pr = flank_5pr[:flank_idx] + alt_base + flank_5pr[flank_idx+1:]
+  pre_len = rnd.randint(3, 40)
+  r1_seq = (random_seq(pre_len) + flank_5pr + str_row['Motif'] * rpts + str_row['3PrFlank'][:15] + random_seq(rdlen))[:rdlen]
+  r1_cigar_str = r1_cigar(str_row, rpts, pre_len)
+  if rnd.random() < params['noise']:
+    r1_seq = random_seq(rdlen)
+    r1_cigar_str = '{0}M'.format(rdlen)
+
+  probe_nr = int(probe_row['Probe']) if rnd.random() > 0.03 else 999999
+  r1 = pysam.AlignedSegment()
+  r1.query_name = 'r{0:09d}'.format(read_nr)
+  r1.reference_id = ref_ids[str_row['Chr']]
+  r1.reference_start = int(str_row['5PrEnd']) - 15 - pre_len
+  r1.mapping_quality = 60
+  r1.cigarstring = r1_cigar_str
+  r1.flag = 0x1 | 0x40
+  r1.next_reference_id = r1.reference_id
+  r1.next_reference_start = r1.reference_start + 100
+  if rnd.random() < params['unmapped']:
+    r1.flag |= 0x4
+    r1.cigarstring = None
+    r1.mapping_quality = 0
+    if probe_row['Strand'] == 'M':
+      r1_seq = msi.rev_complement(r1_seq)
+  r1.query_sequence = r1_seq
+  r1.query_qualities = pysam.qualitystring_to_array('I' * rdlen)
+  r1.set_tag('ZP', probe_nr)
+
+  snv_pos = truth['snv'][1]
+  r2 = pysam.AlignedSegment()
+  r2.query_name = r1.query_name
+  r2.flag = 0x1 | 0x80 | (0x10 if probe_row['Strand'] == 'M' else 0)
+  r2.reference_id = r1.reference_id
+  r2.reference_start = snv_pos - rnd.randint(60, 100)
+  r2.mapping_quality = 60
+  r2.cigarstring = '{0}M'.format(rdlen)
+  r2.next_reference_id = r1.reference_id
+  r2.next_reference_start = r1.reference_start
+  r2_seq = random_seq(rdlen)
+  snv_idx = snv_pos - 1 - r2.reference_start
+  r2.query_sequence = r2_seq[:snv_idx] + ('C' if hap == 0 else 'T') + r2_seq[snv_idx+1:]
+  r2.query_qualities = pysam.qualitystring_to_array('I' * rdlen)
+  r2.set_tag('ZP', probe_nr)
+  return ((r1.reference_start, read_nr, r1), (r2.reference_start, read_nr, r2))
+
+def flush_reads(bam_output, read_heap, before_key):
+  # Write buffered reads with (ref id, position) before before_key, in coordinate order
+  while read_heap and read_heap[0][0] < before_key:
+    bam_output.write(heapq.heappop(read_heap)[2])
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+#-----------------------------------------------------------------------------#
+# Select STRs with probes, and set true alleles/SNVs                          #
+#-----------------------------------------------------------------------------#
+str_input = msi.open_file(sys.argv[2], 'r')
+str_rows  = list(csv.DictReader(str_input, delimiter='\t', quoting=csv.QUOTE_NONE))
+str_input.close()
+probe_input = msi.open_file(sys.argv[1], 'r')
+str_probes = {}
+for probe_row in csv.DictReader(probe_input, delimiter='\t', quoting=csv.QUOTE_NONE):
+  str_probes.setdefault(probe_row['STRName'], []).append(probe_row)
+probe_input.close()
+
+str_rows = [str_row for str_row in str_rows if str_row['STRName'] in str_probes]
+if params['nr_strs'] > 0:
+  str_rows = str_rows[:params['nr_strs']]
+truth = dict((str_row['STRName'], str_truth(str_row)) for str_row in str_rows)
+
+chroms = [str(chrom) for chrom in range(1, 23)] + ['X', 'Y']
+chroms += sorted(set(str_row['Chr'] for str_row in str_rows) - set(chroms))
+ref_ids = dict((chrom, ref_id) for (ref_id, chrom) in enumerate(chroms))
+bam_header = {'HD': {'VN': '1.0', 'SO': 'coordinate'}, 'SQ': [{'SN': chrom, 'LN': 250000000} for chrom in chroms]}
+
+#-----------------------------------------------------------------------------#
+# Write reads for STRs in coordinate order: reads per STR are drawn from a    #
+#   multinomial, and buffered (heap) only until no later STR can precede them #
+#-----------------------------------------------------------------------------#
+print "\n**Running {0}, {1} reads for {2} STRs, parameters: {3}".format(script_name, nr_reads, len(str_rows), params)
+str_rows.sort(key=lambda str_row: (ref_ids[str_row['Chr']], int(str_row['5PrEnd'])))
+str_weights = [rnd.random() + 0.5 for str_row in str_rows]
+tot_weight  = sum(str_weights)
+
+r1_output = pysam.AlignmentFile(out_prefix + '_R1.bam', 'wb', header=bam_header)
+r2_output = pysam.AlignmentFile(out_prefix + '_R2.bam', 'wb', header=bam_header)
+r1_heap = []; r2_heap = []
+read_nr = 0; reads_left = nr_reads; weight_left = tot_weight
+
+for (str_row, str_weight) in zip(str_rows, str_weights):
+  # Earliest possible read start for this (and later) STRs: R1 at 5' flank - 55, R2 at 3' start - 35
+  ref_id = ref_ids[str_row['Chr']]
+  flush_reads(r1_output, r1_heap, (ref_id, int(str_row['5PrEnd']) - 55))
+  flush_reads(r2_output, r2_heap, (ref_id, int(str_row['3PrStart']) - 35))
+
+  str_reads = reads_left if weight_left <= str_weight else int(round(reads_left * str_weight / weight_left))
+  reads_left -= str_reads; weight_left -= str_weight
+  for i in range(str_reads):
+    ((r1_pos, r1_nr, r1), (r2_pos, r2_nr, r2)) = str_read_pair(read_nr, str_row, rnd.choice(str_probes[str_row['STRName']]), truth[str_row['STRName']])
+    heapq.heappush(r1_heap, ((ref_id, r1_pos), r1_nr, r1))
+    heapq.heappush(r2_heap, ((ref_id, r2_pos), r2_nr, r2))
+    read_nr += 1
+
+flush_reads(r1_output, r1_heap, (len(chroms), 0))
+flush_reads(r2_output, r2_heap, (len(chroms), 0))
+r1_output.close()
+r2_output.close()
+for bam_fn in [out_prefix + '_R1.bam', out_prefix + '_R2.bam']:
+  pysam.index(bam_fn)
+
+#-----------------------------------------------------------------------------#
+# Write R1 flank alleles, R2 SNV coordinates and truth files                  #
+#-----------------------------------------------------------------------------#
+fsnv_output = msi.open_file(out_prefix + '_R1.flank_alleles.txt', 'w')
+fsnv_output.write('\t'.join(['Chr', 'SNVPos', 'Ref', 'Alt', 'TYPE', 'GT', 'AF', 'STRName', '5or3pr', 'FlankStart', 'FlankEnd']) + '\n')
+snv_output = msi.open_file(out_prefix + '_R2.snv_coords.txt', 'w')
+snv_output.write('\t'.join(['CHROM', 'POS', 'REF', 'ALT', 'TYPE', 'AF']) + '\n')
+for str_row in str_rows:
+  str_truth_info = truth[str_row['STRName']]
+  snv_output.write('{0}\t{1}\tC\tT\tsnp\t0.5\n'.format(*str_truth_info['snv']))
+  if str_truth_info['flank_snv']:
+    (flank_idx, alt_base) = str_truth_info['flank_snv']
+    flank_start = int(str_row['5PrEnd']) - 15
+    fsnv_output.write('\t'.join(str(value) for value in [str_row['Chr'], flank_start + flank_idx + 1, str_row['5PrFlank'][-15:][flank_idx],
+                      alt_base, 'snp', '0/1', '0.5', str_row['STRName'], '5pr', flank_start, int(str_row['5PrEnd'])]) + '\n')
+fsnv_output.close()
+snv_output.close()
+
+truth_output = msi.open_file(out_prefix + '.truth.json', 'w')
+json.dump({'nr_reads': nr_reads, 'params': params, 'strs': truth}, truth_output, sort_keys=True)
+truth_output.close()
+print "Wrote {0} read pairs to {1}_R1.bam, {1}_R2.bam".format(read_nr, out_prefix)
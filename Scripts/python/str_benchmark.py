@@ -0,0 +1,221 @@
+#!/usr/bin/python
+
+# File: str_benchmark.py
+# Desc: Benchmark of python genotyping stages on synthetic bams (str_bench_bams.py), for comparison across commits.
+#       Generates bams for the pool/read count/generator parameters (reused if present), runs each stage (two pass:
+#       R1 STR, R1 genotyping, R2 SNV, merge, STR/SNV genotyping, haplotype counts; and single pass fused R1/R2)
+#       and appends to results json: commit, date, wall time, peak RSS and read pairs/sec for each stage, accuracy of
+#       called alleles vs true alleles, and md5 of called alleles (so speedups that change calls are flagged).
+#       Results are compared with the previous run with the same settings; exit status is 1 if a stage fails or
+#       called alleles differ from that run.
+#         compare mode prints stage timings/RSS for the last 2 runs (or runs # specified) in a results json.
+#
+#       Optional parameters (name=value) are passed to str_bench_bams.py, eg: nr_strs=1000 stutter=0.05
+#       Bams are written to <results_base>_data/, stage outputs to <results_base>_run/
+#
+# 10/18/2026: Original version
+# 10/18/2026: git describe errors (scripts not in a git checkout) not shown, commit recorded as unknown
+
+import os, sys, csv, json, time, hashlib, platform, subprocess, msi_str as msi
+
+script_name = os.path.basename(__file__)
+script_dir  = os.path.dirname(os.path.abspath(__file__))
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments                                                   #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 3 or (sys.argv[1] != 'compare' and len(sys.argv) < 5):
+  print "Usage: ", script_name, "<probe_info> <str_info> <nr_reads> <results_json> [name=value ..]"
+  print "       ", script_name, "compare <results_json> [run#1 run#2]"
+  print "  eg: ", script_name, "Resources/OS0035.str_probes.txt Resources/OS0035.str_info.txt 1000000 bench.json nr_strs=2000"
+  sys.exit(1)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def script(script_fn):
+  return os.path.join(script_dir, script_fn)
+
+def read_results(results_fn):
+  if not os.path.isfile(results_fn):
+    return []
+  results_input = msi.open_file(results_fn, 'r')
+  results = json.load(results_input)
+  results_input.close()
+  return results
+
+def run_stage(stage, cmd, log_fn):
+  # Run stage script, returning wall time, peak RSS (MB, from wait4 rusage of stage process) and exit status
+  log_output = open(log_fn, 'w')
+  start_time = time.time()
+  stage_proc = subprocess.Popen([sys.executable] + cmd, stdout=log_output, stderr=subprocess.STDOUT)
+  (pid, status, rusage) = os.wait4(stage_proc.pid, 0)
+  wall_secs = time.time() - start_time
+  log_output.close()
+  exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+  print "  {0:<14} {1:8.2f}s {2:8.1f} MB{3}".format(stage, wall_secs, rusage.ru_maxrss / 1024.0,
+                                                    '' if exit_status == 0 else '  FAILED (see ' + log_fn + ')')
+  return {'stage': stage, 'wall_secs': round(wall_secs, 3), 'max_rss_mb': round(rusage.ru_maxrss / 1024.0, 1),
+          'status': exit_status}
+
+def final_alleles(final_fn):
+  # Called alleles from STRln_final (by STR) or STR_SNV.final (by STR and SNV allele) file
+  alleles = {}
+  if not os.path.isfile(final_fn):
+    return alleles
+  final_input = msi.open_file(final_fn, 'r')
+  for final_row in csv.DictReader(final_input, delimiter='\t', quoting=csv.QUOTE_NONE):
+    if 'Allele(s)' in final_row:
+      alleles[final_row['STR Name']] = final_row['Allele(s)']
+    elif final_row['Ref Chr'] != '-':
+      alleles[(final_row['STR name'], final_row['SNV Allele'])] = final_row['STR Allele(s)']
+  final_input.close()
+  return alleles
+
+def allele_accuracy(alleles, str_truth):
+  # Fraction of STRs (or STR/SNV alleles) with called alleles equal to true alleles (R1 alleles are in read count
+  # order, so compared as sets).  R2 SNV C is on first (true) STR allele, T on second
+  nr_correct = 0
+  for (str_key, str_alleles) in alleles.items():
+    if isinstance(str_key, tuple):
+      true_alleles = str_truth[str_key[0]]['alleles'][:1] if str_key[1] == 'C' else str_truth[str_key[0]]['alleles'][1:]
+    else:
+      true_alleles = sorted(set(str_truth[str_key]['alleles']))
+    if sorted(float(allele) for allele in str_alleles.split(', ') if allele not in ['', 'nan']) == true_alleles:
+      nr_correct += 1
+  return {'called': len(alleles), 'correct': nr_correct,
+          'accuracy': round(float(nr_correct) / len(alleles), 4) if len(alleles) > 0 else 0}
+
+def alleles_md5(alleles):
+  return hashlib.md5(''.join('{0}\t{1}\n'.format(str_key, alleles[str_key]) for str_key in sorted(alleles))).hexdigest()
+
+def compare_runs(old_run, new_run):
+  # Print stage timings/RSS of two runs, and return number of differences in called alleles
+  print "Run {0} ({1}, {2}) vs run {3} ({4}, {5})".format(old_run['run_nr'], old_run['commit'], old_run['date'],
+                                                        new_run['run_nr'], new_run['commit'], new_run['date'])
+  print "  {0:<14} {1:>9} {2:>9} {3:>7} {4:>9} {5:>9}".format('stage', 'old secs', 'new secs', 'speedup', 'old MB', 'new MB')
+  old_stages = dict((stage_info['stage'], stage_info) for stage_info in old_run['stages'])
+  for stage_info in new_run['stages']:
+    old_info = old_stages.get(stage_info['stage'])
+    if old_info:
+      print "  {0:<14} {1:9.2f} {2:9.2f} {3:6.2f}x {4:9.1f} {5:9.1f}".format(stage_info['stage'], old_info['wall_secs'],
+              stage_info['wall_secs'], old_info['wall_secs'] / max(stage_info['wall_secs'], 0.001), old_info['max_rss_mb'],
+              stage_info['max_rss_mb'])
+  nr_diffs = 0
+  for calls in sorted(new_run['calls_md5']):
+    if calls in old_run['calls_md5'] and old_run['calls_md5'][calls] != new_run['calls_md5'][calls]:
+      print "  Called alleles differ: {0} (accuracy {1} -> {2})".format(calls, old_run['truth'][calls]['accuracy'],
+                                                                        new_run['truth'][calls]['accuracy'])
+      nr_diffs += 1
+  return nr_diffs
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Compare mode: compare 2 runs in results file                                #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if sys.argv[1] == 'compare':
+  results = read_results(sys.argv[2])
+  if len(results) < 2:
+    print "Need at least 2 runs in results file: {0}".format(sys.argv[2])
+    sys.exit(1)
+  if len(sys.argv) > 4:
+    run_nrs = [int(sys.argv[3]), int(sys.argv[4])]
+  else:
+    run_nrs = [results[-2]['run_nr'], results[-1]['run_nr']]
+  runs = dict((run['run_nr'], run) for run in results)
+  sys.exit(1 if compare_runs(runs[run_nrs[0]], runs[run_nrs[1]]) > 0 else 0)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+probe_fn   = os.path.abspath(sys.argv[1])
+str_fn     = os.path.abspath(sys.argv[2])
+nr_reads   = int(sys.argv[3])
+results_fn = os.path.abspath(sys.argv[4])
+gen_params = sorted(sys.argv[5:])
+pool       = os.path.basename(str_fn).split('.')[0]
+
+results_base = os.path.splitext(results_fn)[0]
+data_dir  = results_base + '_data'
+run_dir   = results_base + '_run'
+data_base = os.path.join(data_dir, '{0}_{1}{2}'.format(pool, nr_reads, ''.join('_' + param.replace('=', '') for param in gen_params)))
+for out_dir in [data_dir, run_dir, os.path.join(run_dir, 'fused')]:
+  if not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+
+#-----------------------------------------------------------------------------#
+# Generate synthetic bams, if not already generated for these settings        #
+#-----------------------------------------------------------------------------#
+print "\n**Running {0}, pool {1}, {2} read pairs".format(script_name, pool, nr_reads)
+stages = []
+if not os.path.isfile(data_base + '.truth.json'):
+  stages.append(run_stage('generate', [script('str_bench_bams.py'), probe_fn, str_fn, str(nr_reads), data_base] + gen_params,
+                          data_base + '.generate_log.txt'))
+  if stages[-1]['status'] != 0:
+    sys.exit(1)
+truth_input = msi.open_file(data_base + '.truth.json', 'r')
+truth = json.load(truth_input)
+truth_input.close()
+
+#-----------------------------------------------------------------------------#
+# Run stages, two pass (R1 then R2/merge) and single pass fused R1/R2         #
+#-----------------------------------------------------------------------------#
+r1_bam = data_base + '_R1.bam'; r2_bam = data_base + '_R2.bam'
+r1_base = os.path.basename(data_base) + '_R1'; r2_base = os.path.basename(data_base) + '_R2'
+stage_cmds = [
+  ['r1_str',     run_dir, [script('str_lengths_R1ref.py'), probe_fn, str_fn, data_base + '_R1.flank_alleles.txt', r1_bam]],
+  ['r1_genotype', run_dir, [script('str_ctlen_genotype.py'), r1_base + '.STRln_summary.txt', r1_base + '.STRln_probects.txt', str_fn]],
+  ['r2_snv',     run_dir, [script('pstr_extract_R2snv.py'), r2_bam, data_base + '_R2.snv_coords.txt', 'alt']],
+  ['merge',      run_dir, [script('pstr_merge_str_snv.py'), msi.detail_fn(r1_base + '.STRln_detail.txt'),
+                                 msi.detail_fn(r2_base + '.SNV_detail.txt')]],
+  ['genotype',   run_dir, [script('pstr_genotyping.py'), r1_base + '.STR_SNV.summary.txt', str_fn, r1_base + '.STRln_probects.txt']],
+  ['haplotype',  run_dir, [script('pstr_haplotype_cts.py'), r1_base + '.STR_SNV.final.txt', 'major']],
+  ['fused',      os.path.join(run_dir, 'fused'), [script('pstr_fused_str_snv.py'), probe_fn, str_fn, data_base + '_R1.flank_alleles.txt',
+                                                   r1_bam, r2_bam, data_base + '_R2.snv_coords.txt', 'alt']],
+  ['fused_genotype', os.path.join(run_dir, 'fused'), [script('pstr_genotyping.py'), r1_base + '.STR_SNV.summary.txt', str_fn,
+                                                     r1_base + '.STRln_probects.txt']]]
+read_stages = ['r1_str', 'r2_snv', 'fused']
+
+cwd = os.getcwd()
+for (stage, stage_dir, cmd) in stage_cmds:
+  os.chdir(stage_dir)
+  stages.append(run_stage(stage, cmd, os.path.join(stage_dir, stage + '.log')))
+  if stage in read_stages:
+    stages[-1]['reads_per_sec'] = round(nr_reads / max(stages[-1]['wall_secs'], 0.001), 1)
+os.chdir(cwd)
+
+#-----------------------------------------------------------------------------#
+# Check called alleles vs truth, and append run to results file               #
+#-----------------------------------------------------------------------------#
+calls = {'r1':       final_alleles(os.path.join(run_dir, r1_base + '.STRln_final.txt')),
+         'str_snv':  final_alleles(os.path.join(run_dir, r1_base + '.STR_SNV.final.txt')),
+         'fused':    final_alleles(os.path.join(run_dir, 'fused', r1_base + '.STR_SNV.final.txt'))}
+# Commit of scripts, or unknown if not a git checkout (eg installed copy); git errors are not shown
+git_stderr = open(os.devnull, 'w')
+try:
+  commit = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=script_dir, stderr=git_stderr).strip()
+except (OSError, subprocess.CalledProcessError):
+  commit = 'unknown'
+finally:
+  git_stderr.close()
+
+results = read_results(results_fn)
+run = {'run_nr': results[-1]['run_nr'] + 1 if results else 1, 'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+       'host': platform.node(), 'python': platform.python_version(), 'pool': pool, 'nr_reads': nr_reads,
+       'gen_params': gen_params, 'stages': stages,
+       'truth': dict((calls_name, allele_accuracy(calls[calls_name], truth['strs'])) for calls_name in calls),
+       'calls_md5': dict((calls_name, alleles_md5(calls[calls_name])) for calls_name in calls)}
+results.append(run)
+results_output = msi.open_file(results_fn, 'w')
+json.dump(results, results_output, indent=1, sort_keys=True)
+results_output.close()
+
+print "Allele accuracy vs truth: {0}".format(', '.join('{0} {1}/{2}'.format(calls_name, run['truth'][calls_name]['correct'],
+                                              run['truth'][calls_name]['called']) for calls_name in sorted(calls)))
+print "Run {0} appended to {1}".format(run['run_nr'], results_fn)
+
+nr_diffs = 0
+prev_runs = [prev_run for prev_run in results[:-1] if prev_run['pool'] == pool and prev_run['nr_reads'] == nr_reads and
+             prev_run['gen_params'] == gen_params]
+if prev_runs:
+  nr_diffs = compare_runs(prev_runs[-1], run)
+sys.exit(1 if nr_diffs > 0 or any(stage_info['status'] != 0 for stage_info in stages) else 0)
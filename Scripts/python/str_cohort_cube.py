@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+# File: str_cohort_cube.py
+# Desc: Script compiles STR read counts by motif repeats (STRln) and STR/SNV allele read counts (STR_SNV), and alleles,
+#       from genotype stores of many samples into a cohort count cube (<cohort_dir>, see msi_str.py Cohort count cube),
+#       and answers cohort queries from memory mapped cube files, without rereading per sample files:
+#         add:      add samples (genotype stores, grouped into samples by sample name: sample=store argument,
+#                   sample column of @store_list, or store file base name); samples already in cohort are
+#                   skipped, so a cohort is extended by adding new stores
+#         freq:     STR allele frequencies in cohort, number of carrier samples, and read counts by motif repeats
+#         carriers: samples with STR/SNV haplotype (STR allele with SNV base)
+#         list:     samples, with number of STR alleles and STR/SNV alleles of each sample
+#       Alleles are determined with THRESHOLD_VALS (STR_THRESHOLD_VALS), which must be the same for all adds to a cohort
+#
+# 10/18/2026: Original version
+# 10/18/2026: Sample names from sample=store arguments or @store_list sample column; records grouped by key in segments
+# 10/18/2026: Motif repeats/alleles kept as float64, and printed as in STRln_final ({0:.5g})
+
+import os, sys, time, numpy as np, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments                                                   #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+NR_ACTION_ARGS = {'add': 1, 'freq': 1, 'carriers': 5, 'list': 0}
+if len(sys.argv) < 3 or sys.argv[2] not in NR_ACTION_ARGS or len(sys.argv) < 3 + NR_ACTION_ARGS[sys.argv[2]]:
+  print "Usage: ", script_name, "<cohort_dir> add <[sample=]genotype_store|@store_list> [[sample=]genotype_store ..]"
+  print "       ", script_name, "<cohort_dir> freq <str_name>"
+  print "       ", script_name, "<cohort_dir> carriers <str_name> <snv_chr> <snv_pos> <snv_base> <str_allele>"
+  print "       ", script_name, "<cohort_dir> list"
+  print "  @store_list: file with one genotype store (.STRln_store.npz or .STR_SNV.store.npz) per line: sample<tab>file or file"
+  sys.exit(1)
+
+[cohort_dir, action] = sys.argv[1:3]
+if action != 'add' and not os.path.isfile(os.path.join(cohort_dir, 'cohort.json')):
+  print "Unable to open cohort: {0}".format(cohort_dir)
+  sys.exit(1)
+if not os.path.isdir(cohort_dir):
+  os.makedirs(cohort_dir)
+cohort = msi.open_cohort(cohort_dir)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def sample_store(store_value, sep):
+  # (sample, store file name) from sample<sep>store, or store (sample is store file base name)
+  if sep in store_value:
+    return tuple(store_value.split(sep, 1))
+  return (os.path.basename(store_value).split('.')[0], store_value)
+
+def sample_stores(store_args):
+  # Genotype stores grouped by sample, in order of first store of sample: [(sample, [store_fn, ..]), ..]
+  store_values = []
+  for arg in store_args:
+    if arg[0] == '@':
+      list_input = msi.open_file(arg[1:], 'r')
+      store_values += [sample_store(fn_line.strip(), '\t') for fn_line in list_input if fn_line.strip()]
+      list_input.close()
+    else:
+      store_values.append(sample_store(arg, '='))
+
+  samples = []; sample_idx = {}
+  for (sample, store_fn) in store_values:
+    if sample not in sample_idx:
+      sample_idx[sample] = len(samples)
+      samples.append((sample, []))
+    samples[sample_idx[sample]][1].append(store_fn)
+  return samples
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+start_time = time.time()
+
+#-----------------------------------------------------------------------------#
+# Add samples: counts/alleles of each sample are appended to cohort files     #
+#-----------------------------------------------------------------------------#
+if action == 'add':
+  samples = sample_stores(sys.argv[3:])
+  for store_fn in [store_fn for (sample, sample_fns) in samples for store_fn in sample_fns]:
+    if not os.path.isfile(store_fn):
+      print "Unable to open genotype store: {0}".format(store_fn)
+      sys.exit(1)
+  if cohort['info']['threshold_vals'] != msi.THRESHOLD_VALS:
+    print "THRESHOLD_VALS: {0} differ from cohort threshold_vals: {1}".format(msi.THRESHOLD_VALS, cohort['info']['threshold_vals'])
+    sys.exit(1)
+
+  print "\n**Running {0}, adding {1} samples to cohort: {2}".format(script_name, len(samples), cohort_dir)
+  msi.start_metrics(script_name)
+  msi.phase('add_samples')
+  for sample in [sample for (sample, sample_fns) in samples if sample in cohort['sample_idx']]:
+    print "{0}: already in cohort, skipped".format(sample)
+  add_samples = [(sample, sample_fns) for (sample, sample_fns) in samples if sample not in cohort['sample_idx']]
+  try:
+    add_cts = msi.cohort_add_samples(cohort, add_samples)
+  except ValueError as e:
+    print "*Error - {0}".format(' '.join(str(arg) for arg in e.args))
+    sys.exit(1)
+  for ((sample, sample_fns), sample_cts) in zip(add_samples, add_cts):
+    print "{0}: {1}".format(sample, ', '.join('{0} {1}'.format(rec_type, nr_recs) for (rec_type, nr_recs) in sorted(sample_cts.items())))
+  nr_added = len(add_samples)
+  msi.count('samples_added', nr_added)
+  msi.write_metrics(os.path.join(cohort_dir, 'cohort'))
+  print "Added {0} samples in {1:.1f}s, cohort samples: {2}, STRs: {3}, STR/SNV alleles: {4}".format(nr_added,
+          time.time() - start_time, len(cohort['info']['samples']), len(cohort['info']['strs']), len(cohort['info']['snv_keys']))
+
+#-----------------------------------------------------------------------------#
+# STR allele frequencies, and read counts by motif repeats summed over cohort #
+#-----------------------------------------------------------------------------#
+elif action == 'freq':
+  str_name = sys.argv[3]
+  [alleles, freqs, carriers, nr_samples] = msi.cohort_allele_freqs(cohort, str_name)
+  [rpts, counts] = msi.cohort_str_counts(cohort, str_name)
+  rpt_keys = ['{0:.5g}'.format(rpt) for rpt in rpts.tolist()]
+  rpt_rds = dict(zip(rpt_keys, counts.sum(axis=0).tolist()))
+  rpt_samples = dict(zip(rpt_keys, np.count_nonzero(counts, axis=0).tolist()))
+  print "{0}: {1} of {2} samples with alleles".format(str_name, nr_samples, len(cohort['info']['samples']))
+  print "Allele\tFreq\tCarriers\tReads\tSamplesWithReads"
+  for (str_allele, freq, nr_carriers) in zip(alleles.tolist(), freqs.tolist(), carriers.tolist()):
+    allele_key = '{0:.5g}'.format(str_allele)
+    print "{0}\t{1:.4f}\t{2}\t{3}\t{4}".format(allele_key, freq, nr_carriers, rpt_rds.get(allele_key, 0), rpt_samples.get(allele_key, 0))
+
+#-----------------------------------------------------------------------------#
+# Samples with STR/SNV haplotype                                              #
+#-----------------------------------------------------------------------------#
+elif action == 'carriers':
+  [str_name, snv_chr, snv_pos, snv_base, str_allele] = sys.argv[3:8]
+  haplo_samples = msi.cohort_haplotype_samples(cohort, str_name, snv_chr, snv_pos, snv_base, str_allele)
+  print "{0} {1}:{2} {3}, allele {4}: {5} of {6} samples".format(str_name, snv_chr, snv_pos, snv_base, str_allele,
+          len(haplo_samples), len(cohort['info']['samples']))
+  for sample in haplo_samples:
+    print sample
+
+else:
+  print "Sample\tSTRAlleles\tSTR_SNVAlleles"
+  for (sample, nr_str_alleles, nr_snv_alleles) in zip(cohort['info']['samples'], msi.cohort_sample_alleles(cohort, 'strln_alleles').tolist(),
+                                                     msi.cohort_sample_alleles(cohort, 'snv_alleles').tolist()):
+    print "{0}\t{1}\t{2}".format(sample, nr_str_alleles, nr_snv_alleles)
+  print "Samples: {0}, STRs: {1}, STR/SNV alleles: {2}".format(len(cohort['info']['samples']), len(cohort['info']['strs']),
+                                                               len(cohort['info']['snv_keys']))
@@ -5,6 +5,10 @@
 # Desc: Script summarizes STR genotypes/alleles into final output format
 #
 # 10/8/2015: Original version
+# 10/18/2026: Determine alleles for all STRs in one batch (msi.determine_alleles_batch)
+# 10/18/2026: Write stage metrics (phase timings, counters) with msi.start_metrics/write_metrics
+# 10/18/2026: Write genotype store (<base>.STRln_store.npz) for str_regenotype.py; final rows written by msi.write_strln_final
+# 10/18/2026: Optional store=<file> parameter, genotype store file name (eg named by sample, str_batch_genotype.py)
 
 import os, sys, csv, imp, pysam, numpy as np, pandas as pd, msi_str as msi
 
@@ -15,8 +19,9 @@ user_home   = os.path.expanduser("~")
 # Check for valid arguments, and that files exist                             #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 if len(sys.argv) < 3:
-  print "Usage: ", script_name, "<str_summary> <probe_rdcts> <str_info>"
+  print "Usage: ", script_name, "<str_summary> <probe_rdcts> <str_info> [store=<genotype_store>]"
   sys.exit(1)
+msi.start_metrics(script_name)
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Open/initialize output files and general variables                          #
@@ -25,11 +30,13 @@ csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='
 
 summ_input  = msi.open_file(sys.argv[1], 'r')
 rdct_input  = msi.open_file(sys.argv[2], 'r')
-str_input   = msi.open_file(sys.argv[3], 'r')
 final_fn    = sys.argv[1].replace('_summary', '_final', 1)
+store_fn    = final_fn.replace('_final.txt', '_store.npz')
+for arg in sys.argv[4:]:
+  if arg[0:6] == 'store=':
+    store_fn = arg[6:]
 rpt_output  = msi.open_file(final_fn, 'w')
 
-str_csv    = csv.DictReader(str_input, dialect='tab_delim')
 
 FLANK_SIZE = msi.FLANK_SIZE
 ALLELE2_MIN_PCT = msi.ALLELE2_MIN_PCT
@@ -46,7 +53,7 @@ print "STR file is: {0}, flank size is: {1}".format(sys.argv[3], FLANK_SIZE)
 # STR input example:
 #  STRName	Motif	MinRepeat	5PrEnd	5PrFlank		3PrStart	3PrFlank
 #  PIK3CA	A		5			6273772 GCTGAAGCAATCAGG	6273799		CTCGAAGTATGTTGC
-str_info   = msi.dict_from_csv(str_csv, 'str_info')
+str_info   = msi.dict_from_file(sys.argv[3], 'str_info')
 
 #-----------------------------------------------------------------------------#
 # Read STR read counts from input file                                        #
@@ -67,6 +74,7 @@ str_probe_cts = dfct_tots.to_dict(orient='dict')
 # STRName Strand	Motif	Min Rpts	Probe Rds	5pr Flank	3pr Flank		STR Len	Motif#	STR Rds
 #  AR		M		GA		3			4818	GCCTCAATGAACTGG	CAGCTTGTACACGTG	8		4		1964
 #  AR		P		GA		3			4199	GCCTCAATGAACTGG	CAGCTTGTACACGTG	8		4		2208
+msi.phase('groupby')
 df_summ    = pd.read_csv(summ_input,sep='\t',usecols=['STR Name', 'STR Len', 'Motif#', 'STR Rds'])
 df_summ.columns = ['str_name', 'str_len', 'motif_ct', 'str_rds']
 
@@ -84,22 +92,19 @@ summary_str = df_summary.to_dict()
 # Determine alleles, and write final output                                   #
 #-----------------------------------------------------------------------------#
 final_csv = csv.writer(rpt_output, dialect='tab_delim')
-final_csv.writerow(['STR Name', 'Motif', 'Min Rpts', 'Probe Rds', '5pr Flank', '3pr Flank', 'STR TotRds', 'Motif Ct', 'STR Rds', 'Allele(s)'])
-
-for str_name, svalues in sorted(summary_str.items()):
-  str_nm_info  = str_info[str_name]
-  
-  probe_rds = str_probe_cts['probe_reads'][str_name] if str_name in str_probe_cts['probe_reads'] else 0
-  motif_rds   = str_probe_cts['motif_reads'][str_name] if str_name in str_probe_cts['motif_reads'] else 0
-  full_str_rds = str_probe_cts['full_str_rds'][str_name] if str_name in str_probe_cts['full_str_rds'] else 0
-  
-  motif_cts = ', '.join("{0:.5g}".format(motif_rpts) for motif_rpts in svalues[0])
-  str_reads = ', '.join(str(str_rds) for str_rds in svalues[1])
-  [status, str_alleles] = msi.determine_alleles(svalues[1], svalues[0])
-  allele_string = ', '.join("{0:.5g}".format(float(str_allele)) for str_allele in str_alleles)
-  
-  final_csv.writerow([str_name, str_nm_info['str_motif'], str_nm_info['min_repeats'], probe_rds, str_nm_info['flanking_5pr'],  
-                       str_nm_info['flanking_3pr'], full_str_rds, motif_cts, str_reads, allele_string])
+
+msi.phase('call_alleles')
+summary_items  = sorted(summary_str.items())
+allele_results = msi.determine_alleles_batch([svalues[1] for (str_name, svalues) in summary_items],
+                                             [svalues[0] for (str_name, svalues) in summary_items])
+msi.count('strs', len(summary_items))
+
+msi.phase('write_outputs')
+msi.write_strln_final(final_csv, summary_items, allele_results, str_info, str_probe_cts)
+
+# Keep STR read counts by motif repeats (genotype store), for redetermining alleles (str_regenotype.py)
+msi.write_genotype_store(store_fn, 'STRln', summary_items, str_probe_cts)
 
 # Close output files
 rpt_output.close()
+msi.write_metrics(final_fn.rsplit('.', 2)[0])
@@ -3,19 +3,30 @@
 # File: str_flank_alleles.py
 # Name: Sue Grimes
 # Desc: Script outputs ref and alt alleles in STR flanking regions
+#       Input is either FreeBayes vcf (.vcf or .vcf.gz) and 5pr/3pr flank beds, or intersectBed output of vcf with
+#       flank beds (-names '5pr' '3pr' -wa -wb).  For vcf input, the vcf is read in chunks of VCF_CHUNK_ROWS records,
+#       and records are overlapped with a sorted interval index of the flank beds (from pool resource cache, if
+#       available), so that only records in flanks are parsed.  snp records (TYPE snp or snp,snp) are output
+#       to <input base>.flank_alleles.txt
 #
 # 10/6/2015: Original version
+# 10/18/2026: Read vcf and flank beds directly (numpy interval index), rather than intersectBed output
 
-import os, sys, csv, imp, msi_str as msi
+import os, sys, csv, imp, itertools, numpy as np, msi_str as msi
 
 script_name = os.path.basename(__file__)
 user_home   = os.path.expanduser("~")
 
+VCF_CHUNK_ROWS = 100000
+FLANK_ALLELE_HDGS = ['Chr', 'SNVPos', 'Ref', 'Alt', 'TYPE', 'GT', 'AF', 'STRName', '5or3pr', 'FlankStart', 'FlankEnd']
+
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Check for valid command line arguments                                      #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
-if len(sys.argv) < 2:
+vcf_input = len(sys.argv) > 1 and (sys.argv[1][-4:] == '.vcf' or sys.argv[1][-7:] == '.vcf.gz')
+if len(sys.argv) < 2 or (vcf_input and len(sys.argv) < 4):
   print "Usage: ", script_name, "<flank_variants_file>"
+  print "       ", script_name, "<vcf_file> <5prflank_bed> <3prflank_bed>"
   sys.exit(1)
 
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
@@ -24,25 +35,100 @@ if len(sys.argv) < 2:
 csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', escapechar='', quoting=csv.QUOTE_NONE)
 snv_outfn  = sys.argv[1].split(".")[0] + '.flank_alleles.txt'
 
-in_csv = csv.reader(msi.open_file(sys.argv[1],'r'), dialect='tab_delim')
-out_csv = csv.writer(msi.open_file(snv_outfn, 'w'), dialect='tab_delim')
+snv_output = msi.open_file(snv_outfn, 'w')
+out_csv = csv.writer(snv_output, dialect='tab_delim')
 
 print "\n**Running {0}".format(script_name)
 
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def info_value(info_parsed, name):
+  values = [fld[len(name)+1:] for fld in info_parsed if fld[0:len(name)+1] == name + '=']
+  return values[0] if values else ''
+
+def flank_index(flank_beds):
+  # Interval index of flank beds: arrays sorted by start, with start/end as chr_nr * 2^32 + position (so one sorted
+  #   array covers all chromosomes), and bed chr, start, end, name and 5pr/3pr label; plus {chr: chr_nr} and max flank length
+  chr_nrs = {}
+  [labels, chroms, names, chrs, starts, ends] = [[], [], [], [], [], []]
+  for (label, bed_fn) in flank_beds:
+    bed = msi.bed_arrays(bed_fn)
+    for chrom in bed['chr'].tolist():
+      chr_nrs.setdefault(chrom, len(chr_nrs))
+    chrs.append(np.array([chr_nrs[chrom] for chrom in bed['chr'].tolist()], dtype=np.int64))
+    [starts, ends] = [starts + [bed['start']], ends + [bed['end']]]
+    chroms.append(bed['chr'])
+    names.append(bed['name'])
+    labels.append(np.repeat(np.array([label], dtype=object), len(bed['start'])))
+
+  index = {'chr': np.concatenate(chroms), 'start': np.concatenate(starts), 'end': np.concatenate(ends),
+           'name': np.concatenate(names), 'label': np.concatenate(labels)}
+  chr_keys = np.concatenate(chrs) << 32
+  [index['key_start'], index['key_end']] = [chr_keys + index['start'], chr_keys + index['end']]
+  order = np.argsort(index['key_start'], kind='mergesort')
+  index = dict((col, col_values[order]) for (col, col_values) in index.items())
+  max_len = int((index['end'] - index['start']).max()) if len(order) > 0 else 0
+  return [index, chr_nrs, max_len]
+
+def flank_overlaps(index, max_len, rec_starts, rec_ends):
+  # (record idx, index idx) pairs for records (keys as index, 0-based [start, end)) overlapping flank intervals,
+  #   ordered by record, and flank label (5pr first) and start.  Candidate flanks start within max_len before record
+  lo = np.searchsorted(index['key_start'], rec_starts - max_len, side='right')
+  hi = np.searchsorted(index['key_start'], rec_ends, side='left')
+  nr_cands = np.maximum(hi - lo, 0)
+  rec_idx = np.repeat(np.arange(len(rec_starts)), nr_cands)
+  flank_idx = lo[rec_idx] + np.arange(nr_cands.sum()) - np.repeat(np.cumsum(nr_cands) - nr_cands, nr_cands)
+  overlap = index['key_end'][flank_idx] > rec_starts[rec_idx]
+  [rec_idx, flank_idx] = [rec_idx[overlap], flank_idx[overlap]]
+  order = np.lexsort((flank_idx, index['label'][flank_idx] != '5pr', rec_idx))
+  return zip(rec_idx[order].tolist(), flank_idx[order].tolist())
+
+def vcf_chunks(vcf_file):
+  # VCF records (lines, without header lines), in chunks of VCF_CHUNK_ROWS
+  vcf_lines = (line for line in vcf_file if line.strip() and line[0] != '#')
+  while True:
+    chunk = list(itertools.islice(vcf_lines, VCF_CHUNK_ROWS))
+    if len(chunk) == 0:
+      break
+    yield chunk
+
+def vcf_flank_rows(vcf_fn, flank_beds):
+  # intersectBed -wa -wb style rows (vcf columns, flank label, bed columns) for vcf records in flanks
+  [index, chr_nrs, max_len] = flank_index(flank_beds)
+  [vcf_file, zstd_proc] = msi.open_tsv(vcf_fn, 'r')
+  for chunk in vcf_chunks(vcf_file):
+    # CHROM, POS, ID, REF only, to overlap with flanks; other columns are split for records in flanks
+    rec_cols = [line.split('\t', 4) for line in chunk]
+    rec_chrs = np.array([chr_nrs.get(cols[0], -1) for cols in rec_cols], dtype=np.int64)
+    rec_pos = np.array([int(cols[1]) - 1 for cols in rec_cols], dtype=np.int64)
+    rec_lens = np.array([len(cols[3]) for cols in rec_cols], dtype=np.int64)
+    rec_starts = np.where(rec_chrs >= 0, (rec_chrs << 32) + rec_pos, -1 - max_len)
+    rec_ends = np.where(rec_chrs >= 0, rec_starts + rec_lens, rec_starts)
+    for (rec_idx, flank_idx) in flank_overlaps(index, max_len, rec_starts, rec_ends):
+      yield chunk[rec_idx].rstrip('\n').split('\t') + [index['label'][flank_idx], index['chr'][flank_idx],
+              str(index['start'][flank_idx]), str(index['end'][flank_idx]), index['name'][flank_idx]]
+  msi.close_tsv(vcf_file, zstd_proc)
+
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
 # Main program logic                                                          #
 #+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if vcf_input:
+  in_csv = vcf_flank_rows(sys.argv[1], [('5pr', sys.argv[2]), ('3pr', sys.argv[3])])
+else:
+  in_csv = csv.reader(msi.open_file(sys.argv[1],'r'), dialect='tab_delim')
+
 #-----------------------------------------------------------------------------#
 # Read STR flanking SNV information and write alternate flanking alleles      #
 #-----------------------------------------------------------------------------#
-out_csv.writerow(['Chr', 'SNVPos', 'Ref', 'Alt', 'TYPE', 'GT', 'AF', 'STRName', '5or3pr', 'FlankStart', 'FlankEnd'])
+out_csv.writerow(FLANK_ALLELE_HDGS)
 for srow in in_csv:
   gt_parsed = srow[9].split(':')
   info_parsed = srow[7].split(';')
-  var_type = [fld[5:] for fld in info_parsed if fld[0:5] == 'TYPE=']
-  
-  if var_type[0] in ['snp', 'snp,snp']:
-    genotype = gt_parsed[0]
-    allele_freq = [fld[3:] for fld in info_parsed if fld[0:3] == 'AF=']
-    out_csv.writerow([srow[0], srow[1], srow[3], srow[4], var_type[0], genotype, allele_freq[0], srow[14], srow[10], srow[12], srow[13]])
+  var_type = info_value(info_parsed, 'TYPE')
 
+  if var_type in ['snp', 'snp,snp']:
+    genotype = gt_parsed[0]
+    allele_freq = info_value(info_parsed, 'AF')
+    out_csv.writerow([srow[0], srow[1], srow[3], srow[4], var_type, genotype, allele_freq, srow[14], srow[10], srow[12], srow[13]])
+snv_output.close()
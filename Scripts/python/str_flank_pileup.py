@@ -0,0 +1,181 @@
+#!/usr/bin/python
+
+# File: str_flank_pileup.py
+# Desc: Script calls SNVs in STR flanking regions directly from R1 bam, and writes <R1 base>.flank_alleles.txt
+#       (as output by str_flank_alleles.py), replacing FreeBayes R1 calling and intersectBed of flank beds.
+#       Bases are counted (pysam count_coverage) only at flank positions in <pool>.5prflank.st.bed and
+#       <pool>.3prflank.st.bed (found next to str_info), with flanks close together read as one bam region.
+#       Reads are filtered as FreeBayes --standard-filters (min mapping quality 30, min base quality 20,
+#       no duplicate/secondary/QC fail reads).  A base other than the reference flank base is called if it has
+#       at least min_alt_frac of reads (and min_alt_reads), at positions with at least min_depth reads:
+#       genotype 1/1 (AF 1) if reference base is below 1 - hom_alt_frac of reads, otherwise 0/1 (AF 0.5),
+#       or 1/2 (AF 0.5,0.5) for two alt bases.  Flanks with more than max_flank_snvs calls (eg reads with shifted
+#       alignment past STR, called as mnp/complex by FreeBayes, and removed by str_flank_alleles.py) have no SNVs.
+#       Optional parameters (name=value): min_depth (10), min_alt_reads (3), min_alt_frac (0.2), hom_alt_frac (0.8),
+#         min_map_qual (30), min_base_qual (20), max_flank_snvs (2)
+#
+# 10/18/2026: Original version
+
+import os, sys, csv, time, pysam, numpy as np, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+PILEUP_PARAMS = {'min_depth': 10, 'min_alt_reads': 3, 'min_alt_frac': 0.2, 'hom_alt_frac': 0.8, 'min_map_qual': 30,
+                 'min_base_qual': 20, 'max_flank_snvs': 2}
+FLANK_ALLELE_HDGS = ['Chr', 'SNVPos', 'Ref', 'Alt', 'TYPE', 'GT', 'AF', 'STRName', '5or3pr', 'FlankStart', 'FlankEnd']
+PILEUP_BASES = 'ACGT'
+REGION_GAP = 500
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments, and that files exist                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 3:
+  print "Usage: ", script_name, "<str_info> <R1bam_file> [flank_alleles_file] [name=value ..]"
+  print "  flank_alleles_file defaults to <R1 base>.flank_alleles.txt"
+  print "  Optional parameters (defaults): {0}".format(', '.join('{0}={1}'.format(*param) for param in sorted(PILEUP_PARAMS.items())))
+  sys.exit(1)
+
+str_fn = sys.argv[1]
+sam_fn = sys.argv[2]
+params = dict(PILEUP_PARAMS)
+out_fns = []
+for arg in sys.argv[3:]:
+  if '=' in arg:
+    (name, value) = arg.split('=', 1)
+    if name not in params:
+      print "Invalid parameter: {0}, valid parameters are: {1}".format(name, sorted(params))
+      sys.exit(1)
+    params[name] = type(params[name])(value)
+  else:
+    out_fns.append(arg)
+fa_outfn = out_fns[0] if out_fns else sam_fn.split('.')[0] + '.flank_alleles.txt'
+
+if not os.path.isfile(sam_fn) or not os.access(sam_fn, os.R_OK):
+  print "Unable to open bam file for input: {0}".format(sam_fn)
+  sys.exit(1)
+sam_input = pysam.Samfile(sam_fn, 'rb', **msi.BAM_OPEN_ARGS)
+if not sam_input.has_index():
+  print "Bam file must be indexed: {0}".format(sam_fn)
+  sys.exit(1)
+
+pool_fns = msi.pool_files(str_fn)[1]
+missing_beds = [flank_type for flank_type in ['5prflank', '3prflank'] if flank_type not in pool_fns]
+if 'str_info' not in pool_fns or missing_beds:
+  print "Unable to find str_info and flank bed files ({0}) for pool of: {1}".format(', '.join(missing_beds), str_fn)
+  sys.exit(1)
+msi.start_metrics(script_name)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Open/initialize output files and general variables                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', escapechar='', quoting=csv.QUOTE_NONE)
+
+print "\n**Running {0}, with R1 bam: {1}, flank beds: {2}, {3}".format(script_name, sam_fn, pool_fns['5prflank'], pool_fns['3prflank'])
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def str_flanks(str_fn):
+  # Full length (unlike str_info dict, not cut to FLANK_SIZE) reference flanks, by STR name: {str_name: {'5pr': .., '3pr': ..}}
+  str_input = msi.open_file(str_fn, 'r')
+  flanks = dict((srow['STRName'], {'5pr': srow['5PrFlank'], '3pr': srow['3PrFlank']})
+                for srow in csv.DictReader(str_input, dialect='tab_delim'))
+  str_input.close()
+  return flanks
+
+def flank_intervals(flank_beds, flanks):
+  # Flank bed rows with reference flank sequence: [(chr, start, end, str_name, 5or3pr, ref_seq), ..]; flanks are
+  #   aligned to bed interval (5pr flank ends at bed end, 3pr flank starts at bed start)
+  intervals = []
+  for (pr5or3, bed_fn) in flank_beds:
+    bed_input = msi.open_file(bed_fn, 'r')
+    for bed_row in csv.reader(bed_input, dialect='tab_delim'):
+      if len(bed_row) < 4 or not bed_row[1].isdigit() or bed_row[3] not in flanks:
+        continue
+      (start, end) = (int(bed_row[1]), int(bed_row[2]))
+      flank = flanks[bed_row[3]][pr5or3]
+      ref_seq = flank[len(flank) - (end - start):] if pr5or3 == '5pr' else flank[:end - start]
+      intervals.append((bed_row[0], start, end, bed_row[3], pr5or3, ref_seq.rjust(end - start, 'N') if pr5or3 == '5pr' else ref_seq.ljust(end - start, 'N')))
+    bed_input.close()
+  return intervals
+
+def pileup_regions(intervals, ref_names):
+  # Group flank intervals (sorted by contig, in bam header order, and start) into bam regions, merging intervals less
+  #   than REGION_GAP apart: [(contig, start, end, [interval, ..]), ..]
+  ref_order = dict((ref_name, ref_nr) for (ref_nr, ref_name) in enumerate(ref_names))
+  regions = []
+  for interval in sorted([interval for interval in intervals if interval[0] in ref_order], key=lambda interval: (ref_order[interval[0]], interval[1])):
+    if regions and regions[-1][0] == interval[0] and interval[1] <= regions[-1][2] + REGION_GAP:
+      regions[-1][2] = max(regions[-1][2], interval[2])
+      regions[-1][3].append(interval)
+    else:
+      regions.append([interval[0], interval[1], interval[2], [interval]])
+  return regions
+
+def pass_filters(sam_row):
+  return sam_row.mapping_quality >= params['min_map_qual'] and not (sam_row.flag & 0x704)
+
+def call_snv(ref_base, base_cts):
+  # [alt bases, genotype, AF] for base counts (A,C,G,T) at flank position, or None if no alt base called
+  depth = base_cts.sum()
+  if depth < params['min_depth'] or ref_base not in PILEUP_BASES:
+    return None
+  alt_bases = [base for (base_idx, base) in sorted(enumerate(PILEUP_BASES), key=lambda item: -base_cts[item[0]])
+               if base != ref_base and base_cts[base_idx] >= max(params['min_alt_reads'], params['min_alt_frac'] * depth)][0:2]
+  if len(alt_bases) == 0:
+    return None
+  elif len(alt_bases) == 2:
+    return [','.join(alt_bases), '1/2', '0.5,0.5']
+  elif base_cts[PILEUP_BASES.index(ref_base)] < (1 - params['hom_alt_frac']) * depth:
+    return [alt_bases[0], '1/1', '1']
+  return [alt_bases[0], '0/1', '0.5']
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+start_time = time.time()
+intervals = flank_intervals([('5pr', pool_fns['5prflank']), ('3pr', pool_fns['3prflank'])], str_flanks(pool_fns['str_info']))
+regions = pileup_regions(intervals, sam_input.references)
+
+#-----------------------------------------------------------------------------#
+# Count bases at flank positions for each bam region, and call SNVs           #
+#-----------------------------------------------------------------------------#
+msi.phase('read_bam')
+flank_snvs = []
+nr_skipped = 0
+for (contig, start, end, region_intervals) in regions:
+  base_cts = np.array(sam_input.count_coverage(contig, start, end, quality_threshold=params['min_base_qual'],
+                                               read_callback=pass_filters), dtype=np.int64)
+  for (chrom, flank_start, flank_end, str_name, pr5or3, ref_seq) in region_intervals:
+    flank_calls = []
+    for flank_idx in range(flank_end - flank_start):
+      snv_call = call_snv(ref_seq[flank_idx], base_cts[:, flank_start - start + flank_idx])
+      if snv_call:
+        [alt_bases, genotype, allele_freq] = snv_call
+        flank_calls.append([chrom, flank_start + flank_idx + 1, ref_seq[flank_idx], alt_bases, 'snp' if genotype != '1/2' else 'snp,snp',
+                            genotype, allele_freq, str_name, pr5or3, flank_start, flank_end])
+    if len(flank_calls) > params['max_flank_snvs']:
+      msi.log('debug', "{0} {1} flank has {2} SNV calls, not used", str_name, pr5or3, len(flank_calls))
+      nr_skipped += 1
+    else:
+      flank_snvs += flank_calls
+msi.count('flank_regions', len(regions))
+msi.count('flank_positions', sum(interval[2] - interval[1] for interval in intervals))
+msi.count('flank_snvs', len(flank_snvs))
+msi.count('flanks_skipped', nr_skipped)
+
+#-----------------------------------------------------------------------------#
+# Write flank alleles, in position order (as FreeBayes/intersectBed)          #
+#-----------------------------------------------------------------------------#
+msi.phase('write_outputs')
+fa_output = msi.open_file(fa_outfn, 'w')
+fa_csv = csv.writer(fa_output, dialect='tab_delim')
+fa_csv.writerow(FLANK_ALLELE_HDGS)
+fa_csv.writerows(sorted(flank_snvs, key=lambda snv_row: (sam_input.gettid(snv_row[0]), snv_row[1])))
+fa_output.close()
+sam_input.close()
+
+print "Flank SNVs: {0}, at {1} flank positions in {2} bam regions, in {3:.1f}s".format(len(flank_snvs),
+        sum(interval[2] - interval[1] for interval in intervals), len(regions), time.time() - start_time)
+print "Flanks with more than {0} SNV calls (not used): {1}".format(params['max_flank_snvs'], nr_skipped)
+msi.write_metrics(fa_outfn.split('.')[0])
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+# File: str_manifest.py
+# Desc: Script checks/records pipeline stages in a per sample manifest (<base>.manifest.json, see msi_str.py
+#       Stage manifest), for strseq_genotype.sh, so that a rerun skips completed stages:
+#         check: exit status 0 if stage is complete (same parameters, inputs and outputs), otherwise 1
+#         start: remove stage from manifest, before it is run
+#         done:  record stage as complete, with input/output file stamps (size, mtime, md5)
+#         list:  print stages in manifest
+#       Input/output files are space separated lists (quoted); parameters are the command, env settings for
+#       python scripts run by the command (msi.MANIFEST_ENV) and any name=value parameters
+#
+# 10/18/2026: Original version
+
+import os, sys, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments                                                   #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 3 or sys.argv[2] not in ['check', 'start', 'done', 'list'] or (sys.argv[2] != 'list' and len(sys.argv) < 7):
+  print "Usage: ", script_name, "<manifest> check|start|done <stage> <input_files> <output_files> <command> [name=value ..]"
+  print "       ", script_name, "<manifest> list"
+  sys.exit(2)
+
+[manifest_fn, action] = sys.argv[1:3]
+manifest = msi.read_manifest(manifest_fn)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if action == 'list':
+  for (stage, stage_info) in sorted(manifest['stages'].items(), key=lambda item: item[1]['completed']):
+    print "{0}\t{1}\t{2}".format(stage, stage_info['completed'], ' '.join(sorted(stage_info['outputs'])))
+  sys.exit(0)
+
+[stage, input_fns, output_fns, command] = sys.argv[3:7]
+[input_fns, output_fns] = [input_fns.split(), output_fns.split()]
+params = msi.stage_params(command, dict(arg.split('=', 1) for arg in sys.argv[7:] if '=' in arg))
+
+if action == 'check':
+  if msi.stage_complete(manifest, stage, params, input_fns, output_fns):
+    print "Stage {0} is complete ({1}), skipping".format(stage, manifest_fn)
+    sys.exit(0)
+  sys.exit(1)
+elif action == 'start':
+  msi.start_stage(manifest_fn, manifest, stage)
+else:
+  missing_fns = [fn for fn in input_fns + output_fns if not os.path.isfile(fn)]
+  if missing_fns:
+    print "Stage {0} is not recorded as complete, missing files: {1}".format(stage, ' '.join(missing_fns))
+    sys.exit(1)
+  msi.record_stage(manifest_fn, manifest, stage, params, input_fns, output_fns)
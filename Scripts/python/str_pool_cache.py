@@ -0,0 +1,51 @@
+#!/usr/bin/python
+
+# File: str_pool_cache.py
+# Desc: Script compiles pool resource files (str_info, str_probes, 5'/3' flank beds, genomic noSTR beds) into
+#       <pool>.pool_cache.npz, in the resources directory.  Scripts then load str_info/probe_info dicts (and
+#       STR_REGION_FILE positions) from the cache.  The cache is only written by this script (scripts read the
+#       resource text files if the cache is missing or out of date, ie resource files changed); run it once for each
+#       pool after installing or changing resource files, or check which pools have a valid cache.
+#
+# 10/18/2026: Original version
+# 10/18/2026: Only this script writes the cache (no longer written by first script run for a pool)
+
+import os, sys, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments                                                   #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 2:
+  print "Usage: ", script_name, "<pool_resource_file|pool_prefix> [..] [check]"
+  print "  eg: ", script_name, "Resources/OS0035 Resources/OS0037.str_info.txt"
+  sys.exit(1)
+
+check_only = sys.argv[-1] == 'check'
+pool_args = sys.argv[1:-1] if check_only else sys.argv[1:]
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+nr_errors = 0
+for pool_arg in pool_args:
+  [cache_fn, files] = msi.pool_files(pool_arg)
+  if 'str_info' not in files or 'probe_info' not in files:
+    print "{0}: str_info/str_probes files not found for pool".format(pool_arg)
+    nr_errors += 1
+    continue
+
+  cache_valid = os.path.isfile(cache_fn) and msi.pool_cache_valid(msi.read_pool_cache(cache_fn)['info'], files)
+  if check_only:
+    print "{0}: {1}".format(cache_fn, 'valid' if cache_valid else 'missing or out of date')
+    nr_errors += 0 if cache_valid else 1
+    continue
+
+  if not cache_valid:
+    msi.compile_pool_cache(cache_fn, files)
+  pool_cache = msi.read_pool_cache(cache_fn)
+  print "{0}: {1}, {2} STRs, {3} probes, beds: {4}".format(cache_fn, 'up to date' if cache_valid else 'written',
+          pool_cache['info']['nr_str_info'], len(pool_cache['probes']['probe_nr']), ', '.join(sorted(pool_cache['beds'])))
+
+sys.exit(1 if nr_errors > 0 else 0)
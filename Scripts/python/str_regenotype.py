@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+# File: str_regenotype.py
+# Desc: Script redetermines STR alleles (STRln_final), STR/SNV alleles (STR_SNV.final) and haplotypes (haplotype_cts_major/all)
+#       from genotype stores written by str_ctlen_genotype.py (<base>.STRln_store.npz) and pstr_genotyping.py
+#       (<base>.STR_SNV.store.npz), with other allele thresholds, without rereading bams or summary files.
+#       All stores (eg for a cohort) are processed in one run; outputs are written to out_dir.
+#       Optional parameters (name=value): threshold_vals (THRESHOLD_VALS, comma separated, default from STR_THRESHOLD_VALS
+#         or 0.45,0.35,0.15,0.02), minor_base_min (MINOR_BASE_MIN, default from STR_MINOR_BASE_MIN or 0.15),
+#         out_dir (output directory, default regenotype), haplotypes (major,all (default), major, all or none)
+#
+# 10/18/2026: Original version
+# 10/18/2026: Haplotype counts run with msi.run_script (shared with str_batch_genotype.py)
+
+import os, sys, csv, time, numpy as np, msi_str as msi
+
+script_name = os.path.basename(__file__)
+user_home   = os.path.expanduser("~")
+
+REGENO_PARAMS = {'threshold_vals': ','.join(str(tval) for tval in msi.THRESHOLD_VALS), 'minor_base_min': msi.MINOR_BASE_MIN,
+                 'out_dir': 'regenotype', 'haplotypes': 'major,all'}
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments, and that files exist                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 3:
+  print "Usage: ", script_name, "<str_info> <genotype_store|@store_list> [genotype_store ..] [name=value ..]"
+  print "  @store_list: file with one genotype store (.STRln_store.npz or .STR_SNV.store.npz) file name per line"
+  print "  Optional parameters (defaults): {0}".format(', '.join('{0}={1}'.format(*param) for param in sorted(REGENO_PARAMS.items())))
+  sys.exit(1)
+
+params = dict(REGENO_PARAMS)
+store_fns = []
+for arg in sys.argv[2:]:
+  if '=' in arg:
+    (name, value) = arg.split('=', 1)
+    if name not in params:
+      print "Invalid parameter: {0}, valid parameters are: {1}".format(name, ', '.join(sorted(params)))
+      sys.exit(1)
+    params[name] = value
+  elif arg[0] == '@':
+    list_input = msi.open_file(arg[1:], 'r')
+    store_fns += [fn_line.strip() for fn_line in list_input if fn_line.strip()]
+    list_input.close()
+  else:
+    store_fns.append(arg)
+
+for store_fn in store_fns:
+  if not os.path.isfile(store_fn):
+    print "Unable to open genotype store: {0}".format(store_fn)
+    sys.exit(1)
+
+threshold_vals = [float(tval) for tval in str(params['threshold_vals']).split(',')]
+if len(threshold_vals) != 4:
+  print "threshold_vals must be 4 comma separated values (repeats < -1, -1, +1, > +1 from major allele): {0}".format(params['threshold_vals'])
+  sys.exit(1)
+haplo_modes = [mode for mode in params['haplotypes'].split(',') if mode in ['major', 'all']]
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Open/initialize output files and general variables                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', escapechar='', quoting=csv.QUOTE_NONE)
+
+# Allele thresholds are read from msi module globals by determine_alleles_batch/check_threshold, and
+#   MINOR_BASE_MIN by pstr_haplotype_cts.py (run in this process)
+msi.THRESHOLD_VALS = threshold_vals
+msi.MINOR_BASE_MIN = float(params['minor_base_min'])
+
+str_fn    = os.path.abspath(sys.argv[1])
+store_fns = [os.path.abspath(store_fn) for store_fn in store_fns]
+out_dir   = params['out_dir']
+if not os.path.isdir(out_dir):
+  os.makedirs(out_dir)
+
+print "\n**Running {0}, for {1} genotype stores, output directory: {2}".format(script_name, len(store_fns), out_dir)
+print "Parameters: THRESHOLD_VALS: {0}, MINOR_BASE_MIN: {1}".format(msi.THRESHOLD_VALS, msi.MINOR_BASE_MIN)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# General methods                                                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+def regenotype_store(store_fn):
+  # Redetermine alleles for genotype store, and write final file (STRln_final or STR_SNV.final) to out_dir
+  #   Returns [store type, final file name, number of STRs (or STR/SNV alleles)]
+  [store_info, summary_items, str_probe_cts] = msi.read_genotype_store(store_fn)
+  allele_results = msi.determine_alleles_batch([svalues[1] for (skey, svalues) in summary_items],
+                                               [svalues[0] for (skey, svalues) in summary_items])
+
+  store_base = os.path.basename(store_fn).split('.')[0]
+  if store_info['store_type'] == 'STRln':
+    final_fn = os.path.join(out_dir, store_base + '.STRln_final.txt')
+  else:
+    final_fn = os.path.join(out_dir, store_base + '.STR_SNV.final.txt')
+  final_output = msi.open_file(final_fn, 'w')
+  final_csv = csv.writer(final_output, dialect='tab_delim')
+  if store_info['store_type'] == 'STRln':
+    msi.write_strln_final(final_csv, summary_items, allele_results, str_info, str_probe_cts)
+  else:
+    msi.write_str_snv_final(final_csv, summary_items, allele_results, str_info, str_probe_cts)
+  final_output.close()
+  return [store_info['store_type'], final_fn, len(summary_items)]
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+msi.start_metrics(script_name)
+start_time = time.time()
+str_info = msi.dict_from_file(str_fn, 'str_info')
+
+#-----------------------------------------------------------------------------#
+# Redetermine alleles and write final files for each genotype store           #
+#-----------------------------------------------------------------------------#
+msi.phase('call_alleles')
+store_results = [regenotype_store(store_fn) for store_fn in store_fns]
+for [store_type, final_fn, nr_keys] in store_results:
+  print "{0}: {1} {2}".format(final_fn, nr_keys, 'STRs' if store_type == 'STRln' else 'STR/SNV alleles')
+  msi.count('strs' if store_type == 'STRln' else 'str_snv_alleles', nr_keys)
+msi.count('stores', len(store_fns))
+msi.write_metrics(os.path.join(out_dir, 'regenotype'))
+
+#-----------------------------------------------------------------------------#
+# Haplotypes for all STR_SNV.final files, in one run of pstr_haplotype_cts.py #
+#   per mode (bulk @file_list), in out_dir                                    #
+#-----------------------------------------------------------------------------#
+strsnv_fns = [os.path.abspath(final_fn) for [store_type, final_fn, nr_keys] in store_results if store_type == 'STR_SNV']
+if len(strsnv_fns) > 0 and len(haplo_modes) > 0:
+  list_fn = os.path.abspath(os.path.join(out_dir, 'regenotype.STR_SNV_finals.txt'))
+  list_output = msi.open_file(list_fn, 'w')
+  list_output.write(''.join(strsnv_fn + '\n' for strsnv_fn in strsnv_fns))
+  list_output.close()
+
+  cwd = os.getcwd()
+  os.chdir(out_dir)
+  for haplo_mode in haplo_modes:
+    exit_status = msi.run_script('pstr_haplotype_cts.py', ['@' + list_fn, haplo_mode])
+    if exit_status != 0:
+      print "*Error - pstr_haplotype_cts.py {0} failed, exit status: {1}".format(haplo_mode, exit_status)
+      sys.exit(1)
+  os.chdir(cwd)
+
+print "Regenotyped {0} genotype stores in {1:.1f}s".format(len(store_fns), time.time() - start_time)
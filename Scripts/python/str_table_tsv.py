@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+# File: str_table_tsv.py
+# Desc: Script writes binary table (.npz) or compressed (.txt.gz, .txt.zst) detail file (STRln_detail, SNV_detail),
+#       as tab-delimited text.  Writes all columns, or selected columns (comma separated list), to output file
+#       or stdout if not specified
+#
+# 10/18/2026: Original version
+# 10/18/2026: Read any detail file (msi.detail_rows), for compressed and slim (STR_DETAIL_LEVEL) detail files
+
+import os, sys, csv, msi_str as msi
+
+script_name = os.path.basename(__file__)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Check for valid arguments, and that files exist                             #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+if len(sys.argv) < 2:
+  print "Usage: ", script_name, "<detail_file (.npz, .txt, .txt.gz, .txt.zst)> [col1,col2,..|all] [output_file]"
+  sys.exit(1)
+
+dtl_fn = sys.argv[1]
+if not os.path.isfile(dtl_fn) or not os.access(dtl_fn, os.R_OK):
+  print "Unable to open detail file for input: {0}".format(dtl_fn)
+  sys.exit(1)
+
+hdgs = msi.detail_hdgs(dtl_fn)
+cols = hdgs
+if len(sys.argv) > 2 and sys.argv[2] != 'all':
+  cols = sys.argv[2].split(',')
+  invalid_cols = [col for col in cols if col not in hdgs]
+  if len(invalid_cols) > 0:
+    print "Invalid column(s): {0}, detail file columns are: {1}".format(invalid_cols, hdgs)
+    sys.exit(1)
+
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+# Main program logic                                                          #
+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#+#
+csv.register_dialect('tab_delim', delimiter='\t', doublequote=False, quotechar='', lineterminator='\n', escapechar='', quoting=csv.QUOTE_NONE)
+
+tsv_output = msi.open_file(sys.argv[3], 'w') if len(sys.argv) > 3 else sys.stdout
+tsv_csv = csv.writer(tsv_output, dialect='tab_delim')
+
+tsv_csv.writerow(cols)
+tsv_csv.writerows(msi.detail_rows(dtl_fn, cols))
+
+if tsv_output != sys.stdout:
+  tsv_output.close()
@@ -10,7 +10,6 @@ JAVA_EXE='/usr/bin/java'
 #   steps below, as needed
 GENOME_REF_DIR="${RESOURCE_DIR}/GenomeRef/Homo_sapiens"
 
-BEDTOOLS_DIR="${RESOURCE_DIR}/tools/bedtools2-2.25.0/bin"
 VCFTOOLS_DIR="${RESOURCE_DIR}/tools/vcftools_0.1.11/bin"
 VCFLIB_DIR="${RESOURCE_DIR}/tools/vcflib/bin"
 BAMUTIL_DIR="${RESOURCE_DIR}/tools/bamUtil_1.0.13/bamUtil/bin"
@@ -24,18 +23,23 @@ STR_SCRIPT_DIR="${STRSEQ_DIR}/Scripts/python"
 # Function to print help
 print_usage()
 {
-	   echo "Usage: $(basename "$0") -b {R1bam} -p {OSSeq_pool} [-r {rd_len} -k {flank_size} -v {snv_filter} ]";
+	   echo "Usage: $(basename "$0") -b {R1bam} -p {OSSeq_pool} [-r {rd_len} -k {flank_size} -v {snv_filter} -s {snv_coords} -f -n ]";
 	   echo "Where -b R1 bam file must be specified (and must have matching _R2)";
 	   echo "      -p pool file must be specified (eg OS0037)";
 	   echo "      -r read length, default = 150";
 	   echo "      -k flank size, default = 15";
 	   echo "      -v R2 snv filter [all|alt], default = alt";     
+	   echo "      -s R2 snv positions file (eg from 1000 Genomes), if specified R1/R2 are processed in a single pass";
+	   echo "         and R2 SNVs are not called using FreeBayes";
+	   echo "      -f fetch only bam reads near STRs (pool bed regions), rather than all reads";
+	   echo "      -n call R1 flank SNVs from base counts at flank positions (str_flank_pileup.py), rather than";
+	   echo "         FreeBayes";
 	   echo "      -d debug (do not delete intermediate files)";
 	   return
 }
 
 # set default parameters
-rdlen=""; flank=""; snvs="";
+rdlen=""; flank=""; snvs=""; snv_coords=""; fetch_regions="N"; flank_pileup="N";
 default_rdlen=150
 default_flank=15
 default_snvs='alt'
@@ -44,7 +48,7 @@ re_int='^[0-9]+$'
 
 # Parse command line options
 OPTIND=1
-while getopts "b:p:r:k:v:dh" OPT
+while getopts "b:p:r:k:v:s:fndh" OPT
 do
   case "$OPT" in
     b) r1bam="$OPTARG";;
@@ -52,6 +56,9 @@ do
     r) rdlen="$OPTARG";;
     k) flank="$OPTARG";;
     v) snvs="$OPTARG";;
+    s) snv_coords="$OPTARG";;
+    f) fetch_regions="Y";;
+    n) flank_pileup="Y";;
     d) clean="N";;
     h) print_usage; exit 1;;
    \?) print_usage; exit 1;;
@@ -100,6 +107,30 @@ r1base=${r1bam%%.*}
 r2base=${r2bam%%.*}
 
 export FLANK_SIZE=$flank 
+# Per read detail files (STRln_detail, SNV_detail) are binary tables (.npz) if STR_TABLE_FORMAT=bin,
+#   or compressed text (.txt.gz, .txt.zst) if STR_DETAIL_COMPRESS=gz or zstd
+dtl_ext='txt'
+if [ "$STR_DETAIL_COMPRESS" == "gz" ]; then
+  dtl_ext='txt.gz'
+elif [ "$STR_DETAIL_COMPRESS" == "zstd" ]; then
+  dtl_ext='txt.zst'
+fi
+if [ "$STR_TABLE_FORMAT" == "bin" ]; then
+  dtl_ext='npz'
+fi
+# STRln_detail is not written if STR_DETAIL_LEVEL=none; the two pass process needs it (R2 qnames, merge),
+#   so none is only valid for the single pass process (-s)
+r1_dtl_file="$r1base.STRln_detail.$dtl_ext"
+if [ "$STR_DETAIL_LEVEL" == "none" ]; then
+  if [ "$snv_coords" == "" ]; then
+    echo "STR_DETAIL_LEVEL=none requires R2 snv positions (-s); STRln_detail is needed to merge R1 STRs with R2 SNVs"
+    exit 1
+  fi
+  r1_dtl_file=""
+fi
+if [ "$fetch_regions" == "Y" ]; then
+  export STR_REGION_FILE=${STR_INFO_DIR}/${pool}_genomic_${rdlen}b.noSTR_plus5b.bed
+fi
 
 snvs='alt'
 haplo='major'
@@ -107,84 +138,144 @@ if [ "$snvs" == "all" ]; then
   haplo='all'
 fi 
 
+# Completed stages are recorded in $r1base.manifest.json (str_manifest.py), with parameters and input/output
+#   checksums; a rerun skips completed stages, and restarts from the first stage which is not complete
+manifest=$r1base.manifest.json
+ref_fasta=${GENOME_REF_DIR}/1KGenomes/build37/Sequence/BWAIndex/human_g1k_v37.fasta
+
+# run_stage <stage> "<input files>" "<output files>" "<command>": run command unless stage is complete in manifest,
+#   and exit if command fails
+run_stage()
+{
+  local stage=$1 inputs=$2 outputs=$3 cmd=$4
+  if python $STR_SCRIPT_DIR/str_manifest.py $manifest check $stage "$inputs" "$outputs" "$cmd"; then
+    return 0
+  fi
+  python $STR_SCRIPT_DIR/str_manifest.py $manifest start $stage "$inputs" "$outputs" "$cmd"
+  eval "$cmd"
+  local status=$?
+  if [ $status -ne 0 ]; then
+    echo "Stage $stage failed (exit status $status), rerun to continue from this stage"
+    exit 1
+  fi
+  python $STR_SCRIPT_DIR/str_manifest.py $manifest done $stage "$inputs" "$outputs" "$cmd" || exit 1
+}
+
+str_probes=$STR_INFO_DIR/${pool}.str_probes.txt
+str_info=$STR_INFO_DIR/${pool}.str_info.txt
+str_files="$r1base.STRln_summary.txt $r1base.STRln_probects.txt"
+
 echo "Running STR genotyping with bams: $r1bam, $r2bam"
-#R1: Call SNVs in R1 flanking regions
-${FREEBAYES_EXE} --pvar 0.05 --no-indels --standard-filters --min-coverage 0 \
-    --min-base-quality 20  --min-mapping-quality 30 \
-	--fasta-reference ${GENOME_REF_DIR}/1KGenomes/build37/Sequence/BWAIndex/human_g1k_v37.fasta \
-    --bam $r1bam --vcf $r1base.vcf
-
-#R1: Extract variants within STR flanking regions
-#    Remove any mnp or indel variants called by FreeBayes, and reformat output -> selected columns
-${BEDTOOLS_DIR}/intersectBed -a $r1base.vcf \
-    -b $STR_INFO_DIR/${pool}.5prflank.st.bed -b $STR_INFO_DIR/${pool}.3prflank.st.bed \
-    -names '5pr' '3pr' -wa -wb >$r1base.flank_snv.txt
-	
-python ${STR_SCRIPT_DIR}/str_flank_alleles.py $r1base.flank_snv.txt
+if [ "$flank_pileup" == "Y" ]; then
+  #R1: Call SNVs in R1 flanking regions from base counts at flank positions -> flank_alleles
+  run_stage flank_alleles "$r1bam $str_info $STR_INFO_DIR/${pool}.5prflank.st.bed $STR_INFO_DIR/${pool}.3prflank.st.bed" \
+      "$r1base.flank_alleles.txt" \
+    "python ${STR_SCRIPT_DIR}/str_flank_pileup.py $str_info $r1bam $r1base.flank_alleles.txt"
+else
+  #R1: Call SNVs in R1 flanking regions
+  run_stage r1_freebayes "$r1bam $ref_fasta" "$r1base.vcf" \
+    "${FREEBAYES_EXE} --pvar 0.05 --no-indels --standard-filters --min-coverage 0 \
+      --min-base-quality 20  --min-mapping-quality 30 \
+      --fasta-reference $ref_fasta \
+      --bam $r1bam --vcf $r1base.vcf"
+
+  #R1: Extract variants within STR flanking regions (vcf overlapped with flank beds)
+  #    Remove any mnp or indel variants called by FreeBayes, and reformat output -> selected columns
+  run_stage flank_alleles "$r1base.vcf $STR_INFO_DIR/${pool}.5prflank.st.bed $STR_INFO_DIR/${pool}.3prflank.st.bed" \
+      "$r1base.flank_alleles.txt" \
+    "python ${STR_SCRIPT_DIR}/str_flank_alleles.py $r1base.vcf \
+      $STR_INFO_DIR/${pool}.5prflank.st.bed $STR_INFO_DIR/${pool}.3prflank.st.bed"
+fi
 
+if [ "$snv_coords" != "" ]; then
+  #R1/R2 single pass: STR lengths from R1 and SNVs from R2 mates at known SNV positions, merged into STR_SNV detail/summary
+  run_stage fused_str_snv "$str_probes $str_info $r1base.flank_alleles.txt $r1bam $r2bam $snv_coords" \
+      "$str_files $r1_dtl_file $r1base.STR_SNV.summary.txt" \
+    "python $STR_SCRIPT_DIR/pstr_fused_str_snv.py $str_probes $str_info \
+      $r1base.flank_alleles.txt $r1bam $r2bam $snv_coords $snvs"
+
+  run_stage str_genotype "$str_files $str_info" "$r1base.STRln_final.txt" \
+    "python $STR_SCRIPT_DIR/str_ctlen_genotype.py $r1base.STRln_summary.txt $r1base.STRln_probects.txt $str_info"
+else
 #R1: Genotyping using length-based method
-python $STR_SCRIPT_DIR/str_lengths_R1ref.py $STR_INFO_DIR/${pool}.str_probes.txt $STR_INFO_DIR/${pool}.str_info.txt \
-    $r1base.flank_alleles.txt $r1bam
+run_stage r1_str "$str_probes $str_info $r1base.flank_alleles.txt $r1bam" "$str_files $r1_dtl_file" \
+  "python $STR_SCRIPT_DIR/str_lengths_R1ref.py $str_probes $str_info \
+    $r1base.flank_alleles.txt $r1bam"
 
-python $STR_SCRIPT_DIR/str_ctlen_genotype.py $r1base.STRln_summary.txt $r1base.STRln_probects.txt $STR_INFO_DIR/${pool}.str_info.txt
+run_stage str_genotype "$str_files $str_info" "$r1base.STRln_final.txt" \
+  "python $STR_SCRIPT_DIR/str_ctlen_genotype.py $r1base.STRln_summary.txt $r1base.STRln_probects.txt $str_info"
 
 #R2-SNV Phasing: Using qname, extract R2 mates for R1s which contain STR reads
-cut -f5 $r1base.STRln_detail.txt | sort > $r1base.qnames.tmp
+#  (qname column position depends on STR_DETAIL_LEVEL, so extracted by heading; pipefail, so that a failed
+#  str_table_tsv.py fails the stage, rather than leaving a partial qname list for Picard)
+run_stage r2_qnames "$r1_dtl_file" "$r1base.qnames.tmp" \
+  "(set -o pipefail; python $STR_SCRIPT_DIR/str_table_tsv.py $r1_dtl_file qname | sort > $r1base.qnames.tmp)"
 
-${JAVA_EXE} -jar ${PICARD_DIR}/FilterSamReads.jar INPUT=$r2bam TMP_DIR=$TMP_DIR VALIDATION_STRINGENCY=LENIENT \
+run_stage r2_filter "$r2bam $r1base.qnames.tmp" "$r2base.nfilter.bam" \
+  "${JAVA_EXE} -jar ${PICARD_DIR}/FilterSamReads.jar INPUT=$r2bam TMP_DIR=$TMP_DIR VALIDATION_STRINGENCY=LENIENT \
 	    FILTER=includeReadList READ_LIST_FILE=$r1base.qnames.tmp \
 	    SORT_ORDER=coordinate CREATE_INDEX=true WRITE_READS_FILES=false \
-		OUTPUT=$r2base.nfilter.bam
+		OUTPUT=$r2base.nfilter.bam"
 
 #R2-SNV Phasing: Mask synthetic DNA positions (40b R2 probes), and last R2 base
 #  Last base is prone to false positive variants
-${BAMUTIL_DIR}/bam trimBam $r2base.nfilter.bam $r2base.nfilter.trim.bam --left 40 --right 1
+run_stage r2_trim "$r2base.nfilter.bam" "$r2base.nfilter.trim.bam" \
+  "${BAMUTIL_DIR}/bam trimBam $r2base.nfilter.bam $r2base.nfilter.trim.bam --left 40 --right 1"
 
 #R2-SNV Phasing: Sort/index bam file
-${SAMTOOLS_EXE} sort $r2base.nfilter.trim.bam $r2base.nfilter.trim.st
-${SAMTOOLS_EXE} index $r2base.nfilter.trim.st.bam
+run_stage r2_sort "$r2base.nfilter.trim.bam" "$r2base.nfilter.trim.st.bam $r2base.nfilter.trim.st.bam.bai" \
+  "${SAMTOOLS_EXE} sort $r2base.nfilter.trim.bam $r2base.nfilter.trim.st && \
+   ${SAMTOOLS_EXE} index $r2base.nfilter.trim.st.bam"
 
 #R2-SNV Phasing: Call SNVs in R2
-${FREEBAYES_EXE} --pvar 0.05 --no-mnps --no-complex --min-coverage 3 \
+run_stage r2_freebayes "$r2base.nfilter.trim.st.bam $ref_fasta" "$r2base.nfilter.trim.st.vcf" \
+  "${FREEBAYES_EXE} --pvar 0.05 --no-mnps --no-complex --min-coverage 3 \
       --min-mapping-quality 25 --min-base-quality 15 --min-supporting-mapping-qsum 90 --min-supporting-allele-qsum 60 \
-	  --fasta-reference ${GENOME_REF_DIR}/1KGenomes/build37/Sequence/BWAIndex/human_g1k_v37.fasta \
-      --bam $r2base.nfilter.trim.st.bam  --vcf $r2base.nfilter.trim.st.vcf
+	  --fasta-reference $ref_fasta \
+      --bam $r2base.nfilter.trim.st.bam  --vcf $r2base.nfilter.trim.st.vcf"
 
 #R2-SNV Phasing: Extract R2 SNV positions which are in regions defined by bed file (around probe, but not in STR repeat)
 #  Additionally apply quality filter using vcffilter
-${VCFTOOLS_DIR}/vcftools --vcf $r2base.nfilter.trim.st.vcf \
+run_stage r2_vcf_filter "$r2base.nfilter.trim.st.vcf ${STR_INFO_DIR}/${pool}_genomic_${rdlen}b.noSTR_plus5b.bed" \
+    "$r2base.nfilter.trim.st.filter.vcf" \
+  "${VCFTOOLS_DIR}/vcftools --vcf $r2base.nfilter.trim.st.vcf \
     --bed ${STR_INFO_DIR}/${pool}_genomic_${rdlen}b.noSTR_plus5b.bed \
     --thin 6 --remove-filtered-all --remove-indels \
     --recode --recode-INFO-all \
-    --out $r2base.nfilter.trim.st.filter
-	
-${VCFLIB_DIR}/vcffilter -f "QUAL > 1 & QUAL / AO > 8" \
-    $r2base.nfilter.trim.st.filter.recode.vcf > $r2base.nfilter.trim.st.filter.vcf
-rm $r2base.nfilter.trim.st.filter.recode.vcf
+    --out $r2base.nfilter.trim.st.filter && \
+   ${VCFLIB_DIR}/vcffilter -f 'QUAL > 1 & QUAL / AO > 8' \
+    $r2base.nfilter.trim.st.filter.recode.vcf > $r2base.nfilter.trim.st.filter.vcf && \
+   rm $r2base.nfilter.trim.st.filter.recode.vcf"
 
 #R2-SNV Phasing: Extract pertinent vcf columns and reformat to text
-${VCFTOOLS_DIR}/vcftools --vcf $r2base.nfilter.trim.st.filter.vcf --get-INFO TYPE --get-INFO AF \
-	--out $r2base.nfilter.trim.st.filter.snv_coords
-mv $r2base.nfilter.trim.st.filter.snv_coords.INFO $r2base.nfilter.trim.st.filter.snv_coords.txt
+run_stage r2_snv_coords "$r2base.nfilter.trim.st.filter.vcf" "$r2base.nfilter.trim.st.filter.snv_coords.txt" \
+  "${VCFTOOLS_DIR}/vcftools --vcf $r2base.nfilter.trim.st.filter.vcf --get-INFO TYPE --get-INFO AF \
+	--out $r2base.nfilter.trim.st.filter.snv_coords && \
+   mv $r2base.nfilter.trim.st.filter.snv_coords.INFO $r2base.nfilter.trim.st.filter.snv_coords.txt"
 
 #R2-SNV Phasing: Extract R2 bam reads which cover an SNV position
-python $STR_SCRIPT_DIR/pstr_extract_R2snv.py $r2bam $r2base.nfilter.trim.st.filter.snv_coords.txt $snvs
+run_stage r2_snv "$r2bam $r2base.nfilter.trim.st.filter.snv_coords.txt" "$r2base.SNV_detail.$dtl_ext" \
+  "python $STR_SCRIPT_DIR/pstr_extract_R2snv.py $r2bam $r2base.nfilter.trim.st.filter.snv_coords.txt $snvs"
   
 #R2-SNV Phasing: Merge R1 STRs with R2 SNVs
-python $STR_SCRIPT_DIR/pstr_merge_str_snv.py $r1base.STRln_detail.txt $r2base.SNV_detail.txt 
+run_stage merge "$r1_dtl_file $r2base.SNV_detail.$dtl_ext" "$r1base.STR_SNV.summary.txt" \
+  "python $STR_SCRIPT_DIR/pstr_merge_str_snv.py $r1_dtl_file $r2base.SNV_detail.$dtl_ext"
   
+fi
+
 #R2-SNV Phasing: Genotyping
-python $STR_SCRIPT_DIR/pstr_genotyping.py $r1base.STR_SNV.summary.txt $STR_INFO_DIR/${pool}.str_info.txt \
-    $r1base.STRln_probects.txt 
+run_stage str_snv_genotype "$r1base.STR_SNV.summary.txt $str_info $r1base.STRln_probects.txt" "$r1base.STR_SNV.final.txt" \
+  "python $STR_SCRIPT_DIR/pstr_genotyping.py $r1base.STR_SNV.summary.txt $str_info \
+    $r1base.STRln_probects.txt"
 
 #Haplotype counts
-python $STR_SCRIPT_DIR/pstr_haplotype_cts.py $r1base.STR_SNV.final.txt $haplo
+run_stage haplotypes_$haplo "$r1base.STR_SNV.final.txt" "$r1base.haplotype_cts_$haplo.txt" \
+  "python $STR_SCRIPT_DIR/pstr_haplotype_cts.py $r1base.STR_SNV.final.txt $haplo"
 
 #Cleanup
 if [ "clean" == "Y" ]; then
-  rm -f $r1base.flank_snv.txt
   rm -f *.nfilter*.bam
-  rm -f *.SNV_detail.txt
+  rm -f *.SNV_detail.txt* *.SNV_detail.npz
   rm -f *nfilter.trim*.bam
   rm -f *nfilter*.bai
   rm -f *.tmp